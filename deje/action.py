@@ -17,12 +17,14 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 
 from ejtp.util.hasher import checksum
 from ejtp.identity import Identity
+from deje import metrics
 
 class Action(object):
     def __init__(self, items={}, cache = None):
         self.deserialize(items, cache)
 
     def deserialize(self, items, cache = None):
+        self._hash = None
         self.overflow = dict(items)
         self.atype  = self.overflow.pop('type')
         self.author = self.overflow.pop('author')
@@ -74,8 +76,14 @@ class Action(object):
     def hash(self):
         '''
         Less important role in new value-passing quorum scheme.
+
+        Computed once, since it's asked for at every step of an action's
+        life, and actions don't change after they're built.
         '''
-        return checksum(self.serialize())
+        if self._hash is None:
+            with metrics.timer('deje_action_hash_seconds'):
+                self._hash = checksum(self.serialize())
+        return self._hash
 
     def valid(self, doc):
         if self.quorum_threshold_type == 'write':
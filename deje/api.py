@@ -16,9 +16,11 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from persei import *
+from deje.lua import TABLE_CLASS
 
 exported_functions = (
     'get_resource',
+    'list_resources',
     'get_ident',
     'clone_table',
     'event',
@@ -36,11 +38,28 @@ class API(object):
     def __init__(self, interpreter):
         self.interpreter = interpreter
         self.queue = []
+        self.held  = None # Side effects held back while speculating
 
     @property
     def document(self):
         return self.interpreter.document
 
+    @property
+    def source(self):
+        '''
+        Where handler reads go. For the document's current state, that's
+        the document, which reads under its lock. Any other state the
+        handler is in (a copy being imported into, an older version being
+        rebuilt) is read directly, so each event sees what the ones before
+        it did.
+        '''
+        state = self.interpreter.resource.state
+        if state is None:
+            return None
+        if state.doc is None or state is not state.doc._current:
+            return state
+        return state.doc
+
     def process_queue(self):
         while self.queue:
             self.queue.pop()()
@@ -48,31 +67,52 @@ class API(object):
     # Exported functions
 
     def get_resource(self, path):
-        if self.document:
-            return self.document.get_resource(path)
+        source = self.source
+        if source is not None:
+            resource = source.get_resource(path)
         elif path == self.interpreter.resource.path:
-            return self.interpreter.resource
+            resource = self.interpreter.resource
         else:
             raise KeyError("Resource could not be found by DEJE API")
+        return self.interpreter.resource_table(resource)
+
+    def list_resources(self, prefix='/'):
+        source = self.source
+        if source is not None:
+            paths = source.list_resources(prefix)
+        else:
+            path  = self.interpreter.resource.path
+            paths = [path] if path.startswith(prefix) else []
+        return self.interpreter.runtime.to_lua(paths)
 
     def get_ident(self):
         ident = self.document.identity
         return ident.name
 
     def clone_table(self, source, dest):
-        if isinstance(source, list):
+        if isinstance(source, TABLE_CLASS):
+            return self.interpreter.runtime.copy_table(source, dest)
+        elif isinstance(source, list):
+            # Lua sequences start at 1
             for i in range(len(source)):
-                dest[i] = source[i]
+                dest[i + 1] = source[i]
         else:
             for key in source:
                 dest[key] = source[key]
         return dest
 
     def event(self, ev):
-        self.queue.append(lambda: self.document.event(ev))
+        effect = lambda: self.document.event(ev)
+        if self.held is not None:
+            self.held.append(effect)
+        else:
+            self.queue.append(effect)
 
     def debug(self, *args):
-        self.document.debug(args)
+        if self.held is not None:
+            self.held.append(lambda: self.document.debug(args))
+        else:
+            self.document.debug(args)
 
     # set_resource
 
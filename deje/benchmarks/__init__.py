@@ -0,0 +1,137 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import itertools
+import json
+import sys
+from timeit import default_timer
+
+benchmarks = []
+
+class Benchmark(object):
+    def __init__(self, func, params):
+        self.func   = func
+        self.name   = func.__name__
+        self.params = params
+
+    def cases(self):
+        names = sorted(self.params.keys())
+        for values in itertools.product(*[self.params[n] for n in names]):
+            yield dict(zip(names, values))
+
+    def case_name(self, case):
+        if not case:
+            return self.name
+        return "%s[%s]" % (self.name, ",".join(
+            "%s=%s" % (k, case[k]) for k in sorted(case.keys())
+        ))
+
+def benchmark(**params):
+    '''
+    Register a scenario function, parametrized by lists of values.
+
+    Every combination of parameters is run as its own case. The scenario
+    function does its setup, and returns a zero-argument callable, which is
+    what gets timed. Run them all with:
+
+        python -m deje.benchmarks --output results.json
+
+    And check for regressions against earlier results with:
+
+        python -m deje.benchmarks --baseline results.json
+    '''
+    def decorator(func):
+        benchmarks.append(Benchmark(func, params))
+        return func
+    return decorator
+
+def measure(run, repeat=5, min_time=0.05):
+    '''
+    Time a callable. The number of calls per sample is scaled up until a
+    sample takes at least min_time seconds. Returns seconds per call.
+    '''
+    number = 1
+    while True:
+        started = default_timer()
+        for _ in range(number):
+            run()
+        elapsed = default_timer() - started
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = default_timer()
+        for _ in range(number):
+            run()
+        samples.append((default_timer() - started) / number)
+    samples.sort()
+    return {
+        'best'   : samples[0],
+        'median' : samples[len(samples) // 2],
+        'number' : number,
+        'repeat' : repeat,
+    }
+
+def run_all(names=None, repeat=5, min_time=0.05, report=None):
+    '''
+    Run registered benchmarks, optionally only those whose names are given.
+    '''
+    from deje.benchmarks import scenarios
+
+    results = {}
+    for bench in benchmarks:
+        if names and bench.name not in names:
+            continue
+        for case in bench.cases():
+            key    = bench.case_name(case)
+            result = measure(bench.func(**case), repeat, min_time)
+            result['params'] = case
+            results[key] = result
+            if report:
+                report(key, result)
+    return {
+        'python'  : sys.version.split()[0],
+        'results' : results,
+    }
+
+def compare(results, baseline, threshold=0.1):
+    '''
+    Returns a list of (case, old, new) for every case that got slower than
+    baseline by more than threshold (as a fraction).
+    '''
+    regressions = []
+    old_results = baseline['results']
+    for key, result in sorted(results['results'].items()):
+        if key not in old_results:
+            continue
+        old = old_results[key]['best']
+        new = result['best']
+        if new > old * (1 + threshold):
+            regressions.append((key, old, new))
+    return regressions
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def save(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
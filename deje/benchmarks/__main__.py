@@ -0,0 +1,71 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+
+from deje import benchmarks
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m deje.benchmarks',
+        description='Benchmark the DEJE core hot paths.'
+    )
+    parser.add_argument('names', nargs='*',
+        help='Only run these scenarios')
+    parser.add_argument('-o', '--output',
+        help='Save results as JSON to this file')
+    parser.add_argument('-b', '--baseline',
+        help='Compare against results saved earlier')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+        help='Slowdown that counts as a regression (default 0.1 = 10%%)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help='Samples per case (default 5)')
+    parser.add_argument('--min-time', type=float, default=0.05,
+        help='Minimum seconds per sample (default 0.05)')
+    args = parser.parse_args(argv)
+
+    def report(key, result):
+        print("%-60s %12.3f us" % (key, result['best'] * 1e6))
+
+    results = benchmarks.run_all(
+        args.names,
+        args.repeat,
+        args.min_time,
+        report
+    )
+    if args.output:
+        benchmarks.save(results, args.output)
+
+    if args.baseline:
+        regressions = benchmarks.compare(
+            results,
+            benchmarks.load(args.baseline),
+            args.threshold
+        )
+        for key, old, new in regressions:
+            print("REGRESSION %s: %.3f us -> %.3f us (%+.1f%%)" % (
+                key, old * 1e6, new * 1e6, (new / old - 1) * 100
+            ))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
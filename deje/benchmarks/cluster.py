@@ -0,0 +1,498 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import heapq
+import itertools
+import json
+import random
+import sys
+from timeit import default_timer
+
+from Crypto.PublicKey import RSA
+
+from ejtp import frame
+from ejtp.identity.core import Identity
+from ejtp.router import Router
+
+from deje.document import Document
+from deje.owner    import Owner
+from deje.resource import Resource
+
+def percentiles(samples, points=(50, 90, 99)):
+    '''
+    Nearest-rank percentiles of a list of numbers, plus the maximum.
+    '''
+    result = {}
+    if not samples:
+        return result
+    ordered = sorted(samples)
+    for point in points:
+        rank = max(0, int(round(point / 100.0 * len(ordered))) - 1)
+        result['p%d' % point] = ordered[rank]
+    result['max'] = ordered[-1]
+    return result
+
+class SimulatedNetwork(Router):
+    '''
+    In-memory EJTP router with a virtual clock.
+
+    Frames are not delivered when they are sent. Instead they are queued,
+    and delivered by run() after a simulated delay:
+
+        latency + uniform(-jitter, jitter) + size / bandwidth
+
+    A fraction 'loss' of frames is dropped entirely. Bandwidth (in bytes
+    per second) is modeled per receiving node, so a node flooded with
+    frames sees them arrive back to back.
+
+    Every node also processes one thing at a time. With charge_cpu, the
+    real time a node spends handling a frame is added to the clock, and
+    anything else for that node waits until it's done.
+    '''
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, bandwidth=None,
+            seed=None, charge_cpu=True):
+        Router.__init__(self)
+        self.latency    = latency
+        self.jitter     = jitter
+        self.loss       = loss
+        self.bandwidth  = bandwidth
+        self.charge_cpu = charge_cpu
+        self.random     = random.Random(seed)
+
+        self.frames  = 0
+        self.bytes   = 0
+        self.dropped = 0
+
+        self._queue   = []
+        self._order   = itertools.count()
+        self._clock   = 0.0
+        self._started = None
+        self._link_busy = {}
+        self._node_busy = {}
+
+    @property
+    def now(self):
+        '''
+        Current simulated time, in seconds.
+        '''
+        if self._started is None:
+            return self._clock
+        return self._clock + (default_timer() - self._started)
+
+    def schedule(self, when, node, func, *args):
+        '''
+        Run func(*args) at simulated time 'when', as work done by the node
+        at address 'node' (or by nobody in particular, if node is None).
+        '''
+        heapq.heappush(self._queue, (when, next(self._order), node, func, args))
+
+    def recv(self, msg):
+        if not isinstance(msg, frame.base.BaseFrame):
+            try:
+                msg = frame.createFrame(msg)
+            except Exception:
+                return Router.recv(self, msg) # Let Router log it
+        if not isinstance(msg, frame.address.ReceiverCategory) \
+                or not self.client(msg.address):
+            return Router.recv(self, msg)
+
+        size = len(msg.content)
+        self.frames += 1
+        self.bytes  += size
+        if self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        node = tuple(msg.address[:3])
+        now  = self.now
+        if self.bandwidth:
+            start = max(now, self._link_busy.get(node, 0.0))
+            now = start + size / float(self.bandwidth)
+            self._link_busy[node] = now
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        self.schedule(now + max(0.0, delay), node, Router.recv, self, msg)
+
+    def step(self):
+        '''
+        Run the next queued item. Returns False if there was none.
+        '''
+        if not self._queue:
+            return False
+        when, order, node, func, args = heapq.heappop(self._queue)
+        if node is not None:
+            busy = self._node_busy.get(node, 0.0)
+            if busy > when:
+                # Node is still working on something else
+                heapq.heappush(self._queue, (busy, order, node, func, args))
+                return True
+
+        self._clock = max(self._clock, when)
+        if self.charge_cpu:
+            self._started = default_timer()
+        try:
+            func(*args)
+        finally:
+            finished = self.now
+            self._started = None
+        if node is not None:
+            self._node_busy[node] = finished
+        return True
+
+    def simulate(self, until=None):
+        '''
+        Run queued items in order of simulated time, until the queue is
+        empty or the next item is later than 'until'. Returns the clock.
+        '''
+        while self._queue:
+            if until is not None and self._queue[0][0] > until:
+                break
+            self.step()
+        return self._clock
+
+_keys = {}
+
+def node_identity(name):
+    '''
+    RSA identity for a simulated node. Keys are generated once per name
+    and reused for the life of the process.
+    '''
+    if name not in _keys:
+        key = RSA.generate(1024)
+        _keys[name] = key.exportKey().decode('ascii')
+    return Identity(
+        "%s@cluster" % name,
+        ['rsa', _keys[name]],
+        ['local', None, name]
+    )
+
+def cluster_handler(participants, readers, threshold):
+    '''
+    Handler resource for a simulated document. Every participant can
+    write, and any 'threshold' of them form a quorum.
+    '''
+    return Resource(
+        '/handler',
+        {
+            'participants' : participants,
+            'readers'      : readers,
+
+            'event_test': '''
+                return true
+            ''',
+
+            'on_event_achieve': '''
+                set_resource(ev.path, ev.property, ev.value)
+            ''',
+
+            'quorum_participants': '''
+                raw = deje.get_resource('/handler').content.participants
+                return deje.clone_table(raw, {})
+            ''',
+
+            'quorum_thresholds': '''
+                return {read=%d, write=%d}
+            ''' % (threshold, threshold),
+
+            'can_read': '''
+                raw = deje.get_resource('/handler').content.readers
+                for i, v in pairs(deje.clone_table(raw, {})) do
+                    if v == name then
+                        return true
+                    end
+                end
+                return false
+            ''',
+
+            'can_write': '''
+                raw = deje.get_resource('/handler').content.participants
+                for i, v in pairs(deje.clone_table(raw, {})) do
+                    if v == name then
+                        return true
+                    end
+                end
+                return false
+            ''',
+        },
+        'Simulated cluster handler',
+        'direct/json'
+    )
+
+class Cluster(object):
+    '''
+    A set of Owners sharing one SimulatedNetwork, each with its own copy of
+    the same document. The first 'participants' nodes form the quorum, the
+    rest are observers that can only read and subscribe.
+    '''
+    def __init__(self, participants=3, observers=0, threshold=None,
+            network=None, docname='cluster'):
+        if participants < 1:
+            raise ValueError("A cluster needs at least one participant")
+        if threshold is None:
+            threshold = participants // 2 + 1
+        self.network = network or SimulatedNetwork()
+        self.docname = docname
+        self.message_types = {}
+
+        self.nodes = [
+            Owner(node_identity('node%d' % i), self.network)
+            for i in range(participants + observers)
+        ]
+        self.participants = self.nodes[:participants]
+        self.observers    = self.nodes[participants:]
+        self.nodes[0].identities.sync(
+            *[node.identities for node in self.nodes[1:]]
+        )
+
+        writers = [node.identity.name for node in self.participants]
+        readers = [node.identity.name for node in self.nodes]
+        for node in self.nodes:
+            doc = Document(docname)
+            doc.add_resource(cluster_handler(writers, readers, threshold), False)
+            doc.freeze()
+            node.own_document(doc)
+            self._count_messages(node)
+
+    def _count_messages(self, owner):
+        def on_ejtp(msg, client):
+            content = msg.unpack()
+            if isinstance(content, dict):
+                mtype = str(content.get('type'))
+                self.message_types[mtype] = self.message_types.get(mtype, 0) + 1
+            owner.on_ejtp(msg, client)
+        owner.client.rcv_callback = on_ejtp
+
+    def document(self, node):
+        return node.documents[self.docname]
+
+    def address(self, node):
+        return tuple(node.identity.location)
+
+class Workload(object):
+    '''
+    Random mix of writes and reads against a Cluster.
+
+    Operations arrive as a Poisson process at 'rate' per simulated second.
+    Writes are proposed by a random participant, reads (deje.get_version)
+    come from any node. With subscribe, every observer subscribes to every
+    participant before the first operation.
+    '''
+    def __init__(self, writes=100, reads=0, rate=100.0, keys=10,
+            subscribe=True, seed=None):
+        self.writes    = writes
+        self.reads     = reads
+        self.rate      = rate
+        self.keys      = keys
+        self.subscribe = subscribe
+        self.random    = random.Random(seed)
+
+    def run(self, cluster, timeout=60.0):
+        '''
+        Run the workload to completion (or until 'timeout' simulated
+        seconds after the last operation), and return a report.
+        '''
+        network = cluster.network
+        stats = {
+            'issued'        : {},
+            'enacted'       : {},
+            'commits'       : [],
+            'rejected'      : 0,
+            'reads'         : [],
+            'subscriptions' : 0,
+        }
+        receivers = [] # Keep signal receivers alive
+        for node in cluster.nodes:
+            receiver = self._on_enact(cluster, node, stats)
+            receivers.append(receiver)
+            cluster.document(node).signals['enact-event'].connect(receiver)
+
+        if self.subscribe:
+            sources = [node.identity for node in cluster.participants]
+            for node in cluster.observers:
+                network.schedule(network.now, cluster.address(node),
+                    self._subscribe, cluster, node, sources, stats)
+
+        ops = ['write'] * self.writes + ['read'] * self.reads
+        self.random.shuffle(ops)
+        when = network.now
+        for i, op in enumerate(ops):
+            when += self.random.expovariate(self.rate)
+            if op == 'write':
+                node = self.random.choice(cluster.participants)
+                func = self._write
+            else:
+                node = self.random.choice(cluster.nodes)
+                func = self._read
+            network.schedule(when, cluster.address(node),
+                func, cluster, node, i, stats)
+
+        started_wall = default_timer()
+        started = network.now
+        network.simulate(when + timeout)
+        wall = default_timer() - started_wall
+        return self.report(cluster, stats, started, wall)
+
+    def _on_enact(self, cluster, node, stats):
+        def receiver(sender, **kwargs):
+            key = sender.hash()
+            now = cluster.network.now
+            stats['enacted'].setdefault(key, []).append(now)
+            issued = stats['issued'].get(key)
+            if issued and issued[1] is node:
+                stats['commits'].append((issued[0], now))
+        return receiver
+
+    def _subscribe(self, cluster, node, sources, stats):
+        def done(subscription):
+            stats['subscriptions'] += 1
+        cluster.document(node).subscribe(done, sources)
+
+    def _write(self, cluster, node, i, stats):
+        started = cluster.network.now
+        try:
+            event = cluster.document(node).event({
+                'path'     : '/sim/%d' % (i % self.keys),
+                'property' : 'content',
+                'value'    : i,
+            })
+        except ValueError:
+            stats['rejected'] += 1
+            return
+        stats['issued'][event.hash()] = (started, node)
+
+    def _read(self, cluster, node, i, stats):
+        started = cluster.network.now
+        def done(version):
+            stats['reads'].append(cluster.network.now - started)
+        cluster.document(node).get_version(done)
+
+    def report(self, cluster, stats, started, wall):
+        network   = cluster.network
+        committed = len(stats['commits'])
+        finished  = max([c[1] for c in stats['commits']] or [started])
+        duration  = finished - started
+
+        replication = []
+        for key, (issued, node) in stats['issued'].items():
+            enacted = stats['enacted'].get(key)
+            if enacted:
+                replication.append(max(enacted) - issued)
+
+        return {
+            'participants'  : len(cluster.participants),
+            'observers'     : len(cluster.observers),
+            'subscriptions' : stats['subscriptions'],
+            'writes' : {
+                'issued'    : len(stats['issued']) + stats['rejected'],
+                'committed' : committed,
+                'rejected'  : stats['rejected'],
+            },
+            'reads' : {
+                'issued'    : self.reads,
+                'completed' : len(stats['reads']),
+            },
+            'duration'   : duration,
+            'wall'       : wall,
+            'throughput' : duration and committed / duration or 0.0,
+            'commit_latency'      : percentiles([c[1] - c[0] for c in stats['commits']]),
+            'replication_latency' : percentiles(replication),
+            'read_latency'        : percentiles(stats['reads']),
+            'messages' : {
+                'frames'    : network.frames,
+                'bytes'     : network.bytes,
+                'dropped'   : network.dropped,
+                'per_event' : committed and network.frames / float(committed) or 0.0,
+                'by_type'   : dict(cluster.message_types),
+            },
+        }
+
+def print_report(report):
+    def latency(name, values):
+        if not values:
+            return
+        print("%-20s %s" % (name, "  ".join(
+            "%s %.1f ms" % (k, values[k] * 1e3)
+            for k in ('p50', 'p90', 'p99', 'max')
+        )))
+
+    print("participants %d, observers %d, subscriptions %d" % (
+        report['participants'], report['observers'], report['subscriptions']))
+    print("writes: %(issued)d issued, %(committed)d committed, %(rejected)d rejected"
+        % report['writes'])
+    print("reads: %(issued)d issued, %(completed)d completed" % report['reads'])
+    print("throughput: %.1f events/s over %.3f simulated s (%.3f s wall)" % (
+        report['throughput'], report['duration'], report['wall']))
+    latency("commit latency", report['commit_latency'])
+    latency("replication latency", report['replication_latency'])
+    latency("read latency", report['read_latency'])
+    messages = report['messages']
+    print("messages: %d frames, %.1f per event, %d bytes, %d dropped" % (
+        messages['frames'], messages['per_event'],
+        messages['bytes'], messages['dropped']))
+    for mtype, count in sorted(messages['by_type'].items()):
+        print("  %-40s %d" % (mtype, count))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m deje.benchmarks.cluster',
+        description='Simulate a DEJE cluster on an in-memory network.'
+    )
+    parser.add_argument('-p', '--participants', type=int, default=3,
+        help='Quorum participants (default 3)')
+    parser.add_argument('--observers', type=int, default=0,
+        help='Read-only subscriber nodes (default 0)')
+    parser.add_argument('--threshold', type=int,
+        help='Signatures per quorum (default: majority)')
+    parser.add_argument('-w', '--writes', type=int, default=100,
+        help='Events to propose (default 100)')
+    parser.add_argument('--reads', type=int, default=0,
+        help='Version reads to request (default 0)')
+    parser.add_argument('--rate', type=float, default=100.0,
+        help='Operations per simulated second (default 100)')
+    parser.add_argument('--latency', type=float, default=0.01,
+        help='One-way latency in seconds (default 0.01)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help='Latency jitter in seconds (default 0)')
+    parser.add_argument('--loss', type=float, default=0.0,
+        help='Fraction of frames dropped (default 0)')
+    parser.add_argument('--bandwidth', type=float,
+        help='Inbound bytes per second per node (default unlimited)')
+    parser.add_argument('--seed', type=int,
+        help='Random seed, for repeatable runs')
+    parser.add_argument('-o', '--output',
+        help='Save the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    network = SimulatedNetwork(
+        args.latency, args.jitter, args.loss, args.bandwidth, args.seed
+    )
+    cluster = Cluster(args.participants, args.observers, args.threshold, network)
+    workload = Workload(args.writes, args.reads, args.rate, seed=args.seed)
+    report = workload.run(cluster)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
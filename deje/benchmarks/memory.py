@@ -0,0 +1,185 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import gc
+import json
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # Python 3.4 and up only
+
+from deje.document     import Document
+from deje.handlers     import handler_document
+from deje.historystate import HistoryState
+from deje.owner        import Owner
+from deje.resource     import Resource
+from deje.tests.identity import identity
+
+def make_text(count):
+    '''
+    Serialized HistoryState with count resources, as it arrives off the wire.
+    '''
+    return json.dumps({
+        'hash': None,
+        'resources': dict(
+            ("/bench/%d" % i, {
+                'path'    : "/bench/%d" % i,
+                'type'    : 'text/plain',
+                'content' : 'content',
+                'comment' : '',
+            })
+            for i in range(count)
+        ),
+    })
+
+def load(text):
+    state = HistoryState()
+    state.deserialize(json.loads(text))
+    return state
+
+def footprint(setup, build, count):
+    '''
+    Bytes still allocated per item after build(inputs), where inputs is
+    whatever setup(count) returns. Memory used by the inputs themselves
+    doesn't count. Needs tracemalloc.
+    '''
+    if tracemalloc is None:
+        raise RuntimeError("Memory benchmarks need tracemalloc (Python 3.4+)")
+    inputs = setup(count)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build(inputs)
+        gc.collect()
+        after  = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return (after - before) / count
+
+def resources(count):
+    '''
+    Fresh resources, with every property set.
+    '''
+    def build(paths):
+        return [Resource(path, 'content', '', 'text/plain') for path in paths]
+    return footprint(lambda n: ["/bench/%d" % i for i in range(n)], build, count)
+
+def loaded(count):
+    '''
+    A HistoryState parsed and loaded, none of its resources used yet.
+    '''
+    return footprint(make_text, load, count)
+
+def reloaded(count):
+    '''
+    A second copy of the same state, loaded while the first is still around.
+    '''
+    def setup(count):
+        text = make_text(count)
+        return text, load(text)
+    return footprint(setup, lambda inputs: load(inputs[0]), count)
+
+def materialized(count):
+    '''
+    Using every resource in a loaded HistoryState.
+    '''
+    def build(state):
+        for resource in state.resources.values():
+            resource.type
+        return state
+    return footprint(lambda count: load(make_text(count)), build, count)
+
+def cloned(count):
+    '''
+    One clone of a state where every resource has been used.
+    '''
+    def setup(count):
+        state = load(make_text(count))
+        for resource in state.resources.values():
+            resource.type
+        return state
+    return footprint(setup, lambda state: state.clone(), count)
+
+def load_documents(text, count, owner=None):
+    documents = []
+    for i in range(count):
+        doc = Document("bench%d" % i)
+        doc.deserialize(json.loads(text))
+        if owner:
+            owner.own_document(doc)
+        documents.append(doc)
+    return documents
+
+def documents(count):
+    '''
+    Documents that all use the same handler, loaded without an owner.
+    Counts bytes per document rather than per resource.
+    '''
+    text = json.dumps(handler_document("echo_chamber").serialize())
+    return footprint(lambda count: count,
+        lambda count: load_documents(text, count), count)
+
+def owned_documents(count):
+    '''
+    Same as documents, but owned by one Owner, so they share one copy of
+    the handler through its registry.
+    '''
+    text = json.dumps(handler_document("echo_chamber").serialize())
+    owner = Owner(identity("mitzi"), make_jack = False)
+    return footprint(lambda count: count,
+        lambda count: load_documents(text, count, owner), count)
+
+scenarios = (resources, loaded, reloaded, materialized, cloned,
+    documents, owned_documents)
+
+def run_all(count=10000):
+    '''
+    Bytes per resource (or document) for every scenario.
+    '''
+    return dict(
+        (scenario.__name__, scenario(count))
+        for scenario in scenarios
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m deje.benchmarks.memory',
+        description='Measure memory used per resource (or per document).'
+    )
+    parser.add_argument('-n', '--count', type=int, default=10000,
+        help='Resources or documents per scenario (default 10000)')
+    parser.add_argument('-o', '--output',
+        help='Save results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.count)
+    for name in sorted(results):
+        print("%-30s %10.1f bytes" % (name, results[name]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import itertools
+
+from deje.benchmarks     import benchmark
+from deje.document       import Document
+from deje.event          import Event
+from deje.handlers       import handler_document, handler_resource
+from deje.history        import History
+from deje.historystate   import HistoryState
+from deje.quorum         import generate_signature, validate_signature
+from deje.resource       import Resource
+from deje.tests.identity import identity
+
+PARTICIPANTS = ("mitzi", "atlas", "victor")
+
+def make_resources(count):
+    return [
+        Resource("/bench/%d" % i, "content %d" % i)
+        for i in range(count)
+    ]
+
+def make_state(resources):
+    return HistoryState(
+        "bench",
+        [handler_resource("tag_team")] + make_resources(resources)
+    )
+
+def make_event(i, author):
+    return Event(
+        {
+            'path'     : '/bench/0',
+            'property' : 'content',
+            'value'    : 'value %d' % i,
+        },
+        author
+    )
+
+@benchmark(resources=[10, 1000])
+def event_enactment(resources):
+    doc = Document("bench", [handler_resource("tag_team")] + make_resources(resources))
+    doc.freeze()
+    author  = identity("mitzi")
+    counter = itertools.count()
+    def run():
+        make_event(next(counter), author).enact(None, doc)
+    return run
+
+@benchmark()
+def event_test_repeat():
+    '''
+    Testing an event that was already tested against the same state.
+    '''
+    state = make_state(10)
+    event = make_event(0, identity("mitzi"))
+    event.test(state)
+    return lambda: event.test(state)
+
+@benchmark(resources=[10, 1000])
+def historystate_apply(resources):
+    state   = make_state(resources)
+    author  = identity("mitzi")
+    counter = itertools.count()
+    def run():
+        state.apply(make_event(next(counter), author))
+    return run
+
+@benchmark(resources=[10, 100, 1000])
+def historystate_clone(resources):
+    state = make_state(resources)
+    return state.clone
+
+@benchmark(resources=[1000, 10000])
+def historystate_list_resources(resources):
+    state = make_state(resources)
+    state.list_resources() # Build the index outside the timed part
+    return lambda: state.list_resources('/bench/99')
+
+@benchmark(history=[10, 100], resources=[10, 1000])
+def history_generate_state(history, resources):
+    author = identity("mitzi")
+    events = [make_event(i, author) for i in range(history)]
+    hist   = History([make_state(resources)], events)
+    target = events[-1].hash()
+    return lambda: hist.generate_state(target)
+
+@benchmark(participants=[1, 2, 3])
+def quorum_sign(participants):
+    idents = [identity(name) for name in PARTICIPANTS[:participants]]
+    content_hash = make_event(0, idents[0]).hash()
+    def run():
+        for ident in idents:
+            generate_signature(ident, content_hash)
+    return run
+
+@benchmark(participants=[1, 2, 3])
+def quorum_verify(participants):
+    idents = [identity(name) for name in PARTICIPANTS[:participants]]
+    content_hash = make_event(0, idents[0]).hash()
+    signatures = [
+        (ident, generate_signature(ident, content_hash))
+        for ident in idents
+    ]
+    def run():
+        for ident, signature in signatures:
+            validate_signature(ident, content_hash, signature)
+    return run
+
+@benchmark(complexity=[0, 100, 10000])
+def lua_call(complexity):
+    handler = Resource(
+        '/handler',
+        {
+            'bench' : '''
+                local x = 0
+                for i = 1, %d do
+                    x = x + i
+                end
+                return x
+            ''' % complexity,
+        },
+        'lua_call',
+        'direct/json'
+    )
+    interpreter = handler.interpreter()
+    return lambda: interpreter.call("bench")
+
+@benchmark()
+def lua_can_read():
+    interpreter = handler_document("tag_team").interpreter
+    author = identity("victor")
+    return lambda: interpreter.can_read(author)
+
+@benchmark()
+def declared_can_read():
+    '''
+    can_read answered from a permissions section, without calling Lua.
+    '''
+    interpreter = handler_document("tag_team_declared").interpreter
+    author = identity("victor")
+    return lambda: interpreter.can_read(author)
+
+@benchmark(arguments=[0, 4])
+def lua_call_overhead(arguments):
+    '''
+    Fixed cost of a handler call: an empty function, plus arguments.
+    '''
+    handler = Resource('/handler', {'noop': ''}, 'lua_call_overhead', 'direct/json')
+    interpreter = handler.interpreter()
+    kwargs = dict(('arg%d' % i, i) for i in range(arguments))
+    return lambda: interpreter.call('noop', **kwargs)
+
+@benchmark(size=[10, 1000])
+def lua_return_list(size):
+    handler = Resource(
+        '/handler',
+        {
+            'names' : '''
+                local names = {}
+                for i = 1, %d do
+                    names[i] = "user" .. i .. "@example.com"
+                end
+                return names
+            ''' % size,
+        },
+        'lua_return_list',
+        'direct/json'
+    )
+    interpreter = handler.interpreter()
+    return lambda: interpreter.call('names', returntype=list)
+
+@benchmark(batched=[False, True])
+def lua_event_test(batched):
+    '''
+    Validating 100 candidate events, one call each or as one batch.
+    '''
+    interpreter = handler_document("echo_chamber").interpreter
+    author = identity("mitzi")
+    events = [("example", author)] * 100
+    if batched:
+        return lambda: interpreter.event_test_batch(events)
+    return lambda: [interpreter.event_test(ev, who) for (ev, who) in events]
+
+@benchmark(batched=[False, True])
+def lua_filter_readers(batched):
+    '''
+    Checking read access for 75 subscribers, with a Lua can_read.
+    '''
+    interpreter = handler_document("echo_chamber").interpreter
+    idents = [identity(name) for name in PARTICIPANTS] * 25
+    if batched:
+        return lambda: interpreter.filter_readers(idents)
+    return lambda: [i for i in idents if interpreter.can_read(i)]
@@ -0,0 +1,195 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import json
+from itertools import islice
+
+from persei import String
+from ejtp.util.hasher import strict
+
+from deje.action import Action
+from deje.event  import Event
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+class BulkImportError(ValueError):
+    '''
+    An imported event could not be parsed, or was not valid. 'line' is
+    the 1-based line number of the offending event.
+    '''
+    def __init__(self, line, message):
+        ValueError.__init__(self, "Line %d: %s" % (line, message))
+        self.line = line
+
+def read_events(source):
+    '''
+    Lazily yield (line number, serialized event) pairs from newline-
+    delimited JSON.
+
+    Source can be a filename, a file object, or any iterable of lines (or
+    of already-parsed dicts). Blank lines are skipped.
+    '''
+    if isinstance(source, string_types):
+        with open(source) as f:
+            for item in read_events(f):
+                yield item
+        return
+    for number, line in enumerate(source, 1):
+        if isinstance(line, dict):
+            yield number, line
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            raise BulkImportError(number, "Invalid JSON (%s)" % e)
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def parse_event(number, serial, identities):
+    try:
+        action = Action(serial, identities).specific()
+    except (KeyError, TypeError, ValueError) as e:
+        raise BulkImportError(number, "Could not parse event (%r)" % e)
+    if not isinstance(action, Event):
+        raise BulkImportError(number, "Not an event")
+    return action
+
+def normalize(version):
+    if version is None:
+        return None
+    return String(version)
+
+def import_events(doc, source, batch_size=1000, progress=None,
+        snapshot=None, freeze=False, identities=None):
+    '''
+    Apply a stream of serialized events to a document, in bulk.
+
+    Events are read and validated batch_size at a time: each one must
+    build on the version before it, and pass the handler's event_test.
+    The work is done on a copy of the current state, so a bad event
+    anywhere in the stream leaves the document untouched, and raises
+    BulkImportError. Resource update notifications are held back until
+    the end, one per distinct change, and delivered as one batch. The
+    document's 'import-events' signal is sent once, in place of per-event
+    'enact-event' signals.
+
+    Handler calls read from that copy too, so each event is tested and
+    applied against the effects of the ones before it.
+
+    By default, the imported events are added to the document history,
+    so memory use grows with the input. Memory use only stays bounded
+    with freeze: the events aren't kept, and the document is frozen at
+    the resulting state. Freezing throws away the document's existing
+    history too.
+
+    progress(count) is called after every batch. If snapshot is a
+    filename, the resulting state is saved there, in the same format as
+    document.save_to.
+
+    Returns the number of events imported.
+    '''
+    if identities is None:
+        if not doc.owner:
+            raise ValueError("Need identities to import into an unowned document")
+        identities = doc.owner.identities
+
+    with doc.lock.reading():
+        original = doc._current
+        state = original.clone()
+    version = normalize(state.hash)
+    count = 0
+    kept = []
+
+    with doc.deferred_updates():
+        for batch in batches(read_events(source), batch_size):
+            events = [
+                (number, parse_event(number, serial, identities))
+                for (number, serial) in batch
+            ]
+            for number, event in events:
+                if normalize(event.version) != version:
+                    raise BulkImportError(number,
+                        "Event version %r does not follow %r" % (event.version, version))
+                if not event.test(state):
+                    raise BulkImportError(number,
+                        "Event %r was not valid" % event.content)
+                event.apply(state)
+                version = normalize(state.hash)
+                if not freeze:
+                    kept.append(event)
+            count += len(events)
+            if progress:
+                progress(count)
+
+        with doc.lock.writing():
+            if doc._current is not original:
+                raise RuntimeError("Document changed during import")
+            doc._current = state
+            if freeze:
+                doc.freeze()
+            else:
+                doc._history.add_events(kept)
+
+    doc.signals['import-events'].send(doc, count=count, version=doc.version)
+    if snapshot:
+        write_snapshot(doc, snapshot)
+    return count
+
+def export_events(doc, target, start=0, stop=None):
+    '''
+    Write events[start:stop] of a document's history to target (a
+    filename or file object) as newline-delimited JSON, suitable for
+    import_events. Returns the number of events written.
+    '''
+    if isinstance(target, string_types):
+        with open(target, 'w') as f:
+            return export_events(doc, f, start, stop)
+    count = 0
+    with doc.lock.reading():
+        for serial in doc._history.serialize_events(start, stop):
+            target.write(strict(serial).export() + "\n")
+            count += 1
+    return count
+
+def write_snapshot(doc, target):
+    '''
+    Save the document's current state, without history, to a filename or
+    file object. The result can be read back with document.load_from.
+    '''
+    if isinstance(target, string_types):
+        with open(target, 'w') as f:
+            return write_snapshot(doc, f)
+    with doc.lock.reading():
+        serial = {
+            'original' : doc._current.serialize(),
+            'events'   : [],
+        }
+    target.write(strict(serial).export())
@@ -17,20 +17,82 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
 import dispatch
+from contextlib import contextmanager
+from persei import String
 
 from deje import quorumspace
+from deje.locking import RWLock, NullLock
 from deje.event import Event
 from deje.read import ReadRequest
 from deje.historystate import HistoryState
 from deje.history import History
 from deje.quorum import Quorum
 
+# Speculative states a document keeps before starting over.
+SPECULATION_LIMIT = 10
+
+# Changes that say whether a resource is there, rather than what it holds.
+STRUCTURAL = ('add', 'delete', 'path')
+
+class HeldUpdates(object):
+    '''
+    Resource update notifications held back by Document.deferred_updates(),
+    folded as they come in, so a long block holds a bounded number of
+    them.
+
+    Changes are grouped by path, and paths keep the order they were first
+    changed in. Within a path, order is kept, and:
+
+     * A property change is only held once after the last add, delete or
+       move of its path.
+     * A delete drops the property changes before it. If the resource was
+       added in this block, the add goes too, and so does the delete:
+       there's nothing left to tell.
+    '''
+    def __init__(self):
+        self.paths = {} # path -> held (path, propname, oldpath) changes
+        self.order = [] # paths, in the order they were first changed
+
+    def __len__(self):
+        return sum(len(held) for held in self.paths.values())
+
+    def hold(self, change):
+        path, propname = change[0], change[1]
+        held = self.paths.get(path)
+        if held is None:
+            held = self.paths[path] = []
+            self.order.append(path)
+
+        # Changes since the last add, delete or move
+        last = len(held)
+        while last and held[last - 1][1] not in STRUCTURAL:
+            last -= 1
+
+        if propname == 'delete':
+            del held[last:]
+            if last and held[last - 1][1] == 'add':
+                del held[last - 1]
+                return
+            held.append(change)
+        elif propname in STRUCTURAL:
+            if not held or held[-1] != change:
+                held.append(change)
+        elif change not in held[last:]:
+            held.append(change)
+
+    def changes(self):
+        return [change for path in self.order for change in self.paths[path]]
+
 class Document(object):
-    def __init__(self, name, resources=[], owner = None):
+    def __init__(self, name, resources=[], owner = None, concurrent = False):
         self._name = name
         self._owner = None
-        if owner:
-            owner.own_document(self)
+        self.lock = NullLock()
+        self.budget = None # Per-call interpreter.Budget for handler functions
+        self._deferred = None # HeldUpdates, while deferring updates
+        self._speculations = {} # event hash -> (base, digest, state, effects)
+        if concurrent:
+            self.enable_locking()
         self._initial = HistoryState(doc = self)
         self._current = HistoryState("current", resources, self)
         self._history = History([self._initial, self._current])
@@ -38,33 +100,83 @@ class Document(object):
         self.signals = {
             'enact-event': dispatch.Signal(),
             'recv-events': dispatch.Signal(
-                providing_args=['qid','events']),
+                providing_args=['qid','events','token','done','source']),
             'recv-state':dispatch.Signal(
                 providing_args=['qid','state']),
+            'import-events':dispatch.Signal(
+                providing_args=['count','version']),
         }
         for res in resources:
             self.add_resource(res, False)
+        if owner:
+            owner.own_document(self)
 
     # High-level resource manipulation
 
     def add_resource(self, resource, interp_call = True):
-        if interp_call:
-            self.interpreter.on_resource_update(resource.path, 'add')
-        self._current.add_resource(resource)
-        resource.document = self
+        with self.lock.writing():
+            if interp_call:
+                self.resource_updated(resource.path, 'add')
+            self._current.add_resource(resource)
 
     def get_resource(self, path):
-        return self.resources[path]
+        with self.lock.reading():
+            return self.resources[path]
 
     def del_resource(self, path, interp_call = True):
-        if interp_call:
-            self.interpreter.on_resource_update(path, 'delete')
-        del self.resources[path]
+        with self.lock.writing():
+            if interp_call:
+                self.resource_updated(path, 'delete')
+            self._current.del_resource(path)
+
+    def list_resources(self, prefix='/'):
+        '''
+        Sorted paths of current resources that start with prefix.
+        '''
+        with self.lock.reading():
+            return self._current.list_resources(prefix)
 
     @property
     def resources(self):
         return self._current.resources
 
+    # Resource update notifications
+
+    def resource_updated(self, path, propname, oldpath=None):
+        '''
+        Tell the handler about a resource change, or hold the notification
+        back if we're inside a deferred_updates() block.
+        '''
+        if self._deferred is not None:
+            self._deferred.hold((path, propname, oldpath))
+        else:
+            self.interpreter.on_resource_update(path, propname, oldpath)
+
+    @contextmanager
+    def deferred_updates(self):
+        '''
+        Hold back resource update notifications until the end of the
+        block, then deliver them in a single interpreter.on_resource_updates
+        call. They're folded as they come in (see HeldUpdates), so a long
+        block doesn't hold one notification per change. If the block
+        raises, the held notifications are dropped.
+
+        Nested blocks are folded into the outermost one.
+        '''
+        if self._deferred is not None:
+            yield
+            return
+        self._deferred = HeldUpdates()
+        try:
+            yield
+        except:
+            self._deferred = None
+            raise
+        changes = self._deferred.changes()
+        self._deferred = None
+        if changes:
+            self.interpreter.on_resource_updates(changes)
+
     @property
     def interpreter(self):
         return self._current.interpreter
@@ -77,26 +189,124 @@ class Document(object):
             return tuple()
 
     def serialize(self):
-        return {
-            'original': self._initial.serialize(),
-            'events': self._history.events
-        }
+        with self.lock.reading():
+            return {
+                'original': self._initial.serialize(),
+                'events': self._history.events
+            }
 
     def deserialize(self, serial):
-        self._current = HistoryState(doc=self)
-        self._current.deserialize(serial['original'])
-        self.freeze()
+        with self.deferred_updates():
+            with self.lock.writing():
+                self._current = HistoryState(doc=self)
+                self._current.deserialize(serial['original'])
+                self.freeze()
 
-        for event in serial['events']:
-            ev = Event(event['content'], event['author'], event['version'])
-            self.external_event(ev)
+            for event in serial['events']:
+                ev = Event(event['content'], event['author'], event['version'])
+                self.external_event(ev)
 
     def freeze(self):
         '''
         Throw away history and base originals off of current state.
         '''
-        self._initial = self._current.clone()
-        self._history.events = []
+        with self.lock.writing():
+            self._initial = self._current.clone()
+            self._history = History([self._initial])
+
+    # Speculation
+
+    def speculate(self, event):
+        '''
+        Work out ahead of time the state that enacting event would
+        produce, so that enacting it later is just a swap.
+
+        on_event_achieve runs against a detached clone of the current
+        state. Resource notifications and the handler's deje.event and
+        deje.debug calls are held back until the state is swapped in. If
+        the handler fails, nothing is kept, and enacting the event runs
+        it again, for real.
+        '''
+        with self.lock.reading():
+            base   = self._current
+            digest = base.digest
+            state  = base.detached()
+            interpreter = base.handler.interpreter()
+
+        effects = interpreter.api.held = []
+        try:
+            interpreter.on_event_achieve(event.content, event.author, state)
+        except Exception:
+            return False
+        state.hash = event.hash()
+
+        with self.lock.writing():
+            if len(self._speculations) >= SPECULATION_LIMIT:
+                self._speculations = {}
+            self._speculations[event.hash()] = (base, digest, state, effects)
+        return True
+
+    def adopt_speculation(self, event):
+        '''
+        Swap in the state speculate() worked out for event, if it was
+        worked out from the current state, and that hasn't changed since.
+        Returns whether it was swapped in.
+
+        Every other speculation is discarded, since they were all worked
+        out from the state being replaced.
+        '''
+        with self.lock.writing():
+            speculations, self._speculations = self._speculations, {}
+            found = speculations.get(event.hash())
+            if found is None:
+                return False
+            base, digest, state, effects = found
+            if base is not self._current or base.digest != digest:
+                return False
+
+            with self.deferred_updates():
+                changes = state.attach(self)
+                self._current = state
+                for change in changes:
+                    self.resource_updated(*change)
+                for effect in effects:
+                    effect()
+            return True
+
+    # Concurrency
+
+    def enable_locking(self):
+        '''
+        Opt in to thread safety, with a per-document reader/writer lock.
+
+        Reads (resource access, serialization, retrieval) run in parallel,
+        while event enactment and other writes are exclusive.
+        '''
+        if isinstance(self.lock, NullLock):
+            self.lock = RWLock()
+
+    @property
+    def lock_stats(self):
+        return self.lock.stats.snapshot()
+
+    def state_at(self, version):
+        '''
+        Get the HistoryState for a given version, regenerating it from
+        history if necessary.
+        '''
+        # Versions off the wire are plain strings, event hashes are Strings
+        candidates = [version]
+        if version is not None:
+            candidates.append(String(version))
+        for candidate in candidates:
+            if candidate == self.version:
+                return self._current
+        for candidate in candidates:
+            try:
+                return self._history.generate_state(candidate)
+            except KeyError:
+                pass
+        raise KeyError("Cannot generate state for version %r" % version)
 
     def debug(self, lines):
         for line in lines:
@@ -131,6 +341,16 @@ class Document(object):
         else:
             raise ValueError("Event %r was not valid" % event.content)
 
+    def test_events(self, events):
+        '''
+        Whether each of a list of events is valid for the current state,
+        tested in one batch. Returns a list of bools.
+        '''
+        with self.lock.reading():
+            return self.interpreter.event_test_batch(
+                [(event.content, event.author) for event in events]
+            )
+
     def get_version(self, callback):
         if not self.can_read():
             raise ValueError("You don't have read permission")
@@ -169,6 +389,12 @@ class Document(object):
         ident = ident or self.identity
         return self.interpreter.can_read(ident)
 
+    def filter_readers(self, identities):
+        '''
+        The identities allowed to read this document, checked together.
+        '''
+        return self.interpreter.filter_readers(identities)
+
     def can_write(self, ident = None):
         ident = ident or self.identity
         return self.interpreter.can_write(ident)
@@ -179,6 +405,19 @@ class Document(object):
     def handler(self):
         return self.get_resource('/handler')
 
+    def register_handler(self, registry):
+        '''
+        Register the current handler with a HandlerRegistry, and switch
+        stored states with the same handler over to the registry's copy.
+        '''
+        with self.lock.reading():
+            if '/handler' not in self.resources:
+                return
+            registry.register(self.handler, self.name)
+            for state in self._history.states.values():
+                if '/handler' in state.resources:
+                    registry.share(state.handler)
+
     # Other accessors
 
     @property
@@ -53,6 +53,13 @@ PERMISSION_DOCINFO_NOT_PARTICIPANT = {
     'explanation': "%r information came from non-participant source, ignoring",
 }
 
+# State errors
+
+STATE_DIGEST_MISMATCH = {
+    'code': 60,
+    'explanation': "Received state did not match its digest, ignoring",
+}
+
 # Event errors
 
 # Subscription errors
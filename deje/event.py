@@ -48,15 +48,18 @@ class Event(Action):
         '''
         Returns whether Event has already been applied.
         '''
-        return self in document._history.events
+        return self.hash() in document._history.events_by_hash
 
     def enact(self, quorum, document):
         '''
-        Apply Event to the head of the document's history.
+        Apply Event to the head of the document's history, or swap in
+        the state Document.speculate() already worked out for it.
         '''
-        document._history.add_event(self)
-        document.signals['enact-event'].send(self)
-        self.apply(document._current)
+        with document.lock.writing():
+            document._history.add_event(self)
+            document.signals['enact-event'].send(self)
+            if not document.adopt_speculation(self):
+                self.apply(document._current)
 
     def apply(self, state):
         '''
@@ -66,6 +69,7 @@ class Event(Action):
 
     def test(self, state):
         '''
-        Return whether Event is valid for the given state.
+        Return whether Event is valid for the given state. Repeat tests
+        against the same state are answered from the interpreter's cache.
         '''
-        return state.interpreter.event_test(self.content, self.author)
+        return state.interpreter.memoized_event_test(self, state)
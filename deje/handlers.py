@@ -19,9 +19,10 @@ from deje import document, resource
 
 def handler_text(handler_name):
     functions = {
-        "echo_chamber" : echo_chamber,
-        "tag_team"     : tag_team,
-        "psycho_ward"  : psycho_ward,
+        "echo_chamber"      : echo_chamber,
+        "tag_team"          : tag_team,
+        "tag_team_declared" : tag_team_declared,
+        "psycho_ward"       : psycho_ward,
     }
     return functions[handler_name]()
 
@@ -156,6 +157,38 @@ def tag_team():
         ''',
     }
 
+def tag_team_declared():
+    '''
+    Same rules as tag_team, declared in a permissions section, so they're
+    answered without calling Lua.
+    '''
+    return {
+        'event_test': '''
+            return true
+        ''',
+
+        'on_event_achieve': '''
+            set_resource(ev.path, ev.property, ev.value)
+        ''',
+
+        'permissions': {
+            'readers' : [
+                "mitzi@lackadaisy.com",
+                "atlas@lackadaisy.com",
+                "victor@lackadaisy.com",
+            ],
+            'writers' : [
+                "mitzi@lackadaisy.com",
+                "atlas@lackadaisy.com",
+            ],
+            'participants' : [
+                "mitzi@lackadaisy.com",
+                "atlas@lackadaisy.com",
+            ],
+            'thresholds' : {'read': 2, 'write': 2},
+        },
+    }
+
 def psycho_ward():
     '''
     Diagnostic, returns nonsense values.
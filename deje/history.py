@@ -15,6 +15,8 @@ You should have received a copy of the GNU Lesser General Public License
 along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+from itertools import islice
+
 class History(object):
     '''
     Represents a timeline of Events, with HistoryStates acting as "keyframes",
@@ -47,6 +49,13 @@ class History(object):
         event = self.events_by_hash[hash]
         return self.events.index(event)
 
+    def serialize_events(self, start=0, stop=None):
+        '''
+        Lazily serialize events[start:stop].
+        '''
+        for event in islice(self.events, start, stop):
+            yield event.serialize()
+
     @property
     def orphan_states(self):
         '''
@@ -70,6 +79,10 @@ class History(object):
                 h = event.hash()
                 if h in self.states:
                     return self.states[h]
+            # Frozen starting point, not derived from any known event
+            orphans = self.orphan_states
+            if orphans:
+                return orphans[0]
             raise KeyError("No initial state found!")
 
     @property
@@ -87,7 +100,10 @@ class History(object):
         elif version in self.events_by_hash:
             # Can generate
             i_state = self.initial_state
-            i_index = self.event_index_by_hash(i_state.hash)
+            if i_state.hash in self.events_by_hash:
+                i_index = self.event_index_by_hash(i_state.hash)+1
+            else:
+                i_index = 0
             t_index = self.event_index_by_hash(version)+1
             if t_index >= i_index:
                 events = self.events[i_index:t_index]
@@ -15,7 +15,16 @@ You should have received a copy of the GNU Lesser General Public License
 along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from persei import String
+
+from deje import metrics
 from deje.resource import Resource
+from deje.merkle import MerkleTree
+
+DIGEST_MODULUS = 2 ** 160
 
 class HistoryState(object):
     '''
@@ -33,18 +42,158 @@ class HistoryState(object):
         self.doc  = doc
         self.hash = hash
         self.resources = {}
+        self._merkle = None
+        self._path_index = None # Sorted paths, once list_resources is first used
+        self._digest_parts = None # path -> int, once digest is first used
+        self._digest_total = 0
+        self._digest_dirty = set()
+        self._digest_lock  = threading.Lock() # Readers update the digest too
+        self.changes = None # Recorded notifications, while detached
         for r in resources:
             self.add_resource(r)
 
-        self._interpreter = (None, None) # hash, interp
+        self._interpreter = (None, None) # handler checksum, interp
 
     def add_resource(self, resource):
-        resource.document = self.doc
+        resource.state = self
         self.resources[resource.path] = resource
+        if self._path_index is not None:
+            self._index_path(resource.path)
+        if self._merkle:
+            self._merkle.update(resource.path, resource.checksum())
+        if self._digest_parts is not None:
+            self._forget_digest(resource.path)
+            self._digest_dirty.add(resource.path)
 
     def get_resource(self, path):
         return self.resources[path]
 
+    def del_resource(self, path):
+        resource = self.resources.pop(path)
+        resource.state = None
+        if self._path_index is not None:
+            self._unindex_path(path)
+        if self._merkle:
+            self._merkle.remove(path)
+        if self._digest_parts is not None:
+            self._forget_digest(path)
+
+    def on_resource_change(self, resource, propname, oldpath=None):
+        '''
+        Called by member resources whenever one of their properties is set.
+        '''
+        if self.changes is not None:
+            self.changes.append((resource.path, propname, oldpath or resource.path))
+        if propname == 'path' and oldpath != resource.path:
+            if self.resources.get(oldpath) is resource:
+                del self.resources[oldpath]
+                if self._path_index is not None:
+                    self._unindex_path(oldpath)
+            self.resources[resource.path] = resource
+            if self._path_index is not None:
+                self._index_path(resource.path)
+            if self._merkle:
+                self._merkle.remove(oldpath)
+        if self._merkle:
+            self._merkle.update(resource.path, resource.checksum())
+        if self._digest_parts is not None:
+            if propname == 'path':
+                self._forget_digest(oldpath)
+            self._forget_digest(resource.path)
+            self._digest_dirty.add(resource.path)
+
+    def on_content_edit(self, resource):
+        '''
+        Called by member resources whose content was changed in place.
+        '''
+        if self.resources.get(resource.path) is not resource:
+            return
+        if self._merkle:
+            self._merkle.update(resource.path, resource.checksum())
+        if self._digest_parts is not None:
+            self._forget_digest(resource.path)
+            self._digest_dirty.add(resource.path)
+
+    def list_resources(self, prefix='/'):
+        '''
+        Sorted paths of all resources that start with prefix.
+
+        This is a plain string prefix, so use a trailing slash to get only
+        the resources under a directory. The sorted path index is built on
+        first use, then kept up to date as resources come and go.
+        '''
+        if self._path_index is None:
+            self._path_index = sorted(self.resources)
+        index = self._path_index
+        results = []
+        for i in range(bisect_left(index, prefix), len(index)):
+            if not index[i].startswith(prefix):
+                break
+            results.append(index[i])
+        return results
+
+    def _index_path(self, path):
+        index = self._path_index
+        i = bisect_left(index, path)
+        if i == len(index) or index[i] != path:
+            index.insert(i, path)
+
+    def _unindex_path(self, path):
+        index = self._path_index
+        i = bisect_left(index, path)
+        if i < len(index) and index[i] == path:
+            del index[i]
+
+    def _forget_digest(self, path):
+        part = self._digest_parts.pop(path, None)
+        if part is not None:
+            self._digest_total -= part
+        self._digest_dirty.discard(path)
+
+    @property
+    def digest(self):
+        '''
+        Content hash of this state's resources, independent of history.
+
+        The sum of per-resource checksums, so it doesn't depend on order,
+        and only resources that changed since the last call are rehashed.
+        Tracking starts on first access.
+
+        Safe to call with only the document's read lock held: concurrent
+        readers take turns catching the digest up.
+        '''
+        with self._digest_lock:
+            if self._digest_parts is None:
+                self._digest_parts = {}
+                self._digest_total = 0
+                self._digest_dirty = set(self.resources)
+            for path in self._digest_dirty:
+                part = int(self.resources[path].checksum().export(), 16)
+                self._digest_parts[path] = part
+                self._digest_total += part
+            self._digest_dirty.clear()
+            total = self._digest_total
+        return String('%040x' % (total % DIGEST_MODULUS))
+
+    def matches(self, other):
+        '''
+        Whether two states hold the same resources, by digest.
+        '''
+        return self.digest == other.digest
+
+    @property
+    def merkle(self):
+        '''
+        MerkleTree over this state's resources.
+
+        Built on first access, then kept up to date as resources change.
+        '''
+        if self._merkle is None:
+            self._merkle = MerkleTree(dict(
+                (path, r.checksum()) for (path, r) in self.resources.items()
+            ))
+        return self._merkle
+
     def apply(self, event):
         '''
         Apply an event to this state.
@@ -52,18 +201,100 @@ class HistoryState(object):
         Does not check event validity, or incur side effects aside from
         invalidating the current interpreter.
         '''
-        self.interpreter.on_event_achieve(event.content, event.author, self)
-        self.hash = event.hash()
+        with metrics.timer('deje_historystate_apply_seconds'):
+            with self.deferred_updates():
+                self.interpreter.on_event_achieve(event.content, event.author, self)
+                self.hash = event.hash()
+
+    @contextmanager
+    def deferred_updates(self):
+        '''
+        The document's deferred_updates() scope, if there's a document.
+        '''
+        if self.doc is None:
+            yield
+        else:
+            with self.doc.deferred_updates():
+                yield
 
     def clone(self):
         '''
         Create a full distinct copy of this HistoryState in memory.
         '''
-        return HistoryState(
-            self.hash,
-            [r.clone() for r in self.resources.values()],
-            self.doc
-        )
+        with metrics.timer('deje_historystate_clone_seconds'):
+            result = HistoryState(
+                self.hash,
+                [r.clone() for r in self.resources.values()],
+                self.doc
+            )
+            if self._path_index is not None:
+                result._path_index = list(self._path_index)
+            if self._merkle:
+                result._merkle = self._merkle.copy()
+            if self._digest_parts is not None:
+                result._digest_parts = dict(self._digest_parts)
+                result._digest_total = self._digest_total
+                result._digest_dirty = set(self._digest_dirty)
+        return result
+
+    def detached(self):
+        '''
+        Clone that isn't attached to the document, for working ahead.
+        Changes to it don't notify anyone, and are recorded in its
+        'changes' list instead, for attach() to hand back.
+        '''
+        result = self.clone()
+        result.doc = None
+        result.changes = []
+        return result
+
+    def attach(self, doc):
+        '''
+        Attach a detached state to a document. Returns the changes it
+        recorded, as (path, propname, oldpath) notifications.
+        '''
+        self.doc = doc
+        changes, self.changes = self.changes, None
+        return changes
+
+    def delta_from(self, base):
+        '''
+        Resource-level difference between an older state and this one.
+
+        Applying the result to a copy of base, with apply_delta, produces a
+        copy of this state.
+        '''
+        added   = {}
+        changed = {}
+        for path, resource in self.resources.items():
+            serial = resource.serialize()
+            if path not in base.resources:
+                added[path] = serial
+            elif base.resources[path].serialize() != serial:
+                changed[path] = serial
+        removed = [path for path in base.resources if path not in self.resources]
+        return {
+            "base"    : base.hash,
+            "hash"    : self.hash,
+            "added"   : added,
+            "changed" : changed,
+            "removed" : removed,
+        }
+
+    def apply_delta(self, delta):
+        '''
+        Apply the output of delta_from to this state, in place.
+        '''
+        with self.deferred_updates():
+            for path in delta['removed']:
+                self.del_resource(path)
+            for serials in (delta['added'], delta['changed']):
+                for path in serials:
+                    if path in self.resources:
+                        self.resources[path].deserialize(serials[path])
+                    else:
+                        self.add_resource(Resource.lazy(serials[path]))
+            self.hash = delta['hash']
 
     def serialize_resources(self):
         serialized = {}
@@ -78,26 +309,42 @@ class HistoryState(object):
         }
 
     def deserialize(self, serial):
+        '''
+        Load resources lazily. Each one is only fully built the first time
+        its type, content or comment is used.
+        '''
         self.hash         = serial['hash']
 
         for r_serial in serial['resources'].values():
-            r_real = Resource()
-            r_real.deserialize(r_serial)
-            self.add_resource(r_real)
+            self.add_resource(Resource.lazy(r_serial))
 
     @property
     def handler(self):
         return self.resources['/handler']
 
     def create_interpreter(self):
-        return self.handler.interpreter()
+        handler = self.handler
+        owner   = self.doc and self.doc.owner
+        if owner:
+            if self is self.doc._current:
+                owner.handlers.register(handler, self.doc.name)
+            else:
+                owner.handlers.share(handler)
+        return handler.interpreter()
 
     @property
     def interpreter(self):
+        '''
+        Interpreter for the current handler. Kept until the handler
+        changes, rather than for a single version, and backed by a
+        HandlerCore shared with every other state using the same handler.
+        '''
+        handler = self.handler
+        key = handler.checksum()
         i = self._interpreter
-        if i[0] == self.hash and i[1]:
+        if i[0] == key and i[1] and i[1].resource is handler:
             return i[1]
         else:
             new_interp = self.create_interpreter()
-            self._interpreter = (self.hash, new_interp)
+            self._interpreter = (key, new_interp)
             return new_interp
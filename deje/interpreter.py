@@ -15,9 +15,304 @@ You should have received a copy of the GNU Lesser General Public License
 along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import threading
+import weakref
+from timeit import default_timer
+
 from ejtp.identity.core import Identity
-from deje.api import API
-from deje.lua import Runtime, LuaObject, LuaCastError
+from deje import metrics
+from deje.api import API, exported_functions
+from deje.tracked import untrack
+from deje.locking import NullLock
+from deje.lua import Runtime, LuaObject, LuaCastError, BudgetExceeded, Sequence, \
+    shareable
+
+class Budget(object):
+    '''
+    Limits for a single handler function call. Either limit may be None.
+
+    Setting a budget (even one with no limits) also turns on instruction
+    counting, which is recorded in call_stats. Instructions are counted in
+    increments of 'step', so limits are enforced to within 'step'.
+    '''
+    def __init__(self, instructions=None, seconds=None, step=1000):
+        self.instructions = instructions
+        self.seconds = seconds
+        self.step = step
+
+class CallStats(object):
+    '''
+    Per-function totals for handler calls, across all interpreters.
+    '''
+    def __init__(self):
+        self.functions = {}
+
+    def record(self, function, seconds, instructions=None, exceeded=False):
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = self.functions.setdefault(function, {
+                'calls'            : 0,
+                'seconds'          : 0.0,
+                'max_seconds'      : 0.0,
+                'instructions'     : 0,
+                'max_instructions' : 0,
+                'exceeded'         : 0,
+            })
+        stats['calls']  += 1
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        if instructions is not None:
+            stats['instructions'] += instructions
+            stats['max_instructions'] = max(stats['max_instructions'], instructions)
+            metrics.counter('deje_lua_instructions_total', function=function).inc(instructions)
+        if exceeded:
+            stats['exceeded'] += 1
+            metrics.counter('deje_lua_budget_exceeded_total', function=function).inc()
+
+    def snapshot(self):
+        return dict(
+            (function, dict(stats))
+            for (function, stats) in self.functions.items()
+        )
+
+    def clear(self):
+        self.functions = {}
+
+call_stats = CallStats()
+
+def scaled(limit, calls):
+    if limit is None:
+        return None
+    return limit * calls
+
+class Permissions(object):
+    '''
+    The optional, declarative 'permissions' section of handler content:
+
+        'permissions': {
+            'readers'      : ["mitzi@lackadaisy.com", ...],
+            'writers'      : ["mitzi@lackadaisy.com", ...],
+            'participants' : ["mitzi@lackadaisy.com", ...],
+            'thresholds'   : {'read': 2, 'write': 2},
+        }
+
+    Every key is optional. Whatever is given is answered in Python, unless
+    the handler also defines the matching Lua function (can_read,
+    can_write, quorum_participants, quorum_thresholds), which wins.
+    '''
+    def __init__(self, section=None):
+        section = section or {}
+        self.readers      = self._set(section.get('readers'))
+        self.writers      = self._set(section.get('writers'))
+        self.participants = section.get('participants')
+        self.thresholds   = section.get('thresholds')
+        if self.participants is not None:
+            self.participants = list(self.participants)
+        if self.thresholds is not None:
+            self.thresholds = dict(self.thresholds)
+
+    def _set(self, names):
+        if names is None:
+            return None
+        return frozenset(names)
+
+# Stands in for the lock of interpreters without a document.
+NO_LOCK = NullLock()
+
+# Resource tables a HandlerCore keeps before starting over.
+TABLE_CACHE_SIZE = 1000
+
+# Event test results a LuaInterpreter keeps before starting over.
+RESULT_CACHE_SIZE = 1000
+
+class HandlerCore(object):
+    '''
+    The parts of an interpreter that only depend on handler content: the
+    Lua runtime, compiled functions, the deje module, and native resource
+    tables. Every LuaInterpreter whose handler has the same content shares
+    one, across states, clones and documents, so it stays warm.
+
+    Calls are serialized by the core's lock. 'active' is the interpreter
+    whose call is running, which is where the deje module sends API calls.
+    '''
+    def __init__(self):
+        self.lock      = threading.RLock()
+        self.active    = None
+        self.functions = {} # event -> (source, compiled chunk)
+        self.tables    = {} # resource checksum -> native Lua table, to copy
+        self._runtime  = None
+        self._permissions = None # (handler checksum, Permissions), last parsed
+
+    @property
+    def runtime(self):
+        '''
+        Lua runtime, created on first use. The deje module is built into
+        it once, as a global Lua table. Everything else a call needs goes
+        in that call's frame.
+        '''
+        if self._runtime is None:
+            runtime = Runtime()
+            runtime.set_globals({
+                'deje': runtime.runtime.table(**dict(
+                    (name, self._dispatch(name)) for name in exported_functions
+                )),
+            })
+            self._runtime = runtime
+        return self._runtime
+
+    def _dispatch(self, name):
+        # Weak, so the runtime doesn't keep its own core alive
+        core = weakref.ref(self)
+        def function(*args):
+            return getattr(core().active.api, name)(*args)
+        return function
+
+    def function(self, event, source):
+        '''
+        Compiled handler function, recompiled only if its source changes.
+        '''
+        cached = self.functions.get(event)
+        if cached and cached[0] == source:
+            return cached[1]
+        function = self.runtime.compile(source)
+        self.functions[event] = (source, function)
+        return function
+
+    def permissions(self, resource):
+        '''
+        Permissions declared in a handler's content, parsed again only when
+        its checksum changes, which in-place edits count as.
+        '''
+        key = resource.checksum()
+        cached = self._permissions
+        if cached and (cached[0] is key or cached[0] == key):
+            return cached[1]
+        permissions = Permissions(resource.peek_content().get('permissions'))
+        self._permissions = (key, permissions)
+        return permissions
+
+    def resource_table(self, resource):
+        '''
+        A resource's properties as a native Lua table, content included.
+
+        Converted from Python once per resource version. Every call gets
+        its own copy of that, made within Lua, so whatever a handler does
+        to it can't leak into other calls or other documents.
+        '''
+        version = resource.checksum().export()
+        table = self.tables.get(version)
+        if table is None:
+            if len(self.tables) >= TABLE_CACHE_SIZE:
+                self.tables.clear()
+            table = self.runtime.to_lua(resource.serialize())
+            self.tables[version] = table
+        return self.runtime.deep_copy(table)
+
+# Handler checksum -> HandlerCore, for as long as anyone uses it
+cores = weakref.WeakValueDictionary()
+
+def handler_core(resource):
+    '''
+    The shared HandlerCore for a handler resource, keyed by its checksum,
+    which the resource caches until it changes. A private one, on Lua
+    builds whose runtimes can't be shared.
+    '''
+    if not shareable():
+        return HandlerCore()
+    key  = resource.checksum().export()
+    core = cores.get(key)
+    if core is None:
+        core = cores[key] = HandlerCore()
+    return core
+
+class HandlerEntry(object):
+    '''
+    One version of a handler, as registered with a HandlerRegistry.
+
+    Holds a plain copy of the content, which registered copies of the
+    handler share until someone asks for their content to change it, and
+    a strong reference to its HandlerCore, so the compiled handler stays
+    warm even between calls.
+    '''
+    def __init__(self, key, resource):
+        self.key       = key
+        self.type      = resource.type
+        self.content   = untrack(resource.peek_content())
+        self.core      = handler_core(resource)
+        self.documents = set()
+
+    @property
+    def events(self):
+        return sorted(self.content)
+
+    def stats(self):
+        return {
+            'type'      : self.type,
+            'events'    : self.events,
+            'documents' : len(self.documents),
+            'compiled'  : len(self.core.functions),
+        }
+
+class HandlerRegistry(object):
+    '''
+    Content-addressed store of the handlers used by an Owner's documents.
+
+    Documents with the same handler share one HandlerEntry: one copy of
+    the content, and one compiled core. An entry is dropped once no
+    document's current handler uses it.
+    '''
+    def __init__(self):
+        self.entries = {}  # handler checksum -> HandlerEntry
+        self.current = {}  # document name -> handler checksum
+
+    def register(self, resource, docname):
+        '''
+        Record resource as the current handler of a document, and return
+        its entry, created if this is the first copy of its content.
+        '''
+        key   = resource.checksum().export()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = HandlerEntry(key, resource)
+        self._share(entry, resource)
+
+        if self.current.get(docname) != key:
+            self.release(docname)
+            self.current[docname] = entry.key
+            entry.documents.add(docname)
+        return entry
+
+    def share(self, resource):
+        '''
+        Entry for a handler resource that isn't any document's current
+        handler (say, in an older state), or None if it isn't registered.
+        '''
+        entry = self.entries.get(resource.checksum().export())
+        if entry is not None:
+            self._share(entry, resource)
+        return entry
+
+    def _share(self, entry, resource):
+        # Later copies switch over to the entry's content, so only one is
+        # kept in memory.
+        if resource.peek_content() is not entry.content:
+            resource.share_content(entry.content)
+
+    def release(self, docname):
+        '''
+        Forget which handler a document uses.
+        '''
+        key = self.current.pop(docname, None)
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.documents.discard(docname)
+            if not entry.documents:
+                del self.entries[key]
+
+    def stats(self):
+        return dict(
+            (key, entry.stats()) for (key, entry) in self.entries.items()
+        )
 
 class LuaInterpreter(object):
     def __init__(self, resource):
@@ -25,7 +320,9 @@ class LuaInterpreter(object):
             Lua-based interpreter for handler files.
         '''
         self.resource = resource
-        self.api = API(self)
+        self.api  = API(self)
+        self.core = handler_core(resource)
+        self.results = {} # (state digest, handler, action hash) -> bool
 
     # Callbacks
 
@@ -37,6 +334,26 @@ class LuaInterpreter(object):
             oldpath=oldpath
         )
 
+    def on_resource_updates(self, changes):
+        '''
+        Deliver a batch of (path, propname, oldpath) changes.
+
+        If the handler defines on_resource_updates, it gets them all in one
+        call, as a list of {path=..., propname=..., oldpath=...} tables.
+        Otherwise on_resource_update is called once per change.
+        '''
+        if "on_resource_updates" in self.resource.peek_content():
+            self.call(
+                "on_resource_updates",
+                changes=Sequence(
+                    dict(path=path, propname=propname, oldpath=oldpath)
+                    for (path, propname, oldpath) in changes
+                )
+            )
+        else:
+            for change in changes:
+                self.on_resource_update(*change)
+
     def on_event_achieve(self, ev, author, state=None):
         set_resource, sr_flag = self.api.set_resource(state)
         self.call(
@@ -55,15 +372,60 @@ class LuaInterpreter(object):
             returntype = bool
         )
 
+    def memoized_event_test(self, action, state):
+        '''
+        event_test for an Event against a state, remembered by the state's
+        content digest, the handler's checksum and the event's hash. Given
+        the same state, handler functions give the same answer, so testing
+        an event again (on proposal, on accept, on retry) is a lookup.
+        '''
+        key = (state.digest, self.resource.checksum(), action.hash())
+        result = self.results.get(key)
+        if result is None:
+            result = self.event_test(action.content, action.author)
+            if len(self.results) >= RESULT_CACHE_SIZE:
+                self.results.clear()
+            self.results[key] = result
+        return result
+
+    def event_test_batch(self, events):
+        '''
+        event_test for a list of (ev, author) pairs, all against the same
+        state, in one trip into Lua. Returns a list of bools.
+
+        If the handler defines event_test_batch, it gets every pair in one
+        call, as a list of {ev=..., author=...} tables, and returns a list
+        of booleans. Otherwise event_test is run once per pair.
+        '''
+        frames = [dict(ev=ev, author=author) for (ev, author) in events]
+        if not frames:
+            return []
+        if "event_test_batch" in self.resource.peek_content():
+            results = self.call(
+                "event_test_batch",
+                events=Sequence(frames),
+                returntype = list
+            )
+        else:
+            results = self.call_each("event_test", frames)
+        return self.check_batch(results, len(frames))
+
     def quorum_participants(self):
-        return self.normalize_idents(
-            self.call("quorum_participants", returntype = list)
-        )
+        participants = self.declared("quorum_participants", "participants")
+        if participants is None:
+            participants = self.call("quorum_participants", returntype = list)
+        return self.normalize_idents(participants)
 
     def quorum_thresholds(self):
+        thresholds = self.declared("quorum_thresholds", "thresholds")
+        if thresholds is not None:
+            return dict(thresholds)
         return self.call("quorum_thresholds", returntype = dict)
 
     def can_read(self, ident):
+        readers = self.declared("can_read", "readers")
+        if readers is not None:
+            return ident.name in readers
         return self.call(
             "can_read",
             name=ident.name,
@@ -71,12 +433,57 @@ class LuaInterpreter(object):
         )
 
     def can_write(self, ident):
+        writers = self.declared("can_write", "writers")
+        if writers is not None:
+            return ident.name in writers
         return self.call(
             "can_write",
             name=ident.name,
             returntype = bool
         )
 
+    def filter_readers(self, identities):
+        '''
+        The identities that pass can_read, in order, all checked at once:
+        against the permissions section if there is one, otherwise in one
+        trip into Lua.
+        '''
+        identities = list(identities)
+        readers = self.declared("can_read", "readers")
+        if readers is not None:
+            return [ident for ident in identities if ident.name in readers]
+        if not identities:
+            return []
+        results = self.check_batch(
+            self.call_each(
+                "can_read",
+                [dict(name=ident.name) for ident in identities]
+            ),
+            len(identities)
+        )
+        return [
+            ident for (ident, allowed) in zip(identities, results) if allowed
+        ]
+
+    def check_batch(self, results, count):
+        '''
+        Make sure a batch call gave one boolean per item.
+        '''
+        if len(results) != count or \
+                not all(type(result) is bool for result in results):
+            raise HandlerReturnError(
+                "Handler returned unexpected batch results", results)
+        return results
+
+    def declared(self, function, name):
+        '''
+        A value from the handler's permissions section, or None if the
+        handler leaves it to the Lua function instead.
+        '''
+        if function in self.resource.peek_content():
+            return None
+        return getattr(self.core.permissions(self.resource), name)
+
     def request_protocols(self):
         return self.call("request_protocols", returntype = list)
 
@@ -96,40 +503,116 @@ class LuaInterpreter(object):
         else:
             returntype = object
 
-        runtime = Runtime(deje = self.deje_module)
-        runtime.set_globals(kwargs)
+        return self.invoke(
+            event,
+            lambda runtime: runtime.frame(self.function(event), kwargs),
+            returntype
+        )
 
-        if event in self.resource.content:
-            funcbody = self.resource.content[event]
-            result = runtime.execute(funcbody)
-            self.api.process_queue()
-        else:
-            result = LuaObject(None)
+    def call_each(self, event, frames, returntype = list):
+        '''
+        Call a handler function once per dict of variables in frames, with
+        the loop running inside Lua. Returns the results as a list. The
+        budget covers the whole loop, scaled by the number of calls.
+        '''
+        return self.invoke(
+            event,
+            lambda runtime: runtime.batch(self.function(event), frames),
+            returntype,
+            len(frames)
+        )
+
+    def invoke(self, event, bind, returntype, calls = 1):
+        '''
+        Run the chunk bind(runtime) returns, on behalf of handler function
+        'event', and cast the result.
+
+        The document's read lock is taken before the core's lock, never
+        after, so a handler reading the document is already a reader, and
+        can't end up queued behind a writer while it holds the core. What
+        the handler queued up (set_resource, deje.event) runs once both
+        are released.
+        '''
+        core = self.core
+        document = self.document
+        lock = document.lock if document is not None else NO_LOCK
+        with lock.reading():
+            with core.lock, metrics.timer('deje_lua_call_seconds', function=event):
+                if event in self.resource.peek_content():
+                    runtime  = core.runtime
+                    function = bind(runtime)
+                    previous, core.active = core.active, self
+                    try:
+                        result = self.execute(runtime, event, function, calls)
+                    finally:
+                        core.active = previous
+                else:
+                    result = LuaObject(None)
+        self.api.process_queue()
 
         try:
             return result.cast(returntype)
         except LuaCastError as e:
             raise HandlerReturnError("Handler returned unexpected type", e)
 
+    def execute(self, runtime, event, funcbody, calls = 1):
+        '''
+        Run a handler function body within the document's budget, or
+        'calls' times that budget for a batch.
+        '''
+        budget  = self.budget
+        started = default_timer()
+        instructions = None
+        try:
+            if budget:
+                result, instructions = runtime.execute_limited(
+                    funcbody,
+                    scaled(budget.instructions, calls),
+                    scaled(budget.seconds, calls),
+                    budget.step
+                )
+            else:
+                result = runtime.execute(funcbody)
+        except BudgetExceeded as e:
+            self.api.queue = [] # Discard side effects of the aborted call
+            call_stats.record(event, default_timer() - started, e.instructions, True)
+            raise HandlerReturnError("Handler %s exceeded its budget" % event, e)
+        call_stats.record(event, default_timer() - started, instructions)
+        return result
+
+    def function(self, event):
+        return self.core.function(event, self.resource.peek_content()[event])
+
+    def resource_table(self, resource):
+        return self.core.resource_table(resource)
+
     def normalize_idents(self, identlist):
         results = []
         for ident in identlist:
-            if LuaObject(ident).is_list:
-                ident = LuaObject(ident).to_list()
             if isinstance(ident, Identity):
                 results.append(ident)
             else:
                 results.append(self.owner.identities.find_by_name(ident))
         return results
 
+    @property
+    def runtime(self):
+        return self.core.runtime
+
     @property
     def deje_module(self):
-        return self.api.export()
+        return self.runtime.runtime.globals().deje
 
     @property
     def document(self):
         return self.resource.document
 
+    @property
+    def budget(self):
+        if self.document:
+            return self.document.budget
+        return None
+
     @property
     def owner(self):
         return self.document.owner
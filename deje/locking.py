@@ -0,0 +1,160 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import threading
+import time
+
+class LockStats(object):
+    '''
+    Acquisition and contention counters for a lock.
+
+    An acquisition is "contended" if the caller had to wait for it.
+    '''
+    def __init__(self):
+        self.reads  = 0
+        self.writes = 0
+        self.contended_reads  = 0
+        self.contended_writes = 0
+        self.read_wait  = 0.0
+        self.write_wait = 0.0
+
+    def snapshot(self):
+        return {
+            'reads'  : self.reads,
+            'writes' : self.writes,
+            'contended_reads'  : self.contended_reads,
+            'contended_writes' : self.contended_writes,
+            'read_wait'  : self.read_wait,
+            'write_wait' : self.write_wait,
+        }
+
+class LockContext(object):
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+class RWLock(object):
+    '''
+    Reader/writer lock. Any number of readers, or one writer.
+
+    Writers are preferred, so a steady stream of reads can't starve event
+    enactment. Both sides are reentrant, and the thread holding the write
+    lock may also read. Upgrading a read lock to a write lock is not
+    supported, and raises RuntimeError rather than deadlocking.
+
+        with lock.reading():
+            do_reads()
+        with lock.writing():
+            do_writes()
+    '''
+    def __init__(self):
+        self._cond    = threading.Condition(threading.Lock())
+        self._local   = threading.local()
+        self._readers = 0
+        self._writer  = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self.stats = LockStats()
+
+        self._read_context  = LockContext(self.acquire_read,  self.release_read)
+        self._write_context = LockContext(self.acquire_write, self.release_write)
+
+    def _read_depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def reading(self):
+        return self._read_context
+
+    def writing(self):
+        return self._write_context
+
+    def acquire_read(self):
+        me = threading.current_thread()
+        with self._cond:
+            self.stats.reads += 1
+            if self._writer is me or self._read_depth():
+                self._local.depth = self._read_depth() + 1
+                return
+            if self._writer or self._waiting_writers:
+                self.stats.contended_reads += 1
+                started = time.time()
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+                self.stats.read_wait += time.time() - started
+            self._readers += 1
+            self._local.depth = 1
+
+    def release_read(self):
+        with self._cond:
+            self._local.depth -= 1
+            if self._writer is threading.current_thread():
+                return
+            if not self._local.depth:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self.stats.writes += 1
+                self._writer_depth += 1
+                return
+            if self._read_depth():
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self.stats.writes += 1
+            if self._writer or self._readers:
+                self.stats.contended_writes += 1
+                started = time.time()
+                self._waiting_writers += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self.stats.write_wait += time.time() - started
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+class NullLock(object):
+    '''
+    Same interface as RWLock, without doing any locking.
+
+    Used by objects that haven't opted in to concurrency.
+    '''
+    _context = LockContext(lambda: None, lambda: None)
+
+    def __init__(self):
+        self.stats = LockStats()
+
+    def reading(self):
+        return self._context
+
+    def writing(self):
+        return self._context
@@ -18,25 +18,325 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 # TODO: Replace this file with the usage of HardLupa
 
 import lupa
+from timeit import default_timer
 
 TABLE_CLASS   = lupa._lupa._LuaTable
 RUNTIME_CLASS = lupa.LuaRuntime
 
+# Oldest Lua whose runtimes can be shared between documents. On older
+# builds and LuaJIT, lupa can hand back the wrong Python object once Lua
+# has collected the wrappers of objects that went through a long-lived
+# runtime, so every interpreter there keeps a runtime of its own.
+SHARED_LUA_VERSION = (5, 4)
+
+_shareable = None
+
+def shareable():
+    '''
+    Whether runtimes of this Lua build are safe to share, decided once.
+    '''
+    global _shareable
+    if _shareable is None:
+        version = getattr(RUNTIME_CLASS(), 'lua_version', None)
+        _shareable = version is not None and tuple(version) >= SHARED_LUA_VERSION
+    return _shareable
+
+# Run once per runtime, before anything else. Builds 'base', the globals
+# every call frame reads through to, out of a copy of _G:
+#
+#  * Tables in it are read-only proxies, and so is base itself, which is
+#    also its own _G. A handler can't change what later calls see, even
+#    in another document with the same handler.
+#  * There's nothing that leads back to the real globals or the host:
+#    no debug, package, require, load and friends, getfenv/setfenv or
+#    python. Without debug, handlers can't clear the budget hook either.
+#  * rawset refuses the read-only tables, and the string metatable is
+#    hidden, since its __index is the real string library.
+#  * coroutine.create and wrap copy the creating thread's hook into the
+#    new coroutine, since hooks are per coroutine.
+#
+# Returns the real debug library, for the chunks below, base, and
+# expose(name, value), which adds a global to both _G and base.
+SANDBOX = '''
+local _G, debug, pairs, type, error = _G, debug, pairs, type, error
+local rawset, setmetatable, getmetatable = rawset, setmetatable, getmetatable
+local gethook, sethook = debug.gethook, debug.sethook
+local create, resume = coroutine.create, coroutine.resume
+
+local hidden = {
+    debug = true, package = true, require = true, module = true,
+    load = true, loadstring = true, loadfile = true, dofile = true,
+    getfenv = true, setfenv = true, python = true,
+}
+
+local protected = setmetatable({}, {__mode = "k"})
+local function deny()
+    error("attempt to modify a read-only table", 2)
+end
+local function readonly(t)
+    local proxy = setmetatable({}, {
+        __index = t, __newindex = deny, __metatable = false,
+    })
+    protected[proxy] = true
+    return proxy
+end
+
+local coroutines = {}
+for name, value in pairs(coroutine) do
+    coroutines[name] = value
+end
+coroutines.create = function(f)
+    local co = create(f)
+    local hook, mask, count = gethook()
+    if hook then
+        sethook(co, hook, mask, count)
+    end
+    return co
+end
+local function finish(ok, ...)
+    if not ok then
+        error((...), 0)
+    end
+    return ...
+end
+coroutines.wrap = function(f)
+    local co = coroutines.create(f)
+    return function(...)
+        return finish(resume(co, ...))
+    end
+end
+
+local base = {}
+local function expose(name, value)
+    rawset(_G, name, value)
+    if type(value) == "table" then
+        value = readonly(value)
+    end
+    rawset(base, name, value)
+end
+for name, value in pairs(_G) do
+    if not hidden[name] and name ~= "_G" then
+        expose(name, value)
+    end
+end
+expose("coroutine", coroutines)
+base._G = base
+base.rawset = function(t, key, value)
+    if protected[t] then
+        deny()
+    end
+    return rawset(t, key, value)
+end
+setmetatable(base, {__newindex = deny, __metatable = false})
+protected[base] = true
+
+getmetatable("").__metatable = false
+return debug, base, expose
+'''
+
+# Runs a compiled chunk under a count hook. Once the budget is exceeded,
+# the hook errors on every instruction outside the guard itself, so
+# handler code can't pcall its way past the limit.
+GUARD = '''
+local debug = ...
+local sethook, getinfo = debug.sethook, debug.getinfo
+local guard
+guard = function(f, step, limit, deadline, clock)
+    local count = 0
+    local exceeded = nil
+    local hook
+    hook = function()
+        if exceeded then
+            if getinfo(2, "f").func ~= guard then
+                error(exceeded)
+            end
+            return
+        end
+        count = count + step
+        if limit and count > limit then
+            exceeded = "instructions"
+        elseif deadline and clock() > deadline then
+            exceeded = "seconds"
+        else
+            return
+        end
+        sethook(hook, "", 1)
+        error(exceeded)
+    end
+    sethook(hook, "", step)
+    local ok, result = pcall(f)
+    sethook()
+    return ok, result, count, exceeded
+end
+return guard
+'''
+
+# Binds a compiled chunk to a fresh environment for one call. Reads fall
+# through to the sandbox base, writes stay in the frame. Lua 5.1 has
+# setfenv, later versions keep the environment in the chunk's first
+# upvalue, _ENV.
+FRAME = '''
+local debug, base = ...
+local setfenv, setupvalue, setmetatable = setfenv, debug.setupvalue, setmetatable
+local globals = {__index = base, __metatable = false}
+return function(f, env)
+    setmetatable(env, globals)
+    if setfenv then
+        setfenv(f, env)
+    else
+        setupvalue(f, 1, env)
+    end
+    return f
+end
+'''
+
+BATCH = '''
+local frame = ...
+return function(f, names, values, count)
+    local width = #names
+    return function()
+        local results = {}
+        for i = 1, count do
+            local env, base = {}, (i - 1) * width
+            for j = 1, width do
+                env[names[j]] = values[base + j]
+            end
+            results[i] = frame(f, env)()
+        end
+        return results
+    end
+end
+'''
+
+COPY = '''
+return function(source, dest)
+    for key, value in pairs(source) do
+        dest[key] = value
+    end
+    return dest
+end
+'''
+
+DEEP_COPY = '''
+local pairs, type = pairs, type
+local function copy(source)
+    local result = {}
+    for key, value in pairs(source) do
+        if type(value) == "table" then
+            value = copy(value)
+        end
+        result[key] = value
+    end
+    return result
+end
+return copy
+'''
+
 class LuaCastError(ValueError): pass
 
+class BudgetExceeded(Exception):
+    '''
+    A limited execution ran past its instruction or time budget.
+    '''
+    def __init__(self, kind, limit, instructions):
+        Exception.__init__(self, "%s budget of %r exceeded" % (kind, limit))
+        self.kind  = kind
+        self.limit = limit
+        self.instructions = instructions
+
+class Sequence(list):
+    '''
+    A list that Runtime.set_globals hands to Lua as a 1-indexed table, so
+    handlers can use # and ipairs(). Dict items become tables as well.
+    Other lists are passed through as Python objects, indexed from 0.
+    '''
+
+# Sorts a table into a sequence (keys exactly 1..n) or not, in one pass
+# inside Lua. Sequences come back unpacked, so they cross over to Python
+# in a single call rather than one call per element.
+SHAPE = '''
+local pairs, type, floor = pairs, type, math.floor
+local unpack = unpack or table.unpack
+local function slice(t, i, j)
+    return unpack(t, i, j)
+end
+local function shape(t, limit)
+    local n, top = 0, 0
+    for k in pairs(t) do
+        n = n + 1
+        if top and type(k) == "number" and k >= 1 and floor(k) == k then
+            if k > top then top = k end
+        else
+            top = nil
+        end
+    end
+    if n > 0 and top == n then
+        if n <= limit then
+            return true, n, unpack(t, 1, n)
+        end
+        return true, n
+    end
+    return false, n
+end
+return shape, slice
+'''
+
+# Largest sequence unpacked in one go, well under Lua's stack limits.
+UNPACK_LIMIT = 1000
+
+# Deeper than this, a table is assumed to contain itself.
+MAX_DEPTH = 100
+
+def to_python(value, depth=0):
+    '''
+    Recursively convert Lua tables into Python lists and dicts.
+
+    Tables whose keys are exactly 1..n become lists, anything else
+    (including empty tables) becomes a dict. Raises LuaCastError for
+    cyclic or absurdly deep tables. Runtime.to_python does the same job
+    with fewer round trips, when the runtime is at hand.
+    '''
+    if not isinstance(value, TABLE_CLASS):
+        return value
+    if depth > MAX_DEPTH:
+        raise LuaCastError('Lua table is cyclic, or nested too deeply')
+    items = list(value.items())
+    size  = len(items)
+    result = [None] * size
+    for key, item in items:
+        if type(key) is not int or not 0 < key <= size:
+            return dict(
+                (key, to_python(item, depth + 1)) for (key, item) in items
+            )
+        result[key - 1] = to_python(item, depth + 1)
+    if not size:
+        return {}
+    return result
+
 class LuaObject(object):
-    def __init__(self, value):
+    def __init__(self, value, runtime=None):
         if isinstance(value, LuaObject):
-            self.value = value.value
+            self.value   = value.value
+            self.runtime = runtime or value.runtime
         else:
-            self.value = value
+            self.value   = value
+            self.runtime = runtime
+
+    def to_python(self, value, depth=0):
+        if self.runtime:
+            return self.runtime.to_python(value, depth)
+        return to_python(value, depth)
 
     def cast(self, expected_type):
         value = self.value
-        if expected_type == list and self.is_list:
-            return self.to_list()
-        elif expected_type == dict and self.is_dict:
-            return self.to_dict()
+        # Fast path for plain values, like the bools from permission checks
+        if expected_type is object or type(value) is expected_type:
+            return value
+        if isinstance(value, TABLE_CLASS):
+            if expected_type == list:
+                return self.to_list()
+            elif expected_type == dict:
+                return self.to_dict()
         elif isinstance(value, expected_type):
             return value
         # If value was valid, we would have returned already
@@ -56,11 +356,31 @@ class LuaObject(object):
             return isinstance(self.value, comparing_type)
 
     def to_list(self):
-        table = self.value
-        return [table[i+1] for i in range(max(table.keys()))]
+        '''
+        Table with integer keys as a list, converting nested tables. Gaps
+        are filled with None.
+        '''
+        result = self.to_python(self.value)
+        if isinstance(result, list):
+            return result
+        items = list(self.value.items())
+        size  = 0
+        for key, item in items:
+            if not isinstance(key, int):
+                raise LuaCastError(
+                    'Could not cast %r to %r' % (self.value, list)
+                )
+            size = max(size, key)
+        result = [None] * size
+        for key, item in items:
+            if key > 0:
+                result[key - 1] = self.to_python(item, 1)
+        return result
 
     def to_dict(self):
-        return dict(self.value)
+        return dict(
+            (key, self.to_python(item, 1)) for (key, item) in self.value.items()
+        )
 
     @property
     def is_list(self):
@@ -79,6 +399,13 @@ class LuaObject(object):
 class Runtime(object):
     def __init__(self, **variables):
         self._runtime = RUNTIME_CLASS()
+        self._debug, self._base, self._expose = self._runtime.execute(SANDBOX)
+        self._guard = None
+        self._frame = None
+        self._batch = None
+        self._copy  = None
+        self._deep_copy = None
+        self._shape = None
         self.set_globals(variables)
 
     @property
@@ -86,12 +413,169 @@ class Runtime(object):
         return self._runtime
 
     def set_globals(self, variables):
-        lua_g = self.runtime.eval('_G')
+        '''
+        Add globals, which call frames see as read-only.
+        '''
         for key in variables:
-            lua_g[key] = variables[key]
+            self._expose(key, self._global(variables[key]))
+
+    def _global(self, value):
+        if isinstance(value, Sequence):
+            return self.table(value)
+        return value
+
+    def compile(self, code):
+        return self.runtime.compile(code)
+
+    def frame(self, function, variables):
+        '''
+        Bind a compiled chunk to a new call frame, an environment holding
+        the given variables on top of the globals. Globals the chunk sets
+        only last as long as the frame. Returns the bound chunk.
+        '''
+        return self._framer()(function, self._env(variables))
+
+    def batch(self, function, frames):
+        '''
+        A chunk that runs a compiled function once per dict of variables
+        in frames, each in its own call frame, all in one trip into Lua.
+        It returns a table of the results, in order.
+
+        Every frame must have the same variable names. The values cross
+        into Lua as one flat table, and the frames are built there.
+        '''
+        if self._batch is None:
+            self._batch = self.runtime.execute(BATCH, self._framer())
+        names = list(frames[0]) if frames else []
+        values = [
+            self._global(variables[name])
+            for variables in frames
+            for name in names
+        ]
+        return self._batch(
+            function,
+            self.runtime.table(*names),
+            self.runtime.table(*values),
+            len(frames)
+        )
+
+    def _framer(self):
+        if self._frame is None:
+            self._frame = self.runtime.execute(FRAME, self._debug, self._base)
+        return self._frame
+
+    def _env(self, variables):
+        env = self.runtime.table()
+        for key in variables:
+            env[key] = self._global(variables[key])
+        return env
+
+    def table(self, sequence):
+        items = []
+        for item in sequence:
+            if isinstance(item, dict):
+                item = self.runtime.table(**item)
+            items.append(item)
+        return self.runtime.table(*items)
+
+    def to_lua(self, value):
+        '''
+        Deep copy of JSON-style data as native Lua tables, which Lua code
+        can use without calling back into Python. Lists become 1-indexed
+        sequences. Anything else is passed through as-is.
+        '''
+        if isinstance(value, dict):
+            table = self.runtime.table()
+            for key in value:
+                table[key] = self.to_lua(value[key])
+            return table
+        elif isinstance(value, (list, tuple)):
+            return self.runtime.table(*[self.to_lua(item) for item in value])
+        return value
+
+    def to_python(self, value, depth=0):
+        '''
+        Same as the module-level to_python, but lets Lua sort out which
+        tables are sequences, and unpack them in bulk.
+        '''
+        if not isinstance(value, TABLE_CLASS):
+            return value
+        if depth > MAX_DEPTH:
+            raise LuaCastError('Lua table is cyclic, or nested too deeply')
+        if self._shape is None:
+            self._shape = self.runtime.execute(SHAPE)
+        shape, slice = self._shape
+        result = shape(value, UNPACK_LIMIT)
+        if not result[0]:
+            return dict(
+                (key, self.to_python(item, depth + 1))
+                for (key, item) in value.items()
+            )
+        size  = result[1]
+        items = list(result[2:])
+        while len(items) < size:
+            start = len(items) + 1
+            chunk = slice(value, start, min(size, start + UNPACK_LIMIT - 1))
+            if not isinstance(chunk, tuple):
+                chunk = (chunk,) # Single results aren't wrapped
+            items.extend(chunk)
+        return [self.to_python(item, depth + 1) for item in items]
+
+    def copy_table(self, source, dest):
+        '''
+        Shallow copy of one Lua table into another, entirely within Lua.
+        '''
+        if self._copy is None:
+            self._copy = self.runtime.execute(COPY)
+        return self._copy(source, dest)
+
+    def deep_copy(self, source):
+        '''
+        Deep copy of an acyclic Lua table, entirely within Lua.
+        '''
+        if self._deep_copy is None:
+            self._deep_copy = self.runtime.execute(DEEP_COPY)
+        return self._deep_copy(source)
 
     def eval(self, code):
-        return LuaObject(self.runtime.eval(code))
+        return LuaObject(self.runtime.eval(code), self)
 
     def execute(self, code):
-        return LuaObject(self.runtime.execute(code))
+        '''
+        Run Lua source, or a chunk that's already compiled.
+        '''
+        if callable(code):
+            return LuaObject(code(), self)
+        return LuaObject(self.runtime.execute(code), self)
+
+    def execute_limited(self, code, instructions=None, seconds=None, step=1000):
+        '''
+        Execute code under a debug hook that counts VM instructions, in
+        increments of 'step'. Returns (result, instructions counted).
+
+        Raises BudgetExceeded if more than 'instructions' are run, or the
+        code is still running after 'seconds'. Either limit may be None.
+        Code may be Lua source, or a chunk that's already compiled.
+        '''
+        if not callable(code):
+            code = self.compile(code)
+        if self._guard is None:
+            self._guard = self.runtime.execute(GUARD, self._debug)
+        deadline = None
+        if seconds is not None:
+            deadline = default_timer() + seconds
+
+        ok, result, count, exceeded = self._guard(
+            code,
+            step,
+            instructions,
+            deadline,
+            default_timer
+        )
+        if exceeded == "instructions":
+            raise BudgetExceeded(exceeded, instructions, count)
+        elif exceeded == "seconds":
+            raise BudgetExceeded(exceeded, seconds, count)
+        elif not ok:
+            raise lupa.LuaError(result)
+        return LuaObject(result, self), count
@@ -0,0 +1,194 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from persei import String
+from ejtp.util.hasher import make, strict
+
+def split_path(path):
+    return [segment for segment in path.split('/') if segment]
+
+def join_path(segments):
+    return '/' + '/'.join(segments)
+
+class MerkleNode(object):
+    '''
+    One directory level of a MerkleTree.
+
+    'leaves' maps the paths of resources that live at this level to their
+    checksums. Hashes are computed lazily, and invalidated all the way up
+    to the root whenever something below changes.
+    '''
+    def __init__(self):
+        self.children = {}
+        self.leaves   = {}
+        self._hash    = None
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            leaves   = sorted(self.leaves.items())
+            children = sorted(
+                (name, child.hash) for (name, child) in self.children.items()
+            )
+            self._hash = make(strict([leaves, children]))
+        return self._hash
+
+    @property
+    def empty(self):
+        return not (self.leaves or self.children)
+
+    def paths(self):
+        '''
+        All resource paths at or below this node.
+        '''
+        result = list(self.leaves.keys())
+        for child in self.children.values():
+            result.extend(child.paths())
+        return result
+
+    def describe(self):
+        '''
+        Serializable summary, for comparison with a remote tree.
+        '''
+        children = {}
+        for name, child in self.children.items():
+            children[name] = child.hash
+        return {
+            'hash'     : self.hash,
+            'leaves'   : dict(self.leaves),
+            'children' : children,
+        }
+
+    def copy(self):
+        result = MerkleNode()
+        result.leaves = dict(self.leaves)
+        result._hash  = self._hash
+        for name, child in self.children.items():
+            result.children[name] = child.copy()
+        return result
+
+class MerkleTree(object):
+    '''
+    Hash tree over resource paths, following the path hierarchy.
+
+    Nodes are addressed by directory-style paths ('/', '/zones',
+    '/zones/example.com'). Two trees with the same root hash hold the same
+    resources, and diverging subtrees can be found one level at a time.
+    '''
+    def __init__(self, checksums = {}):
+        self.root = MerkleNode()
+        for path in checksums:
+            self.update(path, checksums[path])
+
+    @property
+    def hash(self):
+        return self.root.hash
+
+    def _walk(self, segments, create = False):
+        '''
+        Returns list of nodes from root to target, or None if missing.
+        '''
+        node  = self.root
+        nodes = [node]
+        for segment in segments:
+            if segment not in node.children:
+                if not create:
+                    return None
+                node.children[segment] = MerkleNode()
+            node = node.children[segment]
+            nodes.append(node)
+        return nodes
+
+    def update(self, path, checksum):
+        nodes = self._walk(split_path(path), True)
+        nodes[-1].leaves[path] = checksum
+        for node in nodes:
+            node._hash = None
+
+    def remove(self, path):
+        segments = split_path(path)
+        nodes = self._walk(segments)
+        if not nodes or path not in nodes[-1].leaves:
+            raise KeyError(path)
+        del nodes[-1].leaves[path]
+        for node in nodes:
+            node._hash = None
+
+        # Prune empty directories
+        for i in range(len(segments), 0, -1):
+            if not nodes[i].empty:
+                break
+            del nodes[i-1].children[segments[i-1]]
+
+    def node(self, nodepath):
+        nodes = self._walk(split_path(nodepath))
+        if nodes:
+            return nodes[-1]
+        return None
+
+    def describe(self, nodepath):
+        node = self.node(nodepath)
+        if node:
+            return node.describe()
+        return None
+
+    def paths(self, nodepath = '/'):
+        node = self.node(nodepath)
+        if node:
+            return node.paths()
+        return []
+
+    def compare(self, nodepath, remote):
+        '''
+        Compare a local node against a remote node description.
+
+        Returns (fetch, removed, descend): resource paths that differ or
+        only exist remotely, paths that only exist locally, and child node
+        paths that need to be compared next.
+        '''
+        local   = self.node(nodepath)
+        segments = split_path(nodepath)
+        fetch   = []
+        removed = []
+        descend = []
+
+        if remote is None:
+            return fetch, self.paths(nodepath), descend
+        if local is None:
+            local = MerkleNode()
+        if local.hash == String(remote['hash']):
+            return fetch, removed, descend
+
+        for path, checksum in remote['leaves'].items():
+            if local.leaves.get(path) != String(checksum):
+                fetch.append(path)
+        for path in local.leaves:
+            if path not in remote['leaves']:
+                removed.append(path)
+        for name, child_hash in remote['children'].items():
+            child = local.children.get(name)
+            if child is None or child.hash != String(child_hash):
+                descend.append(join_path(segments + [name]))
+        for name, child in local.children.items():
+            if name not in remote['children']:
+                removed.extend(child.paths())
+        return fetch, removed, descend
+
+    def copy(self):
+        result = MerkleTree()
+        result.root = self.root.copy()
+        return result
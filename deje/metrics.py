@@ -0,0 +1,247 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import os
+import socket
+import threading
+from timeit import default_timer
+
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001,
+    0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+)
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Histogram(object):
+    '''
+    Counts observations into cumulative buckets, Prometheus style.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * len(self.buckets)
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum   += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self):
+        return Timer(self)
+
+    def cumulative(self):
+        total  = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self):
+        return {
+            'count'   : self.count,
+            'sum'     : self.sum,
+            'buckets' : dict(self.cumulative()),
+        }
+
+class Timer(object):
+    '''
+    Context manager that observes its elapsed time, in seconds.
+    '''
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = default_timer()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.histogram.observe(default_timer() - self.started)
+
+class NullMetric(object):
+    '''
+    Stands in for every metric type while metrics are disabled.
+    '''
+    def inc(self, amount = 1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+NULL_METRIC = NullMetric()
+
+def series_name(name, labels):
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ",".join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for (k, v) in labels
+    ))
+
+class Registry(object):
+    '''
+    Collection of named metrics, each optionally split by labels.
+
+    Disabled registries hand out NULL_METRIC, so instrumented code costs
+    one function call and a flag check when nobody is collecting.
+    '''
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.metrics = {}
+        self._lock   = threading.Lock()
+
+    def _get(self, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(key, cls())
+        if not isinstance(metric, cls):
+            raise TypeError("%s is already registered as a %s" % (name, metric.kind))
+        return metric
+
+    def counter(self, name, **labels):
+        if not self.enabled:
+            return NULL_METRIC
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        if not self.enabled:
+            return NULL_METRIC
+        return self._get(Histogram, name, labels)
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NULL_METRIC
+        return self._get(Histogram, name, labels).time()
+
+    def clear(self):
+        with self._lock:
+            self.metrics = {}
+
+    def snapshot(self):
+        '''
+        Current values, keyed by series name. Counters are numbers,
+        histograms are dicts of count, sum and cumulative buckets.
+        '''
+        return dict(
+            (series_name(name, labels), metric.snapshot())
+            for ((name, labels), metric) in list(self.metrics.items())
+        )
+
+    def render(self):
+        '''
+        All metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        typed = set()
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda i: i[0]):
+            if name not in typed:
+                lines.append("# TYPE %s %s" % (name, metric.kind))
+                typed.add(name)
+            if metric.kind == 'counter':
+                lines.append("%s %r" % (series_name(name, labels), metric.value))
+                continue
+            for bound, count in metric.cumulative():
+                lines.append("%s %d" % (
+                    series_name(name + '_bucket', labels + (('le', repr(bound)),)),
+                    count
+                ))
+            lines.append("%s %d" % (
+                series_name(name + '_bucket', labels + (('le', '+Inf'),)),
+                metric.count
+            ))
+            lines.append("%s %r" % (series_name(name + '_sum', labels), metric.sum))
+            lines.append("%s %d" % (series_name(name + '_count', labels), metric.count))
+        return "\n".join(lines) + "\n"
+
+    def export_file(self, filename):
+        '''
+        Write render() output to a file, for node_exporter's textfile
+        collector or similar. The file is replaced atomically.
+        '''
+        temp = filename + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.render())
+        os.rename(temp, filename)
+
+    def export_socket(self, address):
+        '''
+        Send render() output over TCP to (host, port), or to a Unix socket
+        if address is a string.
+        '''
+        if isinstance(address, tuple):
+            sock = socket.create_connection(address)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        try:
+            sock.sendall(self.render().encode('utf-8'))
+        finally:
+            sock.close()
+
+# Process-wide default registry, used by DEJE's own instrumentation.
+registry = Registry()
+
+def enable():
+    registry.enabled = True
+
+def disable():
+    registry.enabled = False
+
+def counter(name, **labels):
+    if not registry.enabled:
+        return NULL_METRIC
+    return registry.counter(name, **labels)
+
+def histogram(name, **labels):
+    if not registry.enabled:
+        return NULL_METRIC
+    return registry.histogram(name, **labels)
+
+def timer(name, **labels):
+    if not registry.enabled:
+        return NULL_METRIC
+    return registry.timer(name, **labels)
+
+def snapshot():
+    return registry.snapshot()
@@ -25,6 +25,8 @@ import ejtp.router
 from ejtp import identity
 from deje import protocol
 from deje import errors
+from deje import metrics
+from deje.interpreter import HandlerRegistry
 
 from deje.protocol.message import DEJEMessage
 
@@ -32,13 +34,19 @@ class Owner(object):
     '''
     Manages documents, identities, and an EJTP client.
     '''
-    def __init__(self, self_ident, router=None, make_jack=True):
+    def __init__(self, self_ident, router=None, make_jack=True, concurrent=False):
         self.identities = identity.IdentityCache()
         self.identities.update_ident(self_ident)
         self.identity = self_ident
+        self.concurrent = concurrent
+
+        # Query ids are always qid_offset, mod qid_stride. See ShardRouter.
+        self.qid_offset = 0
+        self.qid_stride = 1
 
         self.router    = router or ejtp.router.Router()
         self.documents = {}
+        self.handlers  = HandlerRegistry()
         self.protocol  = protocol.ProtocolToplevel(self)
         self.client    = ejtp.client.Client(
             self.router,
@@ -60,7 +68,30 @@ class Owner(object):
 
     def own_document(self, document):
         document._owner = self
+        if self.concurrent:
+            document.enable_locking()
         self.documents[document.name] = document
+        document.register_handler(self.handlers)
+
+    def lock_stats(self):
+        '''
+        Lock contention metrics for every owned document, plus subscriptions.
+        '''
+        stats = dict(
+            (name, doc.lock_stats)
+            for (name, doc) in self.documents.items()
+        )
+        return {
+            'documents': stats,
+            'subscriptions': self.protocol.find('deje-sub').lock.stats.snapshot(),
+        }
+
+    def new_qid(self):
+        '''
+        Random id for a query we send, so we can match up the response.
+        '''
+        stride = self.qid_stride
+        return randint(0, 2**32 // stride) * stride + self.qid_offset
 
     # EJTP callbacks
 
@@ -82,21 +113,24 @@ class Owner(object):
         if participants:
             targets.update(ident.key for ident in document.get_participants())
         if subscribers:
-            targets.update(document.subscribers)
+            readers = document.filter_readers(document.subscribers)
+            targets.update(ident.key for ident in readers)
 
         message = { 'type':mtype, 'docname':document.name }
         message.update(properties)
 
-        for target in targets:
-            if hasattr(target, 'location'):
-                address = target.location
-            else:
-                try:
-                    address = self.identities.find_by_location(target).location
-                except KeyError:
-                    print("No known address for %r, skipping" % target)
-                    break
-            self.client.write_json(address, message)
+        with metrics.timer('deje_transmit_seconds', type=mtype):
+            for target in targets:
+                if hasattr(target, 'location'):
+                    address = target.location
+                else:
+                    try:
+                        address = self.identities.find_by_location(target).location
+                    except KeyError:
+                        print("No known address for %r, skipping" % target)
+                        break
+                self.client.write_json(address, message)
+                metrics.counter('deje_messages_sent_total', type=mtype).inc()
         return targets
 
     def reply(self, document, mtype, properties, target):
@@ -107,11 +141,26 @@ class Owner(object):
 
     # Network actions
 
-    def get_events(self, document, callback, start=None, end=None):
-        qid = randint(0, 2**32)
+    def get_events(self, document, callback, start=None, end=None, page_size=None, token=None):
+        '''
+        Retrieve events from the document's participants.
+
+        Without a page_size, the callback is called once, with the whole
+        range. With a page_size, the range is streamed from the first
+        participant to answer, and the callback is called once per page.
+        Pass the hash of the last event you have as token to resume an
+        interrupted stream.
+        '''
+        qid = self.new_qid()
+        source = []
         def wrapped(sender, **kwargs):
-            if kwargs['qid'] == qid:
-                callback(kwargs['events'])
+            if kwargs['qid'] != qid:
+                return
+            if source and source[0] != kwargs['source']:
+                return # Already streaming from another participant
+            source[:] = [kwargs['source']]
+            callback(kwargs['events'])
+            if kwargs['done']:
                 document.signals['recv-events'].disconnect(wrapped)
         document.signals['recv-events'].connect(wrapped)
 
@@ -120,6 +169,10 @@ class Owner(object):
             arguments['start'] = start
         if end != None:
             arguments['end'] = end
+        if page_size != None:
+            arguments['page_size'] = page_size
+        if token != None:
+            arguments['token'] = token
 
         return self.transmit(
             document,
@@ -130,20 +183,30 @@ class Owner(object):
         )
 
     def get_state(self, document, version, callback):
-        qid = randint(0, 2**32)
+        '''
+        Retrieve the document state at a given version.
+
+        If our current version is one the participants can regenerate, only
+        the resources that differ from it are transferred.
+        '''
+        qid = self.new_qid()
         def wrapped(sender, **kwargs):
             if kwargs['qid'] == qid:
                 callback(kwargs['state'])
                 document.signals['recv-state'].disconnect(wrapped)
         document.signals['recv-state'].connect(wrapped)
 
+        arguments = {
+            'qid': qid,
+            'version':String(version),
+        }
+        if document.version in document._history.events_by_hash:
+            arguments['have'] = document.version
+
         self.transmit(
             document,
             'deje-retrieve-state-query',
-            {
-                'qid': qid,
-                'version':String(version),
-            },
+            arguments,
             participants = True,
             subscribers = False
         )
@@ -20,6 +20,7 @@ from persei import *
 
 from deje.protocol.handler import ProtocolHandler
 from deje.action import Action
+from deje.event import Event
 
 class PaxosHandler(ProtocolHandler):
     '''
@@ -113,6 +114,10 @@ class PaxosHandler(ProtocolHandler):
             quorum.sign(self.owner.identity)
             self.send_accepted(doc, action)
             self.check_quorum(doc, action)
+            # Work out the post-state while the other votes come in,
+            # unless none are left to wait for
+            if isinstance(action, Event) and not quorum.done:
+                doc.speculate(action)
 
     def _on_accepted(self, message):
         sender = self.owner.identities.find_by_location(message.sender)
@@ -136,4 +141,5 @@ class PaxosHandler(ProtocolHandler):
             sender = self.owner.identities.find_by_location(signer)
             sig = RawData(sigs[signer])
             quorum.sign(sender, sig)
-        action.enact(quorum, doc)
+        if not action.is_done(doc):
+            action.enact(quorum, doc)
@@ -19,15 +19,30 @@ from __future__ import absolute_import
 from persei import *
 
 from deje.protocol.handler import ProtocolHandler
+from deje                  import errors
+from deje.historystate     import HistoryState
 
 class RetrieveHandler(ProtocolHandler):
 
     def __init__(self, parent):
         ProtocolHandler.__init__(self, parent)
-        self._on_events = RetrieveEventsHandler(self)
-        self._on_state  = RetrieveStateHandler(self)
+        self._on_events    = RetrieveEventsHandler(self)
+        self._on_state     = RetrieveStateHandler(self)
+        self._on_merkle    = RetrieveMerkleHandler(self)
+        self._on_resources = RetrieveResourcesHandler(self)
 
 class RetrieveEventsHandler(ProtocolHandler):
+    '''
+    Retrieve a range of events from the document history.
+
+    Queries may include a 'page_size', in which case the range is streamed
+    back as a series of responses of at most that many events. Every page
+    carries a continuation 'token' (the hash of its last event) which can be
+    sent back as 'token' in a new query to resume after that point, and the
+    last page is marked 'done'.
+
+    deje-retrieve-events-*
+    '''
 
     def _on_query(self, message):
         qid    = message.qid
@@ -36,34 +51,68 @@ class RetrieveEventsHandler(ProtocolHandler):
         if not doc.can_read(sender):
             return message.error(errors.PERMISSION_CANNOT_READ)
 
-        if 'start' in message:
-            h = String(message['start'])
+        with doc.lock.reading():
             try:
-                start = doc._history.event_index_by_hash(h)
+                start, end = self.range(doc, message)
             except KeyError:
-                return # TODO: Respond with error
+                # Unknown or stale hash. Answer with an empty last page,
+                # so the requester isn't left waiting.
+                start, end = 0, -1
+
+        if 'page_size' in message:
+            page_size = max(1, int(message['page_size']))
+        else:
+            page_size = max(1, end + 1 - start)
+
+        for page in self.pages(doc, start, end + 1, page_size):
+            page['qid'] = qid
+            self.owner.reply(
+                doc,
+                'deje-retrieve-events-response',
+                page,
+                sender.key
+            )
+
+    def range(self, doc, message):
+        '''
+        The first and last event index a query asks for. Raises KeyError
+        if it names an event that isn't in the history.
+        '''
+        history = doc._history
+        if 'token' in message:
+            start = history.event_index_by_hash(String(message['token'])) + 1
+        elif 'start' in message:
+            start = history.event_index_by_hash(String(message['start']))
         else:
             start = 0
 
         if 'end' in message:
-            h = String(message['end'])
-            try:
-                end = doc._history.event_index_by_hash(h)
-            except KeyError:
-                return # TODO: Respond with error
+            end = history.event_index_by_hash(String(message['end']))
         else:
-            end = len(doc._history.events) - 1
+            end = len(history.events) - 1
+        return start, end
 
-        events = [x.serialize() for x in doc._history.events[start:end+1]]
-        self.owner.reply(
-            doc,
-            'deje-retrieve-events-response',
-            {
-                'qid': qid,
+    def pages(self, doc, start, stop, page_size):
+        '''
+        Generate response bodies for events[start:stop], one page at a time,
+        so only a single page is ever serialized in memory.
+        '''
+        while True:
+            with doc.lock.reading():
+                page_stop = min(stop, start + page_size)
+                events = list(doc._history.serialize_events(start, page_stop))
+                token = None
+                if page_stop > start:
+                    token = doc._history.events[page_stop - 1].hash()
+            done = page_stop >= stop
+            yield {
                 'events': events,
-            },
-            sender.key
-        )
+                'token' : token,
+                'done'  : done,
+            }
+            if done:
+                return
+            start = page_stop
 
     def _on_response(self, message):
         qid    = message.qid
@@ -72,14 +121,34 @@ class RetrieveEventsHandler(ProtocolHandler):
         if sender not in doc.get_participants():
             return message.error(errors.PERMISSION_DOCINFO_NOT_PARTICIPANT, data="event")
         events  = message['events']
+        token   = None
+        done    = True
+        if 'token' in message:
+            token = message['token']
+        if 'done' in message:
+            done = message['done']
 
         doc.signals['recv-events'].send(
             self,
             qid=qid,
-            events=events
+            events=events,
+            token=token,
+            done=done,
+            source=message.sender
         )
 
 class RetrieveStateHandler(ProtocolHandler):
+    '''
+    Retrieve the document state at a given version.
+
+    If the query says which version the requester already 'have's, and the
+    responder can generate that version from its history, the response is
+    a resource-level 'delta' against it. Otherwise, the full 'state' is sent.
+    Either way, the 'digest' of the state is included, so the requester can
+    check what it ends up with.
+
+    deje-retrieve-state-*
+    '''
 
     def _on_query(self, message):
         qid    = message.qid
@@ -88,14 +157,23 @@ class RetrieveStateHandler(ProtocolHandler):
         if not doc.can_read(sender):
             return message.error(errors.PERMISSION_CANNOT_READ)
         version = message['version']
-        state = doc._history.generate_state(version).serialize()
+        content = { 'qid': qid }
+        with doc.lock.reading():
+            state = doc.state_at(version)
+            content['digest'] = state.digest
+            base  = None
+            if 'have' in message:
+                have = String(message['have'])
+                if have in doc._history.events_by_hash:
+                    base = doc.state_at(have)
+            if base:
+                content['delta'] = state.delta_from(base)
+            else:
+                content['state'] = state.serialize()
         self.owner.reply(
             doc,
             'deje-retrieve-state-response',
-            {
-                'qid'  : qid,
-                'state': state,
-            },
+            content,
             sender.key
         )
 
@@ -105,9 +183,166 @@ class RetrieveStateHandler(ProtocolHandler):
         sender = self.owner.identities.find_by_location(message.sender)
         if sender not in doc.get_participants():
             return message.error(errors.PERMISSION_DOCINFO_NOT_PARTICIPANT, data="state")
-        state = message['state']
+        digest = 'digest' in message and String(message['digest']) or None
+        if 'delta' in message:
+            delta = message['delta']
+            try:
+                # Detached, so patching it doesn't notify our handler
+                with doc.lock.reading():
+                    state = doc.state_at(String(delta['base'])).detached()
+                state.apply_delta(delta)
+                if digest and state.digest != digest:
+                    raise KeyError("Patched state does not match digest")
+            except KeyError:
+                # We no longer have the base version, or it differs from
+                # the sender's, so ask for everything
+                return self.send(
+                    doc,
+                    'deje-retrieve-state-query',
+                    {
+                        'qid': qid,
+                        'version': delta['hash'],
+                    },
+                    sender.key
+                )
+            state = state.serialize()
+        else:
+            state = message['state']
+            if digest:
+                received = HistoryState()
+                received.deserialize(state)
+                if received.digest != digest:
+                    return message.error(errors.STATE_DIGEST_MISMATCH)
         doc.signals['recv-state'].send(
             self,
             qid=qid,
             state=state
         )
+
+class RetrieveMerkleHandler(ProtocolHandler):
+    '''
+    Compare the Merkle trees of two participants' current states, one level
+    of the path hierarchy per round trip, to find which resources differ.
+
+    deje-retrieve-merkle-*
+    '''
+
+    def diff(self, doc, source, callback):
+        '''
+        Callback will be called with args (fetch, removed): the paths that
+        differ or only exist on source, and the paths that only exist here.
+        '''
+        fetch   = []
+        removed = []
+        def on_nodes(nodes):
+            descend = []
+            with doc.lock.reading():
+                tree = doc._current.merkle
+                for nodepath in nodes:
+                    f, r, d = tree.compare(nodepath, nodes[nodepath])
+                    fetch.extend(f)
+                    removed.extend(r)
+                    descend.extend(d)
+            if descend:
+                self.query(doc, source, descend, on_nodes)
+            else:
+                callback(fetch, removed)
+        self.query(doc, source, ['/'], on_nodes)
+
+    def query(self, doc, source, nodes, callback):
+        qid = self.toplevel._query(callback)
+        self.send(
+            doc,
+            'deje-retrieve-merkle-query',
+            {
+                'qid'  : qid,
+                'nodes': nodes,
+            },
+            self.identity(source).key
+        )
+
+    def _on_query(self, message):
+        qid    = message.qid
+        doc    = message.doc
+        sender = self.identity(message.sender)
+        if not doc.can_read(sender):
+            return message.error(errors.PERMISSION_CANNOT_READ)
+        nodes = {}
+        with doc.lock.reading():
+            tree = doc._current.merkle
+            for nodepath in message['nodes']:
+                nodes[nodepath] = tree.describe(nodepath)
+        self.send(
+            doc,
+            'deje-retrieve-merkle-response',
+            {
+                'qid'  : qid,
+                'nodes': nodes,
+            },
+            sender.key
+        )
+
+    def _on_response(self, message):
+        doc    = message.doc
+        sender = self.identity(message.sender)
+        if sender not in doc.get_participants():
+            return message.error(errors.PERMISSION_DOCINFO_NOT_PARTICIPANT, data="merkle")
+        self.toplevel._on_response(message.qid, [message['nodes']])
+
+class RetrieveResourcesHandler(ProtocolHandler):
+    '''
+    Retrieve specific resources from a participant's current state.
+
+    deje-retrieve-resources-*
+    '''
+
+    def get(self, doc, source, paths, callback):
+        '''
+        Callback will be called with args (resources, missing), where
+        resources is a dict of { path : serialized resource }.
+        '''
+        qid = self.toplevel._query(callback)
+        self.send(
+            doc,
+            'deje-retrieve-resources-query',
+            {
+                'qid'  : qid,
+                'paths': paths,
+            },
+            self.identity(source).key
+        )
+
+    def _on_query(self, message):
+        qid    = message.qid
+        doc    = message.doc
+        sender = self.identity(message.sender)
+        if not doc.can_read(sender):
+            return message.error(errors.PERMISSION_CANNOT_READ)
+        resources = {}
+        missing   = []
+        with doc.lock.reading():
+            for path in message['paths']:
+                if path in doc._current.resources:
+                    resources[path] = doc._current.resources[path].serialize()
+                else:
+                    missing.append(path)
+        self.send(
+            doc,
+            'deje-retrieve-resources-response',
+            {
+                'qid'      : qid,
+                'resources': resources,
+                'missing'  : missing,
+            },
+            sender.key
+        )
+
+    def _on_response(self, message):
+        doc    = message.doc
+        sender = self.identity(message.sender)
+        if sender not in doc.get_participants():
+            return message.error(errors.PERMISSION_DOCINFO_NOT_PARTICIPANT, data="resource")
+        self.toplevel._on_response(
+            message.qid,
+            [message['resources'], message['missing']]
+        )
@@ -20,6 +20,7 @@ from persei import *
 
 from deje.protocol.handler import ProtocolHandler
 from deje.subscription     import Subscription
+from deje.locking          import RWLock, NullLock
 from deje                  import errors
 
 class SubscriptionHandler(ProtocolHandler):
@@ -27,23 +28,31 @@ class SubscriptionHandler(ProtocolHandler):
     def __init__(self, parent):
         ProtocolHandler.__init__(self, parent)
         self.subscriptions = {}
+        if self.owner.concurrent:
+            self.lock = RWLock()
+        else:
+            self.lock = NullLock()
 
         self._on_add    = SubAddHandler(self)
         self._on_remove = SubRemoveHandler(self)
         self._on_list   = SubListHandler(self)
 
     def subscribe(self, sub):
-        self.subscriptions[sub.hash()] = sub
+        with self.lock.writing():
+            self.subscriptions[sub.hash()] = sub
 
     def unsubscribe(self, hash):
-        if hash in self.subscriptions:
-            del self.subscriptions[hash]
+        with self.lock.writing():
+            if hash in self.subscriptions:
+                del self.subscriptions[hash]
 
     def subscribers(self, doc):
         name = doc.name
+        with self.lock.reading():
+            subs = list(self.subscriptions.values())
         return tuple(
-            self.identity(s.target) for s in self.subscriptions.values()
-            if s.source == self.owner.identity.location
+            self.identity(s.target) for s in subs
+            if s.source == self.owner.identity.location and s.doc == name
         )
 
 class SubAddHandler(ProtocolHandler):
@@ -125,8 +134,9 @@ class SubRemoveHandler(ProtocolHandler):
         qid  = message.qid
         subh = String(message['hash'])
 
-        success = subh in self.parent.subscriptions
-        self.parent.unsubscribe(subh)
+        with self.parent.lock.writing():
+            success = subh in self.parent.subscriptions
+            self.parent.unsubscribe(subh)
         self.send(
             message.doc,
             'deje-sub-remove-response',
@@ -165,25 +175,36 @@ class SubListHandler(ProtocolHandler):
 
         self.write_json(ident.location, content)
 
+    def list_subs(self, target, hashes=None):
+        '''
+        Serialized subscriptions, by hash. Without hashes, every subscription
+        from us to target. Hashes we don't know about are left out.
+        '''
+        subscriptions = self.parent.subscriptions
+        with self.parent.lock.reading():
+            if hashes is None:
+                hashes = [
+                    s.hash() for s in subscriptions.values()
+                    if s.source == self.owner.identity.location
+                        and s.target == target
+                ]
+
+            subs = {}
+            for h in hashes:
+                sub = subscriptions.get(String(h))
+                if sub is not None:
+                    subs[h] = sub.serialize()
+        return subs
+
     def _on_query(self, message):
-        qid = message.qid
+        hashes = None
         if 'hashes' in message:
             hashes = message['hashes']
-        else:
-            hashes = [
-                s.hash() for s in self.parent.subscriptions.values()
-                if s.source == self.owner.identity.location
-                    and s.target == message.sender
-            ]
-
-        subs = {}
-        for h in hashes:
-            subs[h] = self.parent.subscriptions[h].serialize()
 
         content = {
             'type': 'deje-sub-list-response',
-            'qid' : qid,
-            'subs': subs,
+            'qid' : message.qid,
+            'subs': self.list_subs(message.sender, hashes),
         }
         self.write_json(message.sender, content)
 
@@ -16,9 +16,9 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import absolute_import
-from random import randint
 
 from deje import errors
+from deje import metrics
 from deje.protocol.deje import DejeHandler
 
 class ProtocolToplevel(object):
@@ -58,13 +58,14 @@ class ProtocolToplevel(object):
         if not callable(handler):
             return message.error(errors.MSG_UNKNOWN_TYPE, data=mtype)
 
-        return handler(message)
+        with metrics.timer('deje_protocol_call_seconds', type=mtype):
+            return handler(message)
 
     def _register(self, qid, callback):
         self.callbacks[qid] = callback
 
     def _query(self, callback):
-        qid = randint(0, 2**32)
+        qid = self.owner.new_qid()
         self._register(qid, callback)
         return qid
 
@@ -107,6 +108,25 @@ class ProtocolToplevel(object):
         handler = self.find('deje-sub-list')
         handler.get_subs(source, callback)
 
+    def sync_resources(self, doc, source, callback):
+        '''
+        Find and fetch only the resources where source's current state
+        differs from ours, using Merkle tree comparison.
+
+        Callback will be called with args (resources, removed), where
+        resources is a dict of { path : serialized resource } to add or
+        replace, and removed is a list of paths source doesn't have.
+        '''
+        def on_diff(fetch, removed):
+            if not fetch:
+                return callback({}, removed)
+            def on_resources(resources, missing):
+                callback(resources, removed + missing)
+            self.find('deje-retrieve-resources').get(
+                doc, source, fetch, on_resources
+            )
+        self.find('deje-retrieve-merkle').diff(doc, source, on_diff)
+
     def error(self, recipients, code, msg="", data={}, qid=0):
         for r in recipients:
             self.owner.client.write_json(r, {
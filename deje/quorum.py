@@ -19,6 +19,7 @@ import datetime
 from persei import *
 
 from ejtp.identity import Identity
+from deje import metrics
 
 DEFAULT_DURATION = datetime.timedelta(minutes = 5)
 
@@ -41,9 +42,14 @@ class Quorum(object):
         if key not in self.signatures:
             return False
         identity, signature = self.signatures[key]
-        return (identity in self.participants) and validate_signature(identity, self.hash, signature)
+        with metrics.timer('deje_quorum_sig_valid_seconds'):
+            return (identity in self.participants) and validate_signature(identity, self.hash, signature)
 
     def sign(self, identity, signature = None, duration = DEFAULT_DURATION):
+        with metrics.timer('deje_quorum_sign_seconds'):
+            self._sign(identity, signature, duration)
+
+    def _sign(self, identity, signature, duration):
         if not signature:
             signature = generate_signature(identity, self.hash, duration)
         assert_valid_signature(identity, self.hash, signature)
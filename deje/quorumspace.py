@@ -23,12 +23,18 @@ class QuorumSpace(object):
         self.by_author = {}
         self.by_hash = {}
 
+    @property
+    def lock(self):
+        return self.document.lock
+
     def on_sign(self, identity, quorum):
-        self.by_author[identity.key] = quorum
+        with self.lock.writing():
+            self.by_author[identity.key] = quorum
 
     def register(self, quorum):
-        self.by_hash[quorum.hash] = quorum
-        quorum.qs = self
+        with self.lock.writing():
+            self.by_hash[quorum.hash] = quorum
+            quorum.qs = self
 
     def get_quorum(self, action):
         '''
@@ -37,16 +43,20 @@ class QuorumSpace(object):
         Newly-created quorums are automatically registered.
         '''
         h = action.hash()
-        if not h in self.by_hash:
-            self.register(quorum.Quorum(action))
-        return self.by_hash[h]
+        with self.lock.writing():
+            if not h in self.by_hash:
+                self.register(quorum.Quorum(action))
+            return self.by_hash[h]
 
     def get_competing_actions(self):
         "Get all read and write actions in QS"
-        return [x.action for x in self.by_hash.values() if x.competing]
+        with self.lock.reading():
+            quorums = list(self.by_hash.values())
+        return [x.action for x in quorums if x.competing]
 
     def get_known_actions(self):
-        return [x.action for x in self.by_hash.values()]
+        with self.lock.reading():
+            return [x.action for x in self.by_hash.values()]
 
     def transaction(self, identity, quorum):
         return QSTransaction(self, identity, quorum)
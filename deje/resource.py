@@ -17,14 +17,51 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 
 import mimetypes
 from persei import *
+from ejtp.util.hasher import checksum
 from deje.interpreter import LuaInterpreter
+from deje.tracked import track, Tracked
+
+try:
+    from sys import intern
+except ImportError:
+    pass # Builtin on Python 2
+
+def intern_string(value):
+    '''
+    Exported, interned copy of a string, so that equal paths and types
+    across cloned states share one object.
+    '''
+    value = String(value).export()
+    try:
+        return intern(value)
+    except TypeError:
+        return value # Python 2 can't intern unicode
+
+EMPTY_COMMENT = intern_string('')
 
 class Resource(object):
+    '''
+    A single path in a document: its content, MIME type, and comment.
+
+    Slotted, because there's one per path in every HistoryState, and
+    states get cloned a lot.
+    '''
+    __slots__ = (
+        '_path', '_type', '_content', '_comment',
+        '_raw',      # (type, content, comment) of a lazy resource, until materialized
+        '_checksum',
+        'state',
+        '__weakref__', # Watched by tracked content
+    )
 
     valid_mimetypes = set(mimetypes.types_map.values())
     valid_mimetypes.update(['text/lua', 'direct/json', 'application/x-octet-stream'])
+    interned_mimetypes = dict((t, intern_string(t)) for t in valid_mimetypes)
 
     def __init__(self, path="/", content="", comment="", type="application/x-octet-stream", source=None):
+        self._raw      = None
+        self._checksum = None
+        self.state     = None
         if source:
             self.deserialize(source)
         else:
@@ -32,10 +69,65 @@ class Resource(object):
             self.type = type
             self.content = content
             self.comment = comment
-        self.document = None
+
+    @classmethod
+    def lazy(cls, source, path=None):
+        '''
+        Resource that keeps its serialized form, and only runs the property
+        setters (and MIME validation) when type, content or comment are
+        first used. Serializing or hashing it doesn't count as a use.
+
+        Only the property values are kept, not the source dict itself.
+        '''
+        return cls._lazy((
+            source.get('type', 'application/x-octet-stream'),
+            source.get('content', ''),
+            source.get('comment', ''),
+        ), intern_string(source.get('path', '/')))
+
+    @classmethod
+    def _lazy(cls, raw, path):
+        result = cls.__new__(cls)
+        result._raw      = raw
+        result._path     = path
+        result._checksum = None
+        result.state     = None
+        return result
+
+    def _materialize(self):
+        # Readers may race to get here. Whoever is second either finds
+        # nothing left to do, or builds the same values from the same source.
+        raw = self._raw
+        if raw is None:
+            return
+        self._type    = self._mimetype(raw[0])
+        self._content = raw[1]
+        self._comment = self._commentstr(raw[2])
+        self._raw = None
+
+    def _mimetype(self, value):
+        try:
+            return self.interned_mimetypes[value]
+        except KeyError:
+            raise ValueError('Invalid MIME type: %s' % value)
+
+    def _commentstr(self, value):
+        if not value:
+            return EMPTY_COMMENT
+        return String(value).export()
 
     # Getters and setters
 
+    @property
+    def document(self):
+        '''
+        The document of the state this resource is in, if any.
+        '''
+        state = self.state
+        if state is None:
+            return None
+        return state.doc
+
     @property
     def path(self):
         return self._path
@@ -44,40 +136,92 @@ class Resource(object):
     def path(self, newpath):
         if hasattr(self, '_path'):
             oldpath = self.path
-            self._path = String(newpath).export()
+            self._path = intern_string(newpath)
             self.trigger_change('path', oldpath=oldpath)
         else:
-            self._path = newpath
+            self._path = intern_string(newpath)
 
     @property
     def type(self):
+        if self._raw is not None:
+            self._materialize()
         return self._type
 
     @type.setter
     def type(self, newtype):
-        if newtype not in self.valid_mimetypes:
-            raise ValueError('Invalid MIME type: %s' % newtype)
-        self._type = String(newtype).export()
+        if self._raw is not None:
+            self._materialize()
+        self._type = self._mimetype(newtype)
         self.trigger_change('type')
 
     @property
     def content(self):
-        return self._content
+        '''
+        Dict and list content comes back tracked, as a copy made on first
+        use, so that changing it in place is noticed (see content_edited).
+        Use peek_content() to only read it.
+        '''
+        if self._raw is not None:
+            self._materialize()
+        content = self._content
+        if isinstance(content, (dict, list)):
+            if not isinstance(content, Tracked):
+                content = self._content = self._track(content)
+            content.exposed = True
+        return content
 
     @content.setter
     def content(self, newcontent):
-        self._content = newcontent
+        if self._raw is not None:
+            self._materialize()
+        self._content = self._track(newcontent)
         self.trigger_change('content')
 
+    def _track(self, content):
+        content = track(content)
+        if isinstance(content, Tracked):
+            content.watch(self)
+        return content
+
+    def peek_content(self):
+        '''
+        Content as it's stored, which may be shared with other resources.
+        For reading only: unlike .content, it isn't copied first.
+        '''
+        if self._raw is not None:
+            self._materialize()
+        return self._content
+
     @property
     def comment(self):
+        if self._raw is not None:
+            self._materialize()
         return self._comment
 
     @comment.setter
     def comment(self, newcomment):
-        self._comment = String(newcomment).export()
+        if self._raw is not None:
+            self._materialize()
+        self._comment = self._commentstr(newcomment)
         self.trigger_change('comment')
 
+    def share_content(self, content):
+        '''
+        Swap in an equal, plain content object kept elsewhere (say, by a
+        HandlerRegistry), so identical copies share memory. This isn't a
+        change: nobody is notified, and the checksum stays valid.
+
+        Shared content is never changed: .content makes a private copy of
+        it first. Content that .content has already handed out is kept,
+        since someone may still change it. Returns whether it was swapped.
+        '''
+        if self._raw is not None:
+            self._materialize()
+        if getattr(self._content, 'exposed', False):
+            return False
+        self._content = content
+        return True
+
     def set_property(self, propname, value):
         if propname == "path":
             self.path = value
@@ -90,9 +234,25 @@ class Resource(object):
         else:
             raise KeyError("Not allowed to set property %r through Resource.set_property" % propname)
 
+    def content_edited(self):
+        '''
+        Called by tracked content when it's changed in place. This isn't
+        a property change, so the handler isn't notified, but the checksum
+        is recomputed, and so is everything the state derives from it.
+        '''
+        self._checksum = None
+        state = self.state
+        if state is not None:
+            state.on_content_edit(self)
+
     def trigger_change(self, propname, oldpath=None):
-        if hasattr(self, 'document') and self.document:
-            self.document.interpreter.on_resource_update(self.path, propname, oldpath or self.path)
+        self._checksum = None
+        state = self.state
+        if state is None:
+            return
+        state.on_resource_change(self, propname, oldpath)
+        if state.doc is not None:
+            state.doc.resource_updated(self.path, propname, oldpath or self.path)
 
     # Methods
 
@@ -103,18 +263,57 @@ class Resource(object):
         else:
             raise TypeError("No interpreter for resource type " + str(self.type))
 
+    def checksum(self):
+        '''
+        Canonical hash of the serialized resource. Cached until the next
+        property change, or until its content is changed in place.
+        '''
+        if self._checksum is None:
+            self._checksum = checksum(self.serialize())
+        return self._checksum
+
     def clone(self):
-        return Resource(source=self.serialize())
+        '''
+        A lazy resource clones lazily, sharing its source. Otherwise the
+        values are copied straight over, as they're already valid.
+        '''
+        raw = self._raw
+        if raw is None:
+            result = Resource._lazy(None, self._path)
+            result._type    = self._type
+            result._content = self._content
+            result._comment = self._comment
+            if isinstance(self._content, Tracked):
+                self._content.watch(result)
+        else:
+            result = Resource._lazy(raw, self._path)
+        result._checksum = self._checksum
+        return result
 
     def deserialize(self, source):
+        if self.document:
+            with self.document.deferred_updates():
+                self._deserialize(source)
+        else:
+            self._deserialize(source)
+
+    def _deserialize(self, source):
         for propname in ('path','type','content','comment'):
             if propname in source:
                 setattr(self, propname, source[propname])
 
     def serialize(self):
+        raw = self._raw
+        if raw is not None:
+            return {
+                'path': self._path,
+                'type': raw[0],
+                'content': raw[1],
+                'comment': raw[2],
+            }
         return {
-            'path': self.path,
-            'type': self.type,
-            'content': self.content,
-            'comment': self.comment,
+            'path': self._path,
+            'type': self._type,
+            'content': self._content,
+            'comment': self._comment,
         }
@@ -0,0 +1,351 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import threading
+import multiprocessing
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import ejtp.client
+import ejtp.router
+from ejtp import identity
+from ejtp.address import str_address
+from ejtp.util.hasher import checksum
+
+from deje.owner import Owner
+
+# How long to wait for a worker to answer, and how often to check it's alive.
+REPLY_TIMEOUT = 10.0
+POLL_INTERVAL = 0.1
+
+def shard_index(docname, count):
+    '''
+    Stable shard number for a document name.
+
+    Uses the EJTP checksum rather than hash(), so every process (and every
+    Python version) agrees on where a document lives.
+    '''
+    if count < 1:
+        raise ValueError("Shard count must be at least 1")
+    return int(checksum(docname or '').export(), 16) % count
+
+class ShardUplink(object):
+    '''
+    Stands in for a Router on the shard side. Outbound frames are forwarded
+    to the real router, but clients are never registered, so every shard can
+    share the front router's address.
+    '''
+    def __init__(self, router):
+        self.router = router
+
+    def recv(self, msg):
+        self.router.recv(msg)
+
+class QueueUplink(object):
+    '''
+    ShardUplink for worker processes. Frames are pushed as raw bytes onto a
+    multiprocessing queue, which the front router drains.
+    '''
+    def __init__(self, queue):
+        self.queue = queue
+
+    def recv(self, msg):
+        self.queue.put(msg.content.export())
+
+class ShardFrame(object):
+    '''
+    Picklable, already-unpacked copy of a JSON frame.
+
+    Provides the subset of the frame interface DEJEMessage relies on.
+    '''
+    def __init__(self, content, sender, receiver):
+        self.content  = content
+        self.sender   = sender
+        self.receiver = receiver
+
+    def unpack(self, ident_cache = None):
+        return self.content
+
+def shard_owner(ident, uplink, index, count):
+    '''
+    Owner for shard number index. Its query ids map back to the same shard,
+    so responses without a docname find their way home.
+    '''
+    owner = Owner(ident, uplink, False)
+    owner.qid_offset = index
+    owner.qid_stride = count
+    return owner
+
+def ship_document(document):
+    '''
+    Picklable copy of a document, for a worker process: its original and
+    current states, its events, and the identities of their authors.
+    '''
+    with document.lock.reading():
+        events = document._history.events
+        return {
+            'original': document._initial.serialize(),
+            'current' : document._current.serialize(),
+            'events'  : [event.serialize() for event in events],
+            'authors' : dict(
+                (str_address(event.author.location).export(), event.author.serialize())
+                for event in events
+            ),
+        }
+
+def rebuild_document(name, shipped, identities):
+    '''
+    The document ship_document() was given, as it was. Its events have
+    already been decided, so they go straight into the history, rather
+    than being tested and enacted (or proposed) all over again.
+    '''
+    from deje.action       import Action
+    from deje.document     import Document
+    from deje.history      import History
+    from deje.historystate import HistoryState
+
+    identities.deserialize(shipped['authors'])
+    doc = Document(name)
+    doc._initial = HistoryState(doc=doc)
+    doc._initial.deserialize(shipped['original'])
+    doc._current = HistoryState(doc=doc)
+    doc._current.deserialize(shipped['current'])
+    doc._history = History([doc._initial], [
+        Action(serial, identities).specific()
+        for serial in shipped['events']
+    ])
+    return doc
+
+class LocalShard(object):
+    '''
+    A shard running in the router's own process.
+    '''
+    def __init__(self, front, index, count):
+        self.owner = shard_owner(front.identity, ShardUplink(front.router), index, count)
+        self.owner.identities = front.identities
+
+    def own_document(self, document):
+        self.owner.own_document(document)
+
+    def update_ident(self, ident):
+        pass # Shares the front router's IdentityCache
+
+    def deliver(self, msg):
+        self.owner.on_ejtp(msg, self.owner.client)
+
+    def list_subs(self, target, hashes):
+        return self.owner.protocol.find('deje-sub-list').list_subs(target, hashes)
+
+    def stop(self):
+        pass
+
+class ProcessShard(object):
+    '''
+    A shard running its own Owner in a separate worker process.
+    '''
+    def __init__(self, front, index, count):
+        self.index   = index
+        self.asked   = 0
+        self.asking  = threading.Lock()
+        self.inbox   = multiprocessing.Queue()
+        self.outbox  = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target = run_worker,
+            args   = (
+                front.identity.location,
+                front.identities.serialize(),
+                index,
+                count,
+                self.inbox,
+                self.outbox,
+                self.replies,
+            )
+        )
+        self.process.daemon = True
+        self.process.start()
+
+        self.pump = threading.Thread(
+            target = self._pump,
+            args   = (front.router,)
+        )
+        self.pump.daemon = True
+        self.pump.start()
+
+    def _pump(self, router):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            router.recv(data)
+
+    def check(self):
+        '''
+        Raise RuntimeError if the worker process has died.
+        '''
+        if not self.process.is_alive():
+            raise RuntimeError("Shard %d worker exited with code %r" %
+                (self.index, self.process.exitcode))
+
+    def send(self, command):
+        self.check()
+        self.inbox.put(command)
+
+    def own_document(self, document):
+        self.send(('document', document.name, ship_document(document)))
+
+    def update_ident(self, ident):
+        self.send(('idents', {
+            str_address(ident.location).export(): ident.serialize(),
+        }))
+
+    def deliver(self, msg):
+        self.send(('frame', msg))
+
+    def list_subs(self, target, hashes):
+        '''
+        Ask the worker for its subscriptions. Raises RuntimeError if it
+        dies, or takes longer than REPLY_TIMEOUT to answer.
+        '''
+        with self.asking:
+            self.asked += 1
+            self.send(('subs', self.asked, target, hashes))
+            waited = 0
+            while waited < REPLY_TIMEOUT:
+                try:
+                    number, subs = self.replies.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    self.check()
+                    waited += POLL_INTERVAL
+                    continue
+                if number == self.asked:
+                    return subs
+                # Otherwise, a late answer to a question that timed out
+        raise RuntimeError("Shard %d did not list subscriptions within %ss" %
+            (self.index, REPLY_TIMEOUT))
+
+    def stop(self):
+        if self.process.is_alive():
+            self.inbox.put(('stop',))
+            self.process.join(REPLY_TIMEOUT)
+        self.outbox.put(None)
+
+def run_worker(location, idents, index, count, inbox, outbox, replies):
+    '''
+    Main loop of a ProcessShard worker.
+    '''
+    cache = identity.IdentityCache()
+    cache.deserialize(idents)
+    owner = shard_owner(cache.find_by_location(location), QueueUplink(outbox), index, count)
+    owner.identities = cache
+    sublist = owner.protocol.find('deje-sub-list')
+
+    while True:
+        command = inbox.get()
+        kind = command[0]
+        if kind == 'frame':
+            owner.on_ejtp(command[1], owner.client)
+        elif kind == 'document':
+            owner.own_document(rebuild_document(command[1], command[2], cache))
+        elif kind == 'idents':
+            cache.deserialize(command[1])
+        elif kind == 'subs':
+            replies.put((command[1], sublist.list_subs(command[2], command[3])))
+        elif kind == 'stop':
+            return
+
+class ShardRouter(object):
+    '''
+    Front end for a sharded deployment.
+
+    Owns the only EJTP client registered for this identity, and hands each
+    inbound message to the shard responsible for its 'docname'. Every shard
+    has its own Owner and its own set of documents, so unrelated documents
+    never contend with each other. With processes=True, each shard is a
+    worker process, and throughput scales with available cores.
+
+    Messages without a docname are handled differently. A
+    deje-sub-list-query is answered by the router itself, with the
+    subscriptions of every shard. Responses go back to the shard that sent
+    the query, which is encoded in the qid. Anything else, like deje-error
+    (whose qid is the error code), goes to the first shard.
+    '''
+    def __init__(self, self_ident, count=None, router=None, make_jack=True, processes=False):
+        self.identity   = self_ident
+        self.identities = identity.IdentityCache()
+        self.identities.update_ident(self_ident)
+
+        self.router = router or ejtp.router.Router()
+        self.client = ejtp.client.Client(
+            self.router,
+            self.identity.location,
+            self.identities,
+            make_jack
+        )
+        self.client.rcv_callback = self.on_ejtp
+
+        if count is None:
+            count = multiprocessing.cpu_count()
+        shard_class = processes and ProcessShard or LocalShard
+        self.shards = [shard_class(self, i, count) for i in range(count)]
+
+    def shard_for(self, docname):
+        return self.shards[shard_index(docname, len(self.shards))]
+
+    def own_document(self, document):
+        self.shard_for(document.name).own_document(document)
+
+    def update_ident(self, ident):
+        self.identities.update_ident(ident)
+        for shard in self.shards:
+            shard.update_ident(ident)
+
+    def on_ejtp(self, msg, client):
+        content = msg.unpack()
+        shard = self.shards[0]
+        if type(content) == dict:
+            mtype = content.get('type')
+            if 'docname' in content:
+                shard = self.shard_for(content['docname'])
+            elif mtype == 'deje-sub-list-query' and 'qid' in content:
+                return self.on_sub_list_query(content, msg.sender)
+            elif str(mtype).endswith('-response') and 'qid' in content:
+                shard = self.shards[int(content['qid']) % len(self.shards)]
+        shard.deliver(ShardFrame(content, msg.sender, msg.receiver))
+
+    def on_sub_list_query(self, content, sender):
+        '''
+        Subscriptions are spread across shards, so ask all of them.
+        '''
+        hashes = content.get('hashes')
+        subs = {}
+        for shard in self.shards:
+            subs.update(shard.list_subs(sender, hashes))
+        self.client.write_json(sender, {
+            'type': 'deje-sub-list-response',
+            'qid' : content['qid'],
+            'subs': subs,
+        })
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
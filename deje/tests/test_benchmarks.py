@@ -0,0 +1,74 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+from ejtp.util.compat import unittest
+
+from deje.benchmarks  import Benchmark, measure, compare
+from deje.benchmarks.memory import footprint, tracemalloc
+
+def example(size, depth):
+    return lambda: None
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.bench = Benchmark(example, {'size': [1, 2], 'depth': [3]})
+
+    def test_cases(self):
+        self.assertEqual(list(self.bench.cases()), [
+            {'depth': 3, 'size': 1},
+            {'depth': 3, 'size': 2},
+        ])
+
+    def test_case_name(self):
+        self.assertEqual(
+            self.bench.case_name({'size': 1, 'depth': 3}),
+            "example[depth=3,size=1]"
+        )
+        self.assertEqual(self.bench.case_name({}), "example")
+
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(1), repeat=3, min_time=0.001)
+        # Calibration runs 1, 2, 4 ... number calls, then two more samples
+        self.assertEqual(len(calls), result['number'] * 4 - 1)
+        self.assertTrue(result['best'] <= result['median'])
+
+    def test_compare(self):
+        baseline = {'results': {
+            'fast': {'best': 1.0},
+            'slow': {'best': 1.0},
+            'gone': {'best': 1.0},
+        }}
+        results = {'results': {
+            'fast': {'best': 1.05},
+            'slow': {'best': 1.5},
+            'new' : {'best': 9.0},
+        }}
+        self.assertEqual(compare(results, baseline), [('slow', 1.0, 1.5)])
+        self.assertEqual(compare(results, baseline, 0.01), [
+            ('fast', 1.0, 1.05),
+            ('slow', 1.0, 1.5),
+        ])
+
+    @unittest.skipIf(tracemalloc is None, "Needs tracemalloc")
+    def test_footprint(self):
+        small = footprint(lambda n: n, lambda n: [None] * n, 1000)
+        large = footprint(lambda n: n, lambda n: [[] for _ in range(n)], 1000)
+        self.assertTrue(0 < small < large)
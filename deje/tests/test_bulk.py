@@ -0,0 +1,169 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from persei              import String
+
+from ejtp.util.compat    import unittest
+from ejtp.identity.cache import IdentityCache
+
+from deje.bulk           import import_events, export_events, write_snapshot, \
+    read_events, BulkImportError
+from deje.document       import Document
+from deje.event          import Event
+from deje.resource       import Resource
+from deje.handlers       import handler_document
+from deje.tests.identity import identity
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.mitzi = identity("mitzi")
+        self.identities = IdentityCache()
+        self.identities.update_ident(self.mitzi)
+
+        self.source = handler_document("tag_team")
+        for i in range(5):
+            event = Event(
+                {
+                    'path'     : '/bulk/%d' % (i % 2),
+                    'property' : 'content',
+                    'value'    : 'value %d' % i,
+                },
+                self.mitzi,
+                self.source.version
+            )
+            event.enact(None, self.source)
+
+        self.exported = StringIO()
+        self.assertEqual(export_events(self.source, self.exported), 5)
+        self.exported.seek(0)
+
+        self.target = handler_document("tag_team")
+
+    def test_read_events(self):
+        lines = ['{"a": 1}', '', '{"b": 2}']
+        self.assertEqual(
+            list(read_events(lines)),
+            [(1, {'a': 1}), (3, {'b': 2})]
+        )
+        self.assertRaises(BulkImportError, list, read_events(['{']))
+
+    def test_import(self):
+        reports = []
+        imported = []
+        held = []
+        def on_import(sender, **kwargs):
+            imported.append(kwargs['count'])
+        def on_progress(count):
+            reports.append(count)
+            held.append(len(self.target._deferred))
+        self.target.signals['import-events'].connect(on_import)
+
+        count = import_events(
+            self.target,
+            self.exported,
+            batch_size = 2,
+            progress   = on_progress,
+            identities = self.identities
+        )
+        self.assertEqual(count, 5)
+        self.assertEqual(reports, [2, 4, 5])
+        self.assertEqual(imported, [5])
+        self.assertEqual(self.target.version, self.source.version)
+        self.assertEqual(
+            self.target.get_resource('/bulk/0').content,
+            'value 4'
+        )
+        self.assertEqual(
+            [e.hash() for e in self.target._history.events],
+            [e.hash() for e in self.source._history.events]
+        )
+        # One held notification per path changed, however many events
+        self.assertEqual(held, [2, 2, 2])
+
+    def test_import_freeze(self):
+        import_events(
+            self.target,
+            self.exported,
+            freeze     = True,
+            identities = self.identities
+        )
+        self.assertEqual(self.target.version, self.source.version)
+        self.assertEqual(self.target._history.events, [])
+
+    def test_import_chained(self):
+        # Each event is only valid after the one before it
+        doc = Document("counter")
+        doc.add_resource(Resource('/handler', {
+            'event_test': "return deje.get_resource('/n').content == ev.expect",
+            'on_event_achieve': "set_resource('/n', 'content', ev.next)",
+        }, 'Counter', 'direct/json'), False)
+        doc.add_resource(Resource('/n', '0'), False)
+        doc.freeze()
+
+        events = []
+        version = doc.version
+        for (expect, next) in (('0', '1'), ('1', '2'), ('2', '3')):
+            event = Event({'expect': expect, 'next': next}, self.mitzi, version)
+            events.append(event.serialize())
+            version = event.hash()
+
+        self.assertEqual(
+            import_events(doc, events, identities = self.identities),
+            3
+        )
+        self.assertEqual(doc.get_resource('/n').content, '3')
+
+    def test_import_invalid(self):
+        lines = self.exported.getvalue().splitlines()
+        del lines[2] # Break the version chain
+        original = self.target.version
+        try:
+            import_events(self.target, lines, identities = self.identities)
+        except BulkImportError as e:
+            self.assertEqual(e.line, 3)
+        else:
+            self.fail("Import should have failed")
+        self.assertEqual(self.target.version, original)
+        self.assertRaises(KeyError, self.target.get_resource, '/bulk/0')
+
+    def test_import_unknown_author(self):
+        self.assertRaises(
+            BulkImportError,
+            import_events,
+            self.target, self.exported, identities = IdentityCache()
+        )
+
+    def test_snapshot(self):
+        snapshot = StringIO()
+        write_snapshot(self.source, snapshot)
+
+        import json
+        doc = Document("snapshot")
+        doc.deserialize(json.loads(snapshot.getvalue()))
+        self.assertEqual(String(doc.version), self.source.version)
+        self.assertEqual(
+            doc.get_resource('/bulk/1').content,
+            'value 3'
+        )
@@ -0,0 +1,124 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+from ejtp.util.compat    import unittest
+from ejtp.client         import Client
+from ejtp.identity.cache import IdentityCache
+
+from deje.benchmarks.cluster import SimulatedNetwork, Cluster, Workload, \
+    node_identity, percentiles
+
+class TestPercentiles(unittest.TestCase):
+
+    def test_percentiles(self):
+        self.assertEqual(percentiles(list(range(1, 11))), {
+            'p50': 5,
+            'p90': 9,
+            'p99': 10,
+            'max': 10,
+        })
+
+    def test_empty(self):
+        self.assertEqual(percentiles([]), {})
+
+class TestSimulatedNetwork(unittest.TestCase):
+
+    def make_clients(self, network):
+        cache = IdentityCache()
+        idents = [node_identity('a'), node_identity('b')]
+        for ident in idents:
+            cache.update_ident(ident)
+        clients = [
+            Client(network, ident.location, cache, False)
+            for ident in idents
+        ]
+        received = []
+        def rcv_callback(msg, client):
+            received.append((network.now, msg.unpack()))
+        clients[1].rcv_callback = rcv_callback
+        return clients, received
+
+    def send(self, clients, data):
+        clients[0].write_json(clients[1].interface, data, False)
+
+    def test_latency(self):
+        network = SimulatedNetwork(latency=0.5, charge_cpu=False)
+        clients, received = self.make_clients(network)
+        self.send(clients, {'x': 1})
+        self.assertEqual(received, [])
+        self.assertEqual(network.frames, 1)
+
+        self.assertEqual(network.simulate(), 0.5)
+        self.assertEqual(received, [(0.5, {'x': 1})])
+
+    def test_until(self):
+        network = SimulatedNetwork(latency=0.5, charge_cpu=False)
+        clients, received = self.make_clients(network)
+        self.send(clients, {'x': 1})
+        network.simulate(0.25)
+        self.assertEqual(received, [])
+        network.simulate(1)
+        self.assertEqual(len(received), 1)
+
+    def test_bandwidth(self):
+        network = SimulatedNetwork(bandwidth=100, charge_cpu=False)
+        clients, received = self.make_clients(network)
+        self.send(clients, {'x': 1})
+        self.send(clients, {'x': 2})
+        network.simulate()
+        size = network.bytes / 2.0
+        self.assertEqual([r[1] for r in received], [{'x': 1}, {'x': 2}])
+        self.assertAlmostEqual(received[0][0], size / 100)
+        self.assertAlmostEqual(received[1][0], 2 * size / 100)
+
+    def test_loss(self):
+        network = SimulatedNetwork(loss=1.0)
+        clients, received = self.make_clients(network)
+        self.send(clients, {'x': 1})
+        network.simulate()
+        self.assertEqual(received, [])
+        self.assertEqual(network.dropped, 1)
+
+class TestCluster(unittest.TestCase):
+
+    def test_init(self):
+        cluster = Cluster(3, 1)
+        self.assertEqual(len(cluster.participants), 3)
+        self.assertEqual(len(cluster.observers), 1)
+        doc = cluster.document(cluster.observers[0])
+        self.assertEqual(
+            [ident.name for ident in doc.get_participants()],
+            ['node0@cluster', 'node1@cluster', 'node2@cluster']
+        )
+        self.assertEqual(doc.get_thresholds()['write'], 2)
+        self.assertTrue(cluster.document(cluster.participants[0]).can_write())
+        self.assertFalse(doc.can_write())
+        self.assertTrue(doc.can_read())
+
+    def test_workload(self):
+        network = SimulatedNetwork(latency=0.01, seed=1)
+        cluster = Cluster(2, 1, network=network)
+        report  = Workload(writes=2, reads=1, rate=1, seed=1).run(cluster)
+
+        self.assertEqual(report['writes']['issued'], 2)
+        self.assertTrue(report['writes']['committed'] > 0)
+        self.assertEqual(report['subscriptions'], 2)
+        self.assertEqual(report['reads']['completed'], 1)
+        self.assertTrue(report['commit_latency']['p50'] >= 0.02)
+        self.assertIn('deje-paxos-accept', report['messages']['by_type'])
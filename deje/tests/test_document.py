@@ -26,6 +26,8 @@ from deje.tests.ejtp     import TestEJTP
 from deje.document import Document, save_to, load_from
 from deje.resource import Resource
 from deje.read     import ReadRequest
+from deje.event    import Event
+from deje.tests.identity import identity
 
 try:
    from Queue import Queue
@@ -91,6 +93,66 @@ class TestDocumentSimple(unittest.TestCase):
         self.assertEqual(list(initial_resources.keys()), ['/example'])
         self.assertIsInstance(initial_resources['/example'], Resource)
 
+    def test_list_resources(self):
+        for path in ('/a/1', '/a/2', '/b/1'):
+            self.doc.add_resource(Resource(path), False)
+        self.assertEqual(self.doc.list_resources('/a/'), ['/a/1', '/a/2'])
+        self.assertEqual(self.doc.list_resources(), ['/a/1', '/a/2', '/b/1'])
+
+    def test_speculate(self):
+        changes = []
+        self.doc.debug = changes.append
+        self.doc.add_resource(Resource('/handler', {
+            'on_event_achieve': '''
+                set_resource(ev.path, 'content', ev.value)
+                deje.debug('achieved ' .. ev.value)
+            ''',
+            'on_resource_update': '''
+                deje.debug(path .. ' ' .. propname)
+            ''',
+        }, 'Speculative', 'direct/json'), False)
+        self.doc.add_resource(Resource('/example', 'start'), False)
+        ident = identity()
+        first  = Event({'path': '/example', 'value': 'first'},  ident)
+        second = Event({'path': '/example', 'value': 'second'}, ident)
+
+        # Nothing happens until the event is enacted
+        self.assertTrue(self.doc.speculate(first))
+        self.assertTrue(self.doc.speculate(second))
+        self.assertEqual(self.doc.get_resource('/example').content, 'start')
+        self.assertEqual(changes, [])
+
+        # Then the speculative state is swapped in, effects and all
+        base = self.doc._current
+        second.enact(None, self.doc)
+        self.assertIsNot(self.doc._current, base)
+        self.assertEqual(self.doc.version, second.hash())
+        self.assertEqual(self.doc.get_resource('/example').content, 'second')
+        self.assertEqual(changes, [('achieved second',), ('/example content',)])
+        self.assertEqual(self.doc.get_resource('/example').document, self.doc)
+
+        # The loser was discarded, and is enacted the regular way
+        del changes[:]
+        current = self.doc._current
+        first.enact(None, self.doc)
+        self.assertIs(self.doc._current, current)
+        self.assertEqual(self.doc.get_resource('/example').content, 'first')
+        self.assertEqual(changes, [('achieved first',), ('/example content',)])
+
+    def test_speculate_stale(self):
+        self.doc.add_resource(Resource('/handler', {
+            'on_event_achieve': "set_resource(ev.path, 'content', ev.value)",
+        }, 'Speculative', 'direct/json'), False)
+        ev = Event({'path': '/example', 'value': 'speculated'}, identity())
+        self.doc.speculate(ev)
+
+        # The document changed since, so the speculation is worthless
+        self.doc.add_resource(Resource('/other', 'other'), False)
+        base = self.doc._current
+        ev.enact(None, self.doc)
+        self.assertIs(self.doc._current, base)
+        self.assertEqual(self.doc.get_resource('/example').content, 'speculated')
+
     def test_saving(self):
         self.doc.add_resource(
             Resource(path="/example", content="example"),
@@ -105,6 +167,8 @@ class TestDocumentSimple(unittest.TestCase):
 class TestDocumentEJTP(TestEJTP):
 
     def test_event(self):
+        speculated = []
+        self.adoc.speculate = speculated.append
         mev = self.mdoc.event({
             'path':'/example',
             'property':'content',
@@ -122,6 +186,10 @@ class TestDocumentEJTP(TestEJTP):
             "Mitzi says hi"
         )
 
+        # Atlas's vote completed the quorum, so there was nothing to
+        # work out ahead of time
+        self.assertEqual(speculated, [])
+
     def test_read(self):
         self.assertEqual(self.vdoc.version, 'current')
         self.assertTrue(self.vdoc.can_read())
@@ -27,6 +27,8 @@ from deje.quorum import Quorum
 from deje.handlers     import handler_document
 from deje.tests.identity import identity
 from deje.owner import Owner
+from deje.resource import Resource
+from deje.interpreter import call_stats
 
 class TestEvent(unittest.TestCase):
 
@@ -76,6 +78,29 @@ class TestEvent(unittest.TestCase):
             String('ce9950bb5a8db63712ae1ecfe9269e22289673ec')
         )
 
+    def test_test(self):
+        state = self.doc._current
+        ev = Event("example", self.ident)
+        def calls():
+            return call_stats.snapshot().get('event_test', {}).get('calls', 0)
+
+        call_stats.clear()
+        self.assertTrue(ev.test(state))
+        self.assertTrue(ev.test(state))
+        self.assertFalse(Event("other", self.ident).test(state))
+        self.assertEqual(calls(), 2)
+
+        # Tested again once the state changes
+        with self.io:
+            self.doc.add_resource(Resource('/example', 'blerg'))
+        self.assertTrue(ev.test(state))
+        self.assertEqual(calls(), 3)
+
+        # And once the handler is edited in place
+        self.doc.handler.content['event_test'] = 'return false'
+        self.assertFalse(ev.test(state))
+        self.assertEqual(calls(), 4)
+
     def test_serialize(self):
         self.assertEqual(
             self.ev.serialize(),
@@ -18,12 +18,16 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 
 from deje.tests.stream  import StreamTest
+from deje.tests.identity import identity
 
 from ejtp.identity.core import Identity
 from deje.owner         import Owner
+from deje.document      import Document
 from deje.resource      import Resource
+from deje.event         import Event
 from deje.handlers      import handler_document
-from deje.interpreter   import HandlerReturnError
+from deje.interpreter   import HandlerReturnError, Budget, call_stats
+from deje.lua           import shareable
 
 class TestLuaHandler(StreamTest):
     def setUp(self):
@@ -64,6 +68,130 @@ class TestLuaHandlerEchoChamber(TestLuaHandler):
             "/example.txt was moved to /fridge/turtles.txt\n"
         )
 
+    def test_deferred_updates(self):
+        with self.doc.deferred_updates():
+            exampletxt = Resource('/example.txt', 'blerg', type='text/plain')
+            self.doc.add_resource(exampletxt)
+            exampletxt.content = "I like turtles."
+            self.doc.resources['/handler'].comment = "Handler"
+            exampletxt.content = "I really like turtles."
+            self.assertOutput("")
+        self.assertOutput(
+            "on_resource_update /example.txt add\n" +
+            "on_resource_update /example.txt content\n" +
+            "on_resource_update /handler comment\n"
+        )
+
+    def test_deferred_updates_order(self):
+        # Added, deleted and added again: it was added
+        with self.doc.deferred_updates():
+            self.doc.add_resource(Resource('/x', 'one', type='text/plain'))
+            self.doc.del_resource('/x')
+            self.doc.add_resource(Resource('/x', 'two', type='text/plain'))
+        self.assertOutput("on_resource_update /x add\n")
+
+        # Replaced: deleted, then added
+        with self.doc.deferred_updates():
+            self.doc.resources['/x'].content = 'three'
+            self.doc.del_resource('/x')
+            self.doc.add_resource(Resource('/x', 'four', type='text/plain'))
+            self.doc.resources['/x'].content = 'five'
+            self.doc.resources['/x'].content = 'six'
+        self.assertOutput(
+            "on_resource_update /x delete\n" +
+            "on_resource_update /x add\n" +
+            "on_resource_update /x content\n"
+        )
+
+        # Added and deleted again: nothing to tell
+        with self.doc.deferred_updates():
+            self.doc.add_resource(Resource('/y', 'seven', type='text/plain'))
+            self.doc.resources['/y'].content = 'eight'
+            self.doc.del_resource('/y')
+        self.assertOutput("")
+
+    def test_on_resource_updates(self):
+        self.doc.handler.content['on_resource_updates'] = '''
+            deje.debug(#changes .. " changes")
+            for i, change in ipairs(changes) do
+                deje.debug(change.path .. " " .. change.propname)
+            end
+        '''
+        with self.doc.deferred_updates():
+            exampletxt = Resource('/example.txt', 'blerg', type='text/plain')
+            self.doc.add_resource(exampletxt)
+            exampletxt.comment = "Meaningless drivel"
+        self.assertOutput(
+            "2 changes\n" +
+            "/example.txt add\n" +
+            "/example.txt comment\n"
+        )
+
+    def test_list_resources(self):
+        self.doc.add_resource(Resource('/zones/a.com', type='text/plain'), False)
+        self.doc.add_resource(Resource('/zones/b.com', type='text/plain'), False)
+        self.doc.handler.content['list'] = '''
+            local paths = deje.list_resources(prefix)
+            return #paths .. " " .. paths[1] .. " " .. paths[2]
+        '''
+        self.assertEqual(
+            self.doc.interpreter.call("list", prefix="/zones/"),
+            "2 /zones/a.com /zones/b.com"
+        )
+
+    def test_resource_table(self):
+        self.doc.add_resource(Resource('/zone', {'records': ['a', 'b']}, type='text/plain'), False)
+        self.doc.handler.content['get'] = '''
+            return deje.get_resource('/zone')
+        '''
+        self.doc.handler.content['records'] = '''
+            local records = deje.get_resource('/zone').content.records
+            local copy = deje.clone_table(records, {})
+            return #records .. " " .. copy[1] .. copy[#copy]
+        '''
+        interpreter = self.doc.interpreter
+        self.assertEqual(interpreter.call("records"), "2 ab")
+
+        # Converted once per version, then copied for every call
+        same  = interpreter.runtime.eval('rawequal').value
+        first = interpreter.call("get")
+        self.assertEqual(first.content.records[1], 'a')
+        self.assertFalse(same(interpreter.call("get"), first))
+        self.assertEqual(len(interpreter.core.tables), 1)
+        self.doc.get_resource('/zone').content = {'records': ['c']}
+        self.assertEqual(interpreter.call("records"), "1 cc")
+        self.assertEqual(len(interpreter.core.tables), 2)
+
+        # Changing a copy doesn't change what later calls see
+        self.doc.handler.content['spoil'] = '''
+            table.insert(deje.get_resource('/zone').content.records, 'x')
+        '''
+        interpreter.call("spoil")
+        self.assertEqual(interpreter.call("records"), "1 cc")
+
+        # Python lists become Lua sequences, starting at 1
+        copy = interpreter.api.clone_table(['a', 'b'], interpreter.runtime.runtime.table())
+        self.assertEqual((copy[1], copy[2]), ('a', 'b'))
+        self.assertEqual(len(copy), 2)
+
+    def test_call_frame(self):
+        self.doc.handler.content['leak'] = '''
+            local before = leaked
+            leaked = value
+            return tostring(before)
+        '''
+        interpreter = self.doc.interpreter
+        self.assertEqual(interpreter.call("leak", value="first"), "nil")
+        self.assertEqual(interpreter.call("leak", value="second"), "nil")
+
+        # Module is built once, and every frame sees the same read-only view
+        same = interpreter.runtime.eval('rawequal').value
+        self.assertTrue(same(interpreter.deje_module, interpreter.deje_module))
+        self.doc.handler.content['module'] = 'return deje'
+        self.assertTrue(same(interpreter.call("module"), interpreter.call("module")))
+        self.assertEqual(interpreter.call("module").get_resource,
+            interpreter.deje_module.get_resource)
+
     def test_event(self):
         self.doc.interpreter.call("trigger_event", value="example")
         self.assertOutput("Event 'example' achieved.\n")
@@ -74,6 +202,30 @@ class TestLuaHandlerEchoChamber(TestLuaHandler):
             "trigger_event", value="no dice"
         )
 
+    def test_event_test_batch(self):
+        interpreter = self.doc.interpreter
+        events = [
+            Event("example", self.identity),
+            Event("no dice", self.identity),
+            Event("example", self.identity),
+        ]
+        self.assertEqual(self.doc.test_events(events), [True, False, True])
+        self.assertEqual(interpreter.event_test_batch([]), [])
+
+        # Handlers can take the whole batch in one call
+        self.doc.handler.content['event_test_batch'] = '''
+            local results = {}
+            for i, event in ipairs(events) do
+                results[i] = event.ev ~= "example"
+            end
+            return results
+        '''
+        self.assertEqual(self.doc.test_events(events), [False, True, False])
+
+        # One answer per event
+        self.doc.handler.content['event_test_batch'] = 'return {true}'
+        self.assertRaises(HandlerReturnError, self.doc.test_events, events)
+
     def test_document_properties(self):
         self.assertEquals(
             self.doc.get_participants(), 
@@ -139,3 +291,243 @@ class TestLuaHandlerPsychoWard(TestLuaHandler):
             self.doc.event,
             "comet"
         )
+
+class TestLuaHandlerTagTeam(TestLuaHandler):
+    @property
+    def name(self):
+        return "tag_team"
+
+    def setUp(self):
+        TestLuaHandler.setUp(self)
+        self.mitzi  = identity("mitzi")
+        self.atlas  = identity("atlas")
+        self.victor = identity("victor")
+        for ident in (self.mitzi, self.atlas, self.victor):
+            self.owner.identities.update_ident(ident)
+
+    def test_permissions(self):
+        self.assertTrue(self.doc.can_read(self.victor))
+        self.assertTrue(self.doc.can_write(self.atlas))
+        self.assertFalse(self.doc.can_write(self.victor))
+        self.assertFalse(self.doc.can_read(self.identity))
+        self.assertEqual(
+            self.doc.get_participants(),
+            [self.mitzi, self.atlas]
+        )
+        self.assertEqual(
+            self.doc.get_thresholds(),
+            {'read': 2, 'write': 2}
+        )
+
+    def test_filter_readers(self):
+        idents = [self.identity, self.mitzi, self.victor]
+        self.assertEqual(
+            self.doc.filter_readers(idents),
+            [self.mitzi, self.victor]
+        )
+
+        # With a Lua can_read, in one batch
+        self.doc.handler.content = dict(self.doc.handler.content,
+            can_read = 'return name ~= "mitzi@lackadaisy.com"')
+        self.assertEqual(
+            self.doc.filter_readers(idents),
+            [self.identity, self.victor]
+        )
+        self.assertEqual(self.doc.filter_readers([]), [])
+
+    def test_edited_in_place(self):
+        # Handler tables are rebuilt, though the content is the same dict
+        self.assertFalse(self.doc.can_write(self.victor))
+        self.doc.handler.content['writers'].append("victor@lackadaisy.com")
+        self.assertTrue(self.doc.can_write(self.victor))
+
+class TestLuaHandlerTagTeamDeclared(TestLuaHandlerTagTeam):
+    @property
+    def name(self):
+        return "tag_team_declared"
+
+    def test_permissions(self):
+        # Answered from the permissions section, without calling Lua
+        call_stats.clear()
+        TestLuaHandlerTagTeam.test_permissions(self)
+        self.assertEqual(call_stats.snapshot(), {})
+
+        # Parsed once, and kept until the handler changes
+        core = self.doc.interpreter.core
+        parsed = core.permissions(self.doc.handler)
+        self.doc.can_read(self.victor)
+        self.assertIs(core.permissions(self.doc.handler), parsed)
+
+    def test_edited_in_place(self):
+        # Edits in place are seen, though the handler checksum is cached
+        self.assertFalse(self.doc.can_write(self.victor))
+        self.doc.handler.content['permissions']['writers'].append(
+            "victor@lackadaisy.com")
+        self.assertTrue(self.doc.can_write(self.victor))
+
+    def test_permissions_override(self):
+        # A Lua function takes over from its part of the section
+        self.doc.handler.content = dict(self.doc.handler.content,
+            can_write = 'return name == "victor@lackadaisy.com"')
+        self.assertTrue(self.doc.can_write(self.victor))
+        self.assertFalse(self.doc.can_write(self.atlas))
+        self.assertTrue(self.doc.can_read(self.atlas))
+
+class TestLuaHandlerBudget(TestLuaHandler):
+    @property
+    def name(self):
+        return "echo_chamber"
+
+    def setUp(self):
+        TestLuaHandler.setUp(self)
+        call_stats.clear()
+        self.doc.handler.content['spin'] = '''
+            while true do
+                pcall(function() while true do end end)
+            end
+        '''
+        self.doc.handler.content['count'] = '''
+            local x = 0
+            for i = 1, 1000 do x = x + i end
+            return x
+        '''
+
+    def test_unlimited(self):
+        self.assertEqual(self.doc.interpreter.call("count"), 500500)
+        stats = call_stats.snapshot()['count']
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['instructions'], 0) # Not counted
+
+    def test_instructions(self):
+        self.doc.budget = Budget(instructions=10000, step=100)
+        self.assertEqual(self.doc.interpreter.call("count"), 500500)
+        self.assertRaises(
+            HandlerReturnError,
+            self.doc.interpreter.call,
+            "spin"
+        )
+        stats = call_stats.snapshot()
+        self.assertTrue(stats['count']['instructions'] > 0)
+        self.assertEqual(stats['count']['exceeded'], 0)
+        self.assertEqual(stats['spin']['exceeded'], 1)
+        self.assertTrue(stats['spin']['max_instructions'] > 10000)
+
+    def test_seconds(self):
+        self.doc.budget = Budget(seconds=0.01)
+        self.assertRaises(
+            HandlerReturnError,
+            self.doc.interpreter.call,
+            "spin"
+        )
+        self.assertTrue(call_stats.snapshot()['spin']['seconds'] >= 0.01)
+
+    def test_coroutines(self):
+        # Hooks are per coroutine, so new coroutines inherit the budget
+        self.doc.handler.content['wrapped'] = '''
+            return coroutine.wrap(function(a, b)
+                coroutine.yield(a + b)
+            end)(1, 2)
+        '''
+        self.doc.handler.content['wrap'] = '''
+            coroutine.wrap(function() while true do end end)()
+        '''
+        self.doc.handler.content['resume'] = '''
+            coroutine.resume(coroutine.create(function() while true do end end))
+            return "done"
+        '''
+        self.assertEqual(self.doc.interpreter.call("wrapped"), 3)
+        self.doc.budget = Budget(instructions=10000, seconds=1)
+        self.assertEqual(self.doc.interpreter.call("wrapped"), 3)
+        for name in ("wrap", "resume"):
+            self.assertRaises(
+                HandlerReturnError,
+                self.doc.interpreter.call,
+                name
+            )
+            self.assertEqual(call_stats.snapshot()[name]['exceeded'], 1)
+
+    def test_no_debug(self):
+        # Otherwise, debug.sethook() would clear the budget hook
+        self.doc.handler.content['sethook'] = '''
+            if debug then debug.sethook() end
+            while true do end
+        '''
+        self.doc.handler.content['find'] = '''
+            return type(debug) .. " " .. type(package) .. " " .. type(require)
+        '''
+        self.assertEqual(self.doc.interpreter.call("find"), "nil nil nil")
+        self.doc.budget = Budget(instructions=10000, seconds=1)
+        self.assertRaises(
+            HandlerReturnError,
+            self.doc.interpreter.call,
+            "sethook"
+        )
+        self.assertEqual(call_stats.snapshot()['sethook']['exceeded'], 1)
+
+    def test_errors(self):
+        self.doc.budget = Budget(instructions=10000)
+        self.doc.handler.content['broken'] = 'error("nope")'
+        self.assertRaises(
+            Exception,
+            self.doc.interpreter.call,
+            "broken"
+        )
+
+class TestSharedHandler(StreamTest):
+    def make_document(self, name, value):
+        doc = Document(name)
+        doc.add_resource(Resource('/handler', {
+            'read': "return deje.get_resource('/value').content",
+        }, 'Shared', 'direct/json'), False)
+        doc.add_resource(Resource('/value', value, type='text/plain'), False)
+        return doc
+
+    def test_shared_core(self):
+        first  = self.make_document("first", "one")
+        second = self.make_document("second", "two")
+        if shareable():
+            self.assertIs(first.interpreter.core, second.interpreter.core)
+
+        # API calls go to the document of the interpreter being called
+        self.assertEqual(first.interpreter.call("read"), "one")
+        self.assertEqual(second.interpreter.call("read"), "two")
+
+    def test_read_only_globals(self):
+        first  = self.make_document("first", "one")
+        second = self.make_document("second", "two")
+        spoilers = {
+            'count'    : '_G.leak = (_G.leak or 0) + 1',
+            'library'  : 'string.leak = 1',
+            'rawset'   : 'rawset(_G, "leak", 1)',
+            'metatable': 'getmetatable("").__index.leak = 1',
+            'module'   : 'deje.get_resource = nil',
+            'frame'    : 'getmetatable(_G).__index = {}',
+        }
+        for doc in (first, second):
+            doc.handler.content.update(spoilers)
+            doc.handler.content['check'] = '''
+                return tostring(leak) .. " " .. tostring(string.leak)
+                    .. " " .. tostring(deje.get_resource ~= nil)
+            '''
+        for name in sorted(spoilers):
+            self.assertRaises(Exception, first.interpreter.call, name)
+        self.assertEqual(second.interpreter.call("check"), "nil nil true")
+        self.assertEqual(second.interpreter.call("read"), "two")
+
+    def test_shared_tables(self):
+        first  = self.make_document("first", "one")
+        second = self.make_document("second", "two")
+        for doc in (first, second):
+            doc.handler.content['readers'] = ['mitzi']
+            doc.handler.content['add'] = '''
+                table.insert(deje.get_resource('/handler').content.readers, name)
+            '''
+            doc.handler.content['count'] = '''
+                return #deje.get_resource('/handler').content.readers
+            '''
+        if shareable():
+            self.assertIs(first.interpreter.core, second.interpreter.core)
+
+        first.interpreter.call("add", name="mallory")
+        self.assertEqual(first.interpreter.call("count"), 1)
+        self.assertEqual(second.interpreter.call("count"), 1)
@@ -105,3 +105,19 @@ class TestHistory(unittest.TestCase):
 
         hist.add_event(self.ev_tt)
         self.assertEqual(hist.orphan_events, [self.ev_tt])
+
+    def test_generate_state(self):
+        frozen = HistoryState("frozen", [self.res_tt])
+        hist = History([frozen], [self.ev_tt])
+        self.assertEqual(hist.initial_state, frozen)
+        self.assertEqual(hist.generate_state("frozen"), frozen)
+
+        generated = hist.generate_state(self.ev_tt.hash())
+        self.assertEqual(generated.hash, self.ev_tt.hash())
+        self.assertEqual(
+            generated.get_resource('/handler').comment,
+            'An arbitrary comment'
+        )
+        # Original is untouched
+        self.assertEqual(self.res_tt.comment, 'tag_team')
+        self.assertRaises(KeyError, hist.generate_state, "nonexistent")
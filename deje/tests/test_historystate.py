@@ -15,6 +15,8 @@ You should have received a copy of the GNU Lesser General Public License
 along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import threading
+
 from ejtp.util.compat    import unittest
 from deje.handlers       import handler_resource
 from deje.tests.identity import identity
@@ -22,6 +24,7 @@ from deje.tests.identity import identity
 from deje.historystate   import HistoryState
 from deje.resource       import Resource
 from deje.event          import Event
+from deje.lua            import shareable
 
 class TestHistoryState(unittest.TestCase):
 
@@ -77,6 +80,125 @@ class TestHistoryState(unittest.TestCase):
         self.assertNotEqual(hs1.resources, hs2.resources)
         self.assertEqual(hs1.serialize(), hs2.serialize())
 
+    def test_list_resources(self):
+        hs = HistoryState("example", [
+            Resource('/zones/example.com/www'),
+            Resource('/zones/example.com/mail'),
+            Resource('/zones/example.net/www'),
+        ])
+        self.assertEqual(hs.list_resources('/zones/example.com/'), [
+            '/zones/example.com/mail',
+            '/zones/example.com/www',
+        ])
+
+        # Index is kept up to date after first use
+        hs.add_resource(Resource('/zones/example.com/ftp'))
+        hs.del_resource('/zones/example.com/mail')
+        hs.get_resource('/zones/example.net/www').path = '/zones/example.com/web'
+        self.assertEqual(hs.list_resources('/zones/example.com/'), [
+            '/zones/example.com/ftp',
+            '/zones/example.com/web',
+            '/zones/example.com/www',
+        ])
+        self.assertEqual(hs.list_resources('/zones/example.net/'), [])
+        self.assertEqual(hs.clone().list_resources(), hs.list_resources())
+        self.assertEqual(len(hs.list_resources()), 3)
+
+    def test_delta(self):
+        handler = handler_resource("tag_team")
+        hs1 = HistoryState("example", [self.resource, handler])
+        hs2 = hs1.clone()
+        hs2.hash = "other"
+        hs2.resources['/'].content = "changed"
+        hs2.add_resource(Resource(path="/new", content="new"))
+        del hs2.resources['/handler']
+
+        delta = hs2.delta_from(hs1)
+        self.assertEqual(delta['base'], "example")
+        self.assertEqual(delta['hash'], "other")
+        self.assertEqual(list(delta['added'].keys()), ['/new'])
+        self.assertEqual(list(delta['changed'].keys()), ['/'])
+        self.assertEqual(delta['removed'], ['/handler'])
+
+        hs3 = hs1.clone()
+        hs3.apply_delta(delta)
+        self.assertEqual(hs3.serialize(), hs2.serialize())
+
+    def test_delta_empty(self):
+        hs1 = HistoryState("example", [self.resource])
+        delta = hs1.clone().delta_from(hs1)
+        self.assertEqual(delta['added'],   {})
+        self.assertEqual(delta['changed'], {})
+        self.assertEqual(delta['removed'], [])
+
+    def test_digest(self):
+        a = Resource(path="/a", content="one")
+        b = Resource(path="/b", content="two")
+        hs1 = HistoryState("example", [a, b])
+        hs2 = HistoryState("other", [b.clone(), a.clone()])
+        self.assertEqual(hs1.digest, hs2.digest)
+        self.assertTrue(hs1.matches(hs2))
+        self.assertNotEqual(hs1.digest, HistoryState().digest)
+
+    def test_digest_incremental(self):
+        hs1 = HistoryState("example", [Resource(path="/a", content="one")])
+        empty = HistoryState().digest
+        original = hs1.digest
+
+        hs1.resources['/a'].content = "changed"
+        changed = hs1.digest
+        self.assertNotEqual(changed, original)
+
+        hs2 = hs1.clone()
+        self.assertEqual(hs2.digest, changed)
+        hs2.resources['/a'].path = "/moved"
+        self.assertNotEqual(hs2.digest, changed)
+        hs2.resources['/moved'].path = "/a"
+        self.assertEqual(hs2.digest, changed)
+
+        hs2.add_resource(Resource(path="/b", content="two"))
+        self.assertFalse(hs1.matches(hs2))
+        hs2.del_resource('/b')
+        self.assertTrue(hs1.matches(hs2))
+
+        hs2.del_resource('/a')
+        self.assertEqual(hs2.digest, empty)
+
+        # Same as a digest computed from scratch
+        hs1.resources['/a'].comment = "note"
+        fresh = HistoryState("fresh", [hs1.resources['/a'].clone()])
+        self.assertEqual(hs1.digest, fresh.digest)
+
+    def test_digest_edit_in_place(self):
+        hs = HistoryState("example", [Resource(path="/a", content={'n': [1]})])
+        original = hs.digest
+        merkle = hs.merkle.hash
+        hs.resources['/a'].content['n'].append(2)
+        self.assertNotEqual(hs.digest, original)
+        self.assertNotEqual(hs.merkle.hash, merkle)
+        fresh = HistoryState("fresh", [Resource(path="/a", content={'n': [1, 2]})])
+        self.assertEqual(hs.digest, fresh.digest)
+        self.assertEqual(hs.merkle.hash, fresh.merkle.hash)
+
+    def test_digest_concurrent(self):
+        resources = [Resource(path="/%d" % i, content=str(i)) for i in range(500)]
+        expected = HistoryState("fresh", [r.clone() for r in resources]).digest
+        hs = HistoryState("example", resources)
+
+        start = threading.Event()
+        results = []
+        def read():
+            start.wait()
+            results.append(hs.digest)
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [expected] * 8)
+        self.assertEqual(hs.digest, expected)
+
     def test_serialize_resources(self):
         hs = HistoryState("example", [self.resource])
         self.assertEqual(hs.serialize_resources(), {
@@ -105,6 +227,14 @@ class TestHistoryState(unittest.TestCase):
         self.assertNotEqual(hs1.resources, hs2.resources)
         self.assertEqual(hs1.serialize(), hs2.serialize())
 
+        # Resources are only built when used
+        resource = hs2.get_resource('/')
+        self.assertIsNotNone(resource._raw)
+        self.assertEqual(hs1.digest, hs2.digest)
+        self.assertIsNotNone(resource._raw)
+        self.assertEqual(resource.type, 'application/x-octet-stream')
+        self.assertIsNone(resource._raw)
+
     def test_handler(self):
         res = handler_resource("echo_chamber")
         hs = HistoryState("example", [res])
@@ -131,6 +261,17 @@ class TestHistoryState(unittest.TestCase):
         # Should be the same/cached
         self.assertEqual(interp, hs.interpreter)
 
-        # Should not be the same/cached, after hash change
+        # Still cached after a hash change, since the handler is the same
         hs.hash = "some other hash"
+        self.assertEqual(interp, hs.interpreter)
+
+        # Clones get their own interpreter, backed by the same core
+        clone = hs.clone()
+        self.assertNotEqual(interp, clone.interpreter)
+        if shareable():
+            self.assertIs(interp.core, clone.interpreter.core)
+
+        # Should not be the same/cached, after handler change
+        res.comment = "Changed"
         self.assertNotEqual(interp, hs.interpreter)
+        self.assertIsNot(interp.core, hs.interpreter.core)
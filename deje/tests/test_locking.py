@@ -0,0 +1,158 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import threading
+import time
+
+from ejtp.util.compat import unittest
+
+from deje.locking  import RWLock, NullLock
+from deje.document import Document
+from deje.resource import Resource
+
+class TestRWLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = RWLock()
+
+    def test_reentrant(self):
+        with self.lock.writing():
+            with self.lock.reading():
+                with self.lock.writing():
+                    pass
+        with self.lock.reading():
+            with self.lock.reading():
+                pass
+        self.assertEqual(self.lock.stats.reads, 3)
+        self.assertEqual(self.lock.stats.writes, 2)
+
+    def test_no_upgrade(self):
+        def upgrade():
+            with self.lock.reading():
+                with self.lock.writing():
+                    pass
+        self.assertRaises(RuntimeError, upgrade)
+
+        # Lock is still usable afterwards
+        with self.lock.writing():
+            pass
+
+    def test_parallel_reads(self):
+        inside  = []
+        barrier = threading.Event()
+        def read():
+            with self.lock.reading():
+                inside.append(1)
+                barrier.wait(1)
+
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 1
+        while len(inside) < 3 and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(len(inside), 3)
+        barrier.set()
+        for t in threads:
+            t.join()
+
+    def test_writer_excludes_readers(self):
+        order = []
+        def write():
+            with self.lock.writing():
+                order.append('write')
+
+        with self.lock.reading():
+            writer = threading.Thread(target=write)
+            writer.start()
+            time.sleep(0.05)
+            order.append('read')
+        writer.join()
+
+        self.assertEqual(order, ['read', 'write'])
+        stats = self.lock.stats.snapshot()
+        self.assertEqual(stats['contended_writes'], 1)
+        self.assertTrue(stats['write_wait'] > 0)
+
+class TestDocumentLocking(unittest.TestCase):
+
+    def test_default(self):
+        doc = Document("testing")
+        self.assertIsInstance(doc.lock, NullLock)
+
+    def test_concurrent(self):
+        doc = Document("testing", concurrent=True)
+        self.assertIsInstance(doc.lock, RWLock)
+
+        doc.add_resource(Resource(path="/example"), False)
+        doc.get_resource("/example")
+        doc.serialize()
+
+        stats = doc.lock_stats
+        self.assertEqual(stats['writes'], 1)
+        self.assertEqual(stats['reads'], 2)
+        self.assertEqual(stats['contended_reads'], 0)
+
+    def test_handler_reads_behind_writer(self):
+        # B is in a handler call, A holds the read lock and waits for the
+        # handler, C waits to write. B's reads must not wait behind C.
+        doc = Document("testing", concurrent=True)
+        doc.add_resource(Resource('/handler', {
+            'read': '''
+                pause()
+                return deje.get_resource('/example').content
+            ''',
+        }, 'Reading', 'direct/json'), False)
+        doc.add_resource(Resource('/example', 'example'), False)
+        interpreter = doc.interpreter
+
+        entered = threading.Event()
+        resume  = threading.Event()
+        def pause():
+            entered.set()
+            resume.wait(5)
+        results = []
+
+        def b():
+            results.append(interpreter.call('read', pause=pause))
+        def a():
+            with doc.lock.reading():
+                results.append(interpreter.call('read', pause=lambda: None))
+        def c():
+            with doc.lock.writing():
+                results.append('written')
+
+        threads = []
+        def start(target):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        start(b)
+        self.assertTrue(entered.wait(5))
+        start(a)
+        start(c)
+        while not doc.lock._waiting_writers:
+            time.sleep(0.001)
+
+        resume.set()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(results), ['example', 'example', 'written'])
@@ -0,0 +1,82 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+from ejtp.util.compat import unittest
+
+from deje.lua import Runtime, LuaObject, LuaCastError, to_python, UNPACK_LIMIT
+
+class TestConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime = Runtime()
+
+    def table(self, code):
+        return self.runtime.runtime.eval(code)
+
+    def assertConverts(self, code, expected):
+        table = self.table(code)
+        self.assertEqual(self.runtime.to_python(table), expected)
+        self.assertEqual(to_python(table), expected)
+
+    def test_nested(self):
+        self.assertConverts('{1, 2, {3, {a=4}}}', [1, 2, [3, {'a': 4}]])
+
+    def test_not_sequences(self):
+        self.assertConverts('{}', {})
+        self.assertConverts('{a=1, [2]=3}', {'a': 1, 2: 3})
+        self.assertConverts('{[1]=1, [3]=3}', {1: 1, 3: 3})
+
+    def test_large(self):
+        for size in (UNPACK_LIMIT, UNPACK_LIMIT + 1, UNPACK_LIMIT * 2 + 1):
+            table = self.runtime.runtime.execute('''
+                local t = {}
+                for i = 1, %d do t[i] = i end
+                return t
+            ''' % size)
+            self.assertEqual(
+                self.runtime.to_python(table),
+                list(range(1, size + 1))
+            )
+
+    def test_cyclic(self):
+        table = self.runtime.runtime.execute('local t = {} t.t = t return t')
+        self.assertRaises(LuaCastError, self.runtime.to_python, table)
+        self.assertRaises(LuaCastError, to_python, table)
+
+    def test_batch(self):
+        function = self.runtime.compile('return value * 2')
+        frames = [{'value': i} for i in range(5)]
+        result = self.runtime.execute(self.runtime.batch(function, frames))
+        self.assertEqual(result.to_list(), [0, 2, 4, 6, 8])
+
+    def test_cast(self):
+        self.assertEqual(LuaObject(True, self.runtime).cast(bool), True)
+        self.assertEqual(
+            LuaObject(self.table('{[1]="a", [3]="c"}'), self.runtime).cast(list),
+            ['a', None, 'c']
+        )
+        self.assertEqual(
+            LuaObject(self.table('{read=2, write={1}}'), self.runtime).cast(dict),
+            {'read': 2, 'write': [1]}
+        )
+        self.assertRaises(
+            LuaCastError,
+            LuaObject(self.table('{a=1}'), self.runtime).cast, list
+        )
+        self.assertRaises(LuaCastError, LuaObject("yes").cast, bool)
@@ -0,0 +1,138 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+from ejtp.util.compat  import unittest
+from ejtp.util.hasher  import checksum
+
+from deje.merkle       import MerkleTree
+from deje.historystate import HistoryState
+from deje.resource     import Resource
+
+class TestMerkleTree(unittest.TestCase):
+
+    def setUp(self):
+        self.checksums = {
+            '/'                       : checksum("root"),
+            '/handler'                : checksum("handler"),
+            '/zones/example.com/www'  : checksum(1),
+            '/zones/example.org/www'  : checksum(2),
+        }
+        self.tree = MerkleTree(self.checksums)
+
+    def test_hash(self):
+        other = MerkleTree(self.checksums)
+        self.assertEqual(self.tree.hash, other.hash)
+
+        other.update('/zones/example.org/www', checksum(3))
+        self.assertNotEqual(self.tree.hash, other.hash)
+
+        other.update('/zones/example.org/www', checksum(2))
+        self.assertEqual(self.tree.hash, other.hash)
+
+    def test_paths(self):
+        self.assertEqual(
+            sorted(self.tree.paths()),
+            sorted(self.checksums.keys())
+        )
+        self.assertEqual(
+            self.tree.paths('/zones/example.com'),
+            ['/zones/example.com/www']
+        )
+        self.assertEqual(self.tree.paths('/nonexistent'), [])
+
+    def test_remove(self):
+        empty = MerkleTree()
+        self.tree.remove('/zones/example.com/www')
+        self.assertEqual(self.tree.node('/zones/example.com'), None)
+        self.assertNotEqual(self.tree.node('/zones'), None)
+        self.assertRaises(KeyError, self.tree.remove, '/nonexistent')
+
+        for path in list(self.tree.paths()):
+            self.tree.remove(path)
+        self.assertEqual(self.tree.hash, empty.hash)
+
+    def test_copy(self):
+        other = self.tree.copy()
+        other.update('/handler', checksum("changed"))
+        self.assertNotEqual(self.tree.hash, other.hash)
+        self.assertEqual(self.tree.hash, MerkleTree(self.checksums).hash)
+
+    def test_compare(self):
+        other = self.tree.copy()
+        other.update('/zones/example.org/www', checksum(3))
+        other.update('/zones/example.net/www', checksum(4))
+        other.remove('/handler')
+
+        fetch, removed, descend = self.tree.compare('/', other.describe('/'))
+        self.assertEqual(fetch, [])
+        self.assertEqual(removed, ['/handler'])
+        self.assertEqual(descend, ['/zones'])
+
+        fetch, removed, descend = self.tree.compare('/zones', other.describe('/zones'))
+        self.assertEqual(
+            sorted(descend),
+            ['/zones/example.net', '/zones/example.org']
+        )
+
+        fetch, removed, descend = self.tree.compare(
+            '/zones/example.net',
+            other.describe('/zones/example.net')
+        )
+        self.assertEqual(fetch, [])
+        self.assertEqual(descend, ['/zones/example.net/www'])
+
+        fetch, removed, descend = self.tree.compare(
+            '/zones/example.net/www',
+            other.describe('/zones/example.net/www')
+        )
+        self.assertEqual(fetch, ['/zones/example.net/www'])
+        self.assertEqual(descend, [])
+
+        fetch, removed, descend = self.tree.compare('/zones/example.com', None)
+        self.assertEqual(removed, ['/zones/example.com/www'])
+
+class TestHistoryStateMerkle(unittest.TestCase):
+
+    def test_incremental(self):
+        resource = Resource(path="/example", content="example")
+        hs = HistoryState("example", [resource])
+        original = hs.merkle.hash
+
+        resource.content = "changed"
+        self.assertNotEqual(hs.merkle.hash, original)
+        self.assertEqual(
+            hs.merkle.hash,
+            MerkleTree({'/example': resource.checksum()}).hash
+        )
+
+        resource.path = "/moved"
+        self.assertEqual(list(hs.resources.keys()), ['/moved'])
+        self.assertEqual(hs.merkle.paths(), ['/moved'])
+
+        hs.add_resource(Resource(path="/other"))
+        hs.del_resource("/moved")
+        self.assertEqual(hs.merkle.paths(), ['/other'])
+
+    def test_clone(self):
+        hs1 = HistoryState("example", [Resource(path="/example")])
+        hs2 = hs1.clone()
+        self.assertEqual(hs1.merkle.hash, hs2.merkle.hash)
+
+        hs2.get_resource("/example").content = "changed"
+        self.assertNotEqual(hs1.merkle.hash, hs2.merkle.hash)
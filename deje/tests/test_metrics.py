@@ -0,0 +1,140 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from ejtp.util.compat import unittest
+
+from deje import metrics
+from deje.metrics import Registry, NULL_METRIC
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry(True)
+
+    def test_disabled(self):
+        registry = Registry()
+        self.assertIs(registry.counter('x'), NULL_METRIC)
+        self.assertIs(registry.histogram('x'), NULL_METRIC)
+        with registry.timer('x'):
+            pass
+        self.assertEqual(registry.snapshot(), {})
+
+    def test_counter(self):
+        self.registry.counter('calls', function='a').inc()
+        self.registry.counter('calls', function='a').inc(2)
+        self.registry.counter('calls', function='b').inc()
+        self.assertEqual(self.registry.snapshot(), {
+            'calls{function="a"}': 3,
+            'calls{function="b"}': 1,
+        })
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('size')
+        histogram.buckets = (1, 10)
+        histogram.counts  = [0, 0]
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(self.registry.snapshot(), {
+            'size': {
+                'count'   : 3,
+                'sum'     : 55.5,
+                'buckets' : {1: 1, 10: 2},
+            }
+        })
+
+    def test_timer(self):
+        with self.registry.timer('work', step='one'):
+            pass
+        result = self.registry.snapshot()['work{step="one"}']
+        self.assertEqual(result['count'], 1)
+        self.assertTrue(result['sum'] >= 0)
+
+    def test_type_conflict(self):
+        self.registry.counter('x')
+        self.assertRaises(TypeError, self.registry.histogram, 'x')
+
+    def test_render(self):
+        self.registry.counter('deje_calls_total', type='a"b').inc(2)
+        histogram = self.registry.histogram('deje_seconds')
+        histogram.buckets = (0.5,)
+        histogram.counts  = [0]
+        histogram.observe(0.25)
+        histogram.observe(1.0)
+        self.assertEqual(self.registry.render(), "\n".join([
+            '# TYPE deje_calls_total counter',
+            'deje_calls_total{type="a\\"b"} 2',
+            '# TYPE deje_seconds histogram',
+            'deje_seconds_bucket{le="0.5"} 1',
+            'deje_seconds_bucket{le="+Inf"} 2',
+            'deje_seconds_sum 1.25',
+            'deje_seconds_count 2',
+        ]) + "\n")
+
+    def test_export_file(self):
+        self.registry.counter('x').inc()
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'deje.prom')
+            self.registry.export_file(filename)
+            with open(filename) as f:
+                self.assertEqual(f.read(), self.registry.render())
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_export_socket(self):
+        self.registry.counter('x').inc()
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        received = []
+        def accept():
+            conn, addr = server.accept()
+            chunks = []
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            conn.close()
+            received.append(b''.join(chunks))
+        thread = threading.Thread(target=accept)
+        thread.start()
+        self.registry.export_socket(server.getsockname())
+        thread.join(1)
+        server.close()
+        self.assertEqual(received, [self.registry.render().encode('utf-8')])
+
+class TestDefaultRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.registry.clear()
+
+    def test_enable(self):
+        metrics.counter('x').inc()
+        self.assertEqual(metrics.snapshot(), {})
+        metrics.enable()
+        metrics.counter('x').inc()
+        self.assertEqual(metrics.snapshot(), {'x': 1})
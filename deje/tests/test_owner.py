@@ -18,6 +18,8 @@ along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 from persei import String
 
+import json
+
 from ejtp.util.compat    import unittest
 from ejtp.util.hasher    import strict
 from ejtp.identity.core  import Identity
@@ -26,9 +28,11 @@ from ejtp.router         import Router
 from deje.tests.ejtp     import TestEJTP
 
 from deje.owner          import Owner
+from deje.document       import Document
 from deje.tests.identity import identity
-from deje.handlers       import handler_document, handler_text
+from deje.handlers       import handler_document, handler_resource, handler_text
 from deje.resource       import Resource
+from deje.lua            import shareable
 
 try:
    from Queue import Queue
@@ -68,6 +72,46 @@ class TestOwnerSimple(unittest.TestCase):
         self.assertIsInstance(doc.handler, Resource)
         owner.own_document(doc)
 
+    def test_handlers(self):
+        owner  = Owner(identity(), make_jack = False)
+        first  = Document("first",  [handler_resource("echo_chamber")])
+        second = Document("second", [handler_resource("echo_chamber")])
+        self.assertIsNot(first.handler.peek_content(), second.handler.peek_content())
+
+        owner.own_document(first)
+        owner.own_document(second)
+        key = first.handler.checksum().export()
+        self.assertEqual(list(owner.handlers.entries), [key])
+        entry = owner.handlers.entries[key]
+        self.assertIs(first.handler.peek_content(), entry.content)
+        self.assertIs(second.handler.peek_content(), entry.content)
+        if shareable():
+            self.assertIs(first.interpreter.core, entry.core)
+        self.assertEqual(entry.stats()['documents'], 2)
+
+        # Editing one document's handler in place leaves the other's alone
+        first.handler.content['extra'] = "return 1"
+        self.assertNotIn('extra', second.handler.content)
+        self.assertNotIn('extra', entry.content)
+        self.assertIn('extra', first.handler.content)
+        first.interpreter
+        self.assertEqual(len(owner.handlers.entries), 2)
+        del first.handler.content['extra']
+        first.interpreter
+        self.assertEqual(len(owner.handlers.entries), 1)
+
+        # Changing a handler moves its document to a new entry
+        first.handler.comment = "Changed"
+        first.interpreter
+        self.assertEqual(len(owner.handlers.entries), 2)
+        self.assertEqual(entry.documents, set(["second"]))
+
+        # Entries nobody uses any more are dropped
+        second.handler.comment = "Changed"
+        second.interpreter
+        self.assertEqual(list(owner.handlers.entries),
+            [first.handler.checksum().export()])
+
 class TestOwnerEJTP(TestEJTP):
     def test_on_ejtp(self):
         self.assertEqual(
@@ -128,6 +172,51 @@ class TestOwnerEJTP(TestEJTP):
         result = queue.get(timeout=0.1)
         self.assertEqual(result, [mev.serialize()])
 
+    def test_get_events_paged(self):
+        queue = Queue()
+        def on_recv_events(events):
+            queue.put(events)
+
+        mevs = []
+        for value in ('one', 'two', 'three'):
+            mevs.append(self.mdoc.event({
+                'path':'/example',
+                'property':'content',
+                'value':value,
+            }))
+        # As they come over the wire, with plain string versions
+        serialized = [json.loads(strict(ev.serialize()).export()) for ev in mevs]
+
+        self.victor.get_events(self.vdoc, on_recv_events, page_size=2)
+        self.assertEqual(queue.get(timeout=0.1), serialized[:2])
+        self.assertEqual(queue.get(timeout=0.1), serialized[2:])
+        self.assertTrue(queue.empty())
+
+        # Resume after the first event
+        self.victor.get_events(
+            self.vdoc,
+            on_recv_events,
+            page_size=5,
+            token=mevs[0].hash()
+        )
+        self.assertEqual(queue.get(timeout=0.1), serialized[1:])
+        self.assertTrue(queue.empty())
+
+    def test_get_events_unknown_token(self):
+        queue = Queue()
+        def on_recv_events(events):
+            queue.put(events)
+
+        self.victor.get_events(
+            self.vdoc,
+            on_recv_events,
+            page_size=5,
+            token="not a known event"
+        )
+        self.assertEqual(queue.get(timeout=0.1), [])
+        self.assertTrue(queue.empty())
+        self.assertFalse(self.vdoc.signals['recv-events'].receivers)
+
     def test_get_state(self):
         queue = Queue()
         def on_recv_state(state):
@@ -140,3 +229,50 @@ class TestOwnerEJTP(TestEJTP):
             result,
             self.vdoc._current.serialize()
         )
+
+    def test_get_state_delta(self):
+        queue = Queue()
+        def on_recv_state(state):
+            queue.put(state)
+
+        first = self.mdoc.event({
+            'path':'/example',
+            'property':'content',
+            'value':'first',
+        })
+        # Victor catches up to the first event on his own
+        self.vdoc._history.add_event(first)
+        first.apply(self.vdoc._current)
+        self.assertEqual(self.vdoc.version, first.hash())
+
+        self.mdoc.event({
+            'path':'/example',
+            'property':'content',
+            'value':'second',
+        })
+
+        # Patching a scratch copy must not notify Victor's handler
+        updates = []
+        self.vdoc.resource_updated = lambda *args: updates.append(args)
+
+        # Only the difference comes over the wire
+        handler  = self.victor.protocol.find('deje-retrieve-state')
+        received = []
+        on_response = handler._on_response
+        def spy(message):
+            received.append(('delta' in message, 'state' in message))
+            return on_response(message)
+        handler._on_response = spy
+
+        self.victor.get_state(self.vdoc, self.mdoc.version, on_recv_state)
+        result = queue.get(timeout=0.1)
+        self.assertTrue(received)
+        self.assertEqual(set(received), set([(True, False)]))
+        self.maxDiff = None
+        self.assertEqual(String(result['hash']), self.mdoc.version)
+        self.assertEqual(
+            result['resources'],
+            self.mdoc._current.serialize_resources()
+        )
+        self.assertEqual(updates, [])
+        self.assertEqual(self.vdoc.version, first.hash())
@@ -0,0 +1,59 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+try:
+   from Queue import Queue
+except:
+   from queue import Queue
+
+from deje.tests.ejtp import TestEJTP
+from deje.resource   import Resource
+
+class TestRetrieveMerkle(TestEJTP):
+
+    def test_in_sync(self):
+        results = Queue()
+        self.victor.protocol.sync_resources(
+            self.vdoc,
+            self.mitzi.identity,
+            lambda resources, removed: results.put((resources, removed))
+        )
+        self.assertEqual(results.get(timeout=0.1), ({}, []))
+
+    def test_sync_resources(self):
+        self.mdoc.event({
+            'path':'/zones/example.com',
+            'property':'content',
+            'value':'Mitzi says hi',
+        })
+        self.vdoc.add_resource(Resource(path="/local"), False)
+
+        results = Queue()
+        self.victor.protocol.sync_resources(
+            self.vdoc,
+            self.mitzi.identity,
+            lambda resources, removed: results.put((resources, removed))
+        )
+        resources, removed = results.get(timeout=0.1)
+        self.assertEqual(list(resources.keys()), ['/zones/example.com'])
+        self.assertEqual(
+            resources['/zones/example.com'],
+            self.mdoc.get_resource('/zones/example.com').serialize()
+        )
+        self.assertEqual(removed, ['/local'])
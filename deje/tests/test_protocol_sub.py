@@ -25,6 +25,8 @@ except:
 
 from ejtp.identity.core  import Identity
 from deje.tests.ejtp     import TestEJTP
+from deje.document       import Document
+from deje.handlers       import handler_resource
 
 class TestSub(TestEJTP):
     def test_add(self):
@@ -141,3 +143,35 @@ class TestSub(TestEJTP):
             results['atlas'],
             {}
         )
+
+    def subscribe_victor(self):
+        adds = Queue()
+        self.victor.protocol.subscribe(
+            self.vdoc,
+            lambda sub: adds.put(sub),
+            [self.mitzi.identity]
+        )
+        return adds.get(timeout=0.1)
+
+    def test_subscribers_by_document(self):
+        self.subscribe_victor()
+        other = Document("other", [handler_resource("tag_team")])
+        self.mitzi.own_document(other)
+        self.assertEqual(
+            self.mitzi.protocol.subscribers(self.mdoc),
+            (self.victor.identity,)
+        )
+        self.assertEqual(self.mitzi.protocol.subscribers(other), tuple())
+
+    def test_transmit_to_subscribers(self):
+        self.subscribe_victor()
+        sent = []
+        self.mitzi.client.write_json = lambda address, message: sent.append(
+            (address, message['type'])
+        )
+        targets = self.mitzi.transmit(self.mdoc, 'deje-example', {})
+        self.assertEqual(targets, set([self.victor.identity.key]))
+        self.assertEqual(
+            sent,
+            [(self.victor.identity.location, 'deje-example')]
+        )
@@ -30,3 +30,102 @@ class TestMimetypes(unittest.TestCase):
     def test_direct_json(self):
         r = Resource(type='direct/json')
 
+
+class TestCompactResource(unittest.TestCase):
+
+    def test_slots(self):
+        r = Resource('/slotted')
+        self.assertFalse(hasattr(r, '__dict__'))
+        self.assertRaises(AttributeError, setattr, r, 'color', 'blue')
+
+    def test_interned(self):
+        a = Resource(''.join(['/int', 'erned']), type='text/plain')
+        b = Resource(''.join(['/inte', 'rned']), type=''.join(['text/', 'plain']))
+        self.assertIs(a.path, b.path)
+        self.assertIs(a.type, b.type)
+        self.assertIs(a.comment, b.comment)
+
+class TestTrackedContent(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = Resource('/tracked', {'names': ['mitzi']})
+
+    def test_edit_in_place(self):
+        original = self.resource.checksum()
+        self.resource.content['names'].append('atlas')
+        self.assertNotEqual(self.resource.checksum(), original)
+        self.assertEqual(
+            self.resource.checksum(),
+            Resource('/tracked', {'names': ['mitzi', 'atlas']}).checksum()
+        )
+
+        # Put in a copy, which is tracked too
+        names = ['victor']
+        self.resource.content['others'] = names
+        names.append('ignored')
+        changed = self.resource.checksum()
+        self.resource.content['others'].append('mitzi')
+        self.assertNotEqual(self.resource.checksum(), changed)
+        self.assertEqual(self.resource.content['others'], ['victor', 'mitzi'])
+
+    def test_clone(self):
+        # Clones share content, as before, and both see edits
+        clone = self.resource.clone()
+        original = clone.checksum()
+        self.resource.content['names'].append('atlas')
+        self.assertNotEqual(clone.checksum(), original)
+        self.assertEqual(clone.checksum(), self.resource.checksum())
+
+    def test_copies_are_plain(self):
+        import copy, pickle
+        content = self.resource.content
+        for result in (copy.deepcopy(content), pickle.loads(pickle.dumps(content))):
+            self.assertIs(type(result), dict)
+            self.assertIs(type(result['names']), list)
+            self.assertEqual(result, {'names': ['mitzi']})
+
+class TestLazyResource(unittest.TestCase):
+
+    def setUp(self):
+        self.source = {
+            'path': '/lazy',
+            'type': 'text/plain',
+            'content': 'Hello',
+            'comment': 'Not built yet',
+        }
+        self.resource = Resource.lazy(self.source)
+
+    def test_serialize(self):
+        self.assertEqual(self.resource.serialize(), self.source)
+        self.assertEqual(self.resource.checksum(), Resource(source=self.source).checksum())
+        self.assertIsNotNone(self.resource._raw)
+
+    def test_materialize(self):
+        self.assertEqual(self.resource.path, '/lazy')
+        self.assertIsNotNone(self.resource._raw)
+        self.assertEqual(self.resource.content, 'Hello')
+        self.assertIsNone(self.resource._raw)
+        self.assertEqual(self.resource.serialize(), self.source)
+
+    def test_materialize_twice(self):
+        # As when two readers both saw it unbuilt
+        self.resource._materialize()
+        self.resource._materialize()
+        self.assertEqual(self.resource.content, 'Hello')
+
+    def test_set(self):
+        self.resource.comment = 'Changed'
+        self.assertEqual(self.resource.type, 'text/plain')
+        self.assertEqual(self.resource.comment, 'Changed')
+
+    def test_clone(self):
+        self.resource.path = '/moved'
+        clone = self.resource.clone()
+        self.assertIsNotNone(clone._raw)
+        self.assertEqual(clone.path, '/moved')
+        self.assertEqual(clone.content, 'Hello')
+
+    def test_invalid_type(self):
+        self.source['type'] = 'invalid/type'
+        resource = Resource.lazy(self.source)
+        self.assertRaises(ValueError, getattr, resource, 'type')
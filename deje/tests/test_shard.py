@@ -0,0 +1,208 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import
+
+try:
+   from Queue import Queue
+except:
+   from queue import Queue
+
+from ejtp.util.compat    import unittest
+from ejtp.router         import Router
+
+from deje.shard          import ShardRouter, LocalShard, ProcessShard, shard_index
+from deje.owner          import Owner
+from deje.document       import Document
+from deje.event          import Event
+from deje.resource       import Resource
+from deje.handlers       import handler_resource
+from deje.tests.identity import identity
+
+def tag_team_document(name):
+    doc = Document(name)
+    doc.add_resource(handler_resource("tag_team"), False)
+    doc.freeze()
+    return doc
+
+class TestShardIndex(unittest.TestCase):
+
+    def test_stable(self):
+        self.assertEqual(
+            shard_index("example", 4),
+            shard_index("example", 4)
+        )
+
+    def test_range(self):
+        for i in range(50):
+            self.assertIn(shard_index("doc%d" % i, 3), range(3))
+
+    def test_bad_count(self):
+        self.assertRaises(ValueError, shard_index, "example", 0)
+
+class TestShardRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.mitzi  = ShardRouter(identity("mitzi"), 3, self.router)
+        self.victor = Owner(identity("victor"), self.router)
+        self.mitzi.identities.sync(self.victor.identities)
+
+        self.names = ["doc%d" % i for i in range(6)]
+        for name in self.names:
+            self.mitzi.own_document(tag_team_document(name))
+
+    def test_init(self):
+        self.assertEqual(len(self.mitzi.shards), 3)
+        for shard in self.mitzi.shards:
+            self.assertIsInstance(shard, LocalShard)
+            self.assertEqual(shard.owner.identity, self.mitzi.identity)
+            self.assertEqual(shard.owner.identities, self.mitzi.identities)
+
+    def test_own_document(self):
+        for name in self.names:
+            for shard in self.mitzi.shards:
+                if shard is self.mitzi.shard_for(name):
+                    self.assertIn(name, shard.owner.documents)
+                else:
+                    self.assertNotIn(name, shard.owner.documents)
+
+    def test_dispatch(self):
+        returned = Queue()
+        for name in self.names:
+            vdoc = tag_team_document(name)
+            self.victor.own_document(vdoc)
+            self.victor.protocol.subscribe(
+                vdoc,
+                returned.put,
+                [self.mitzi.identity]
+            )
+            sub = returned.get(timeout=0.1)
+            self.assertEqual(sub.doc, name)
+
+            subs = self.mitzi.shard_for(name).owner.protocol.find('deje-sub')
+            self.assertIn(sub.hash(), subs.subscriptions)
+
+    def subscribe_all(self):
+        returned = Queue()
+        subs = []
+        for name in self.names:
+            vdoc = tag_team_document(name)
+            self.victor.own_document(vdoc)
+            self.victor.protocol.subscribe(
+                vdoc,
+                returned.put,
+                [self.mitzi.identity]
+            )
+            subs.append(returned.get(timeout=0.1))
+        return subs
+
+    def test_sub_list(self):
+        subs = self.subscribe_all()
+        expected = dict((s.hash().export(), s) for s in subs)
+        returned = Queue()
+        self.victor.protocol.get_subs(self.mitzi.identity, returned.put)
+        self.assertEqual(returned.get(timeout=0.1), expected)
+
+        # Only some of them, from whichever shards hold them
+        wanted = [s.hash().export() for s in subs[:2]]
+        self.victor.protocol.find('deje-sub-list').get_subs(
+            self.mitzi.identity,
+            returned.put,
+            wanted
+        )
+        self.assertEqual(sorted(returned.get(timeout=0.1)), sorted(wanted))
+
+    def test_history(self):
+        doc = Document("history")
+        doc.add_resource(handler_resource("tag_team"), False)
+        doc.add_resource(Resource('/example', 'Hello'), False)
+        doc.freeze()
+        events = []
+        for value in ('one', 'two', 'three'):
+            event = Event({
+                'path':'/example',
+                'property':'content',
+                'value':value,
+            }, self.mitzi.identity, doc.version)
+            event.enact(None, doc)
+            events.append(event)
+        self.mitzi.own_document(doc)
+
+        self.victor.identities.update_ident(identity("atlas"))
+        vdoc = tag_team_document("history")
+        self.victor.own_document(vdoc)
+        returned = Queue()
+        self.victor.get_events(vdoc, returned.put,
+            events[0].hash(), events[-1].hash())
+        self.assertEqual(
+            [event['content']['value'] for event in returned.get(timeout=1)],
+            ['one', 'two', 'three']
+        )
+
+        returned = Queue()
+        self.victor.get_state(vdoc, events[-1].hash(), returned.put)
+        state = returned.get(timeout=1)
+        self.assertEqual(state['resources']['/example']['content'], 'three')
+
+    def test_response_routing(self):
+        returned = Queue()
+        for shard in self.mitzi.shards:
+            shard.owner.protocol.get_subs(
+                self.victor.identity,
+                lambda subs, shard=shard: returned.put(shard)
+            )
+            self.assertIs(returned.get(timeout=0.1), shard)
+
+class TestShardRouterProcesses(TestShardRouter):
+
+    def setUp(self):
+        self.router = Router()
+        self.mitzi  = ShardRouter(identity("mitzi"), 2, self.router, processes=True)
+        self.victor = Owner(identity("victor"), self.router)
+        self.mitzi.identities.sync(self.victor.identities)
+        self.mitzi.update_ident(self.victor.identity)
+
+        self.names = ["doc%d" % i for i in range(4)]
+        for name in self.names:
+            self.mitzi.own_document(tag_team_document(name))
+
+    def tearDown(self):
+        self.mitzi.stop()
+
+    def test_init(self):
+        self.assertEqual(len(self.mitzi.shards), 2)
+        for shard in self.mitzi.shards:
+            self.assertIsInstance(shard, ProcessShard)
+            self.assertTrue(shard.process.is_alive())
+
+    def test_own_document(self):
+        pass # Documents live in the worker processes
+
+    def test_dispatch(self):
+        subs = self.subscribe_all()
+        self.assertEqual([s.doc for s in subs], self.names)
+
+    def test_response_routing(self):
+        pass # Worker owners can't be driven from here
+
+    def test_dead_worker(self):
+        shard = self.mitzi.shards[0]
+        shard.process.terminate()
+        shard.process.join()
+        self.assertRaises(RuntimeError, shard.list_subs, self.victor.identity.location, None)
+        self.assertRaises(RuntimeError, shard.deliver, None)
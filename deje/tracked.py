@@ -0,0 +1,172 @@
+'''
+This file is part of python-libdeje.
+
+python-libdeje is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+python-libdeje is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with python-libdeje.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import weakref
+
+def track(value, root=None):
+    '''
+    Deep copy of JSON-style data, with dicts and lists replaced by
+    TrackedDict and TrackedList. Anything else is returned as-is.
+
+    Without a root, the copy is its own root, which watchers can be
+    added to.
+    '''
+    if isinstance(value, dict):
+        result = TrackedDict()
+    elif isinstance(value, list):
+        result = TrackedList()
+    else:
+        return value
+    if root is None:
+        root = result
+        result._watchers = weakref.WeakSet()
+    result._root = root
+    if isinstance(result, dict):
+        for key in value:
+            dict.__setitem__(result, key, track(value[key], root))
+    else:
+        list.extend(result, [track(item, root) for item in value])
+    return result
+
+def untrack(value):
+    '''
+    Plain deep copy of JSON-style data, tracked or not.
+    '''
+    if isinstance(value, dict):
+        return dict((key, untrack(value[key])) for key in value)
+    elif isinstance(value, list):
+        return [untrack(item) for item in value]
+    return value
+
+class Tracked(object):
+    '''
+    Container that tells its root's watchers whenever it, or anything in
+    it, changes. Whatever is put in is tracked too, as a copy.
+
+    Copying or pickling gives back plain dicts and lists.
+    '''
+    exposed = False # Set on roots that have been handed out to be changed
+
+    def watch(self, watcher):
+        '''
+        Call watcher.content_edited() on every change, for as long as the
+        watcher is alive. Only works on a root.
+        '''
+        self._watchers.add(watcher)
+
+    def _track(self, value):
+        return track(value, self._root)
+
+    def _changed(self):
+        for watcher in list(self._root._watchers):
+            watcher.content_edited()
+
+    def __reduce__(self):
+        return (type(self).__bases__[0], (untrack(self),))
+
+class TrackedDict(dict, Tracked):
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, self._track(value))
+        self._changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self._changed()
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, self._track(value))
+        self._changed()
+
+class TrackedList(list, Tracked):
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [self._track(item) for item in value]
+        else:
+            value = self._track(value)
+        list.__setitem__(self, index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    # Python 2 slicing
+    def __setslice__(self, i, j, values):
+        self.__setitem__(slice(i, j), values)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(i, j))
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, count):
+        list.__imul__(self, count)
+        self._changed()
+        return self
+
+    def append(self, value):
+        list.append(self, self._track(value))
+        self._changed()
+
+    def extend(self, values):
+        list.extend(self, [self._track(item) for item in values])
+        self._changed()
+
+    def insert(self, index, value):
+        list.insert(self, index, self._track(value))
+        self._changed()
+
+    def pop(self, *args):
+        result = list.pop(self, *args)
+        self._changed()
+        return result
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._changed()
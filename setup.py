@@ -14,6 +14,7 @@ setup(
     ],
 	packages = [
 		'deje',
+		'deje.benchmarks',
 		'deje.dexter',
 		'deje.dexter.commands',
 		'deje.protocol',